@@ -0,0 +1,81 @@
+"""
+Micro-benchmark for is_excluded: the compiled GlobMatcher against the
+previous loop of one glob.globmatch call per pattern.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_is_excluded [root_path] [--limit N]
+"""
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+from wcmatch import glob
+
+from ccontext.file_system import GlobMatcher, is_excluded
+
+CONFIG_PATH = Path(__file__).resolve().parent.parent / "ccontext" / "config.json"
+
+
+def legacy_is_excluded(path: str, excludes: list, includes: list) -> bool:
+    """is_excluded as it was before GlobMatcher, without gitignore rules."""
+    normalized_path = Path(path).as_posix()
+    if any(
+        glob.globmatch(normalized_path, pattern, flags=glob.GLOBSTAR)
+        for pattern in includes
+    ):
+        return False
+    return any(
+        glob.globmatch(normalized_path, pattern, flags=glob.GLOBSTAR)
+        for pattern in excludes
+    )
+
+
+def collect_paths(root_path: str, limit: int) -> list:
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root_path):
+        for name in dirnames + filenames:
+            paths.append(os.path.relpath(os.path.join(dirpath, name), root_path))
+            if len(paths) >= limit:
+                return paths
+    return paths
+
+
+def timed(fn, paths) -> tuple:
+    start = time.perf_counter()
+    results = [fn(path) for path in paths]
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("root_path", nargs="?", default=os.getcwd())
+    parser.add_argument("--limit", type=int, default=20000)
+    args = parser.parse_args()
+
+    with open(CONFIG_PATH) as f:
+        excludes = json.load(f)["excluded_folders_files"]
+    includes = []
+    paths = collect_paths(args.root_path, args.limit)
+
+    legacy_time, legacy = timed(
+        lambda p: legacy_is_excluded(p, excludes, includes), paths
+    )
+    matcher_excludes, matcher_includes = GlobMatcher(excludes), GlobMatcher(includes)
+    compiled_time, compiled = timed(
+        lambda p: is_excluded(p, matcher_excludes, matcher_includes), paths
+    )
+
+    if legacy != compiled:
+        raise SystemExit("Mismatch between legacy and compiled matcher results")
+
+    print(f"{len(paths)} paths, {len(excludes)} exclude patterns")
+    print(f"globmatch loop:  {legacy_time * 1000:9.1f} ms")
+    print(f"GlobMatcher:     {compiled_time * 1000:9.1f} ms")
+    print(f"speedup:         {legacy_time / compiled_time:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
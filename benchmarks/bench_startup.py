@@ -0,0 +1,82 @@
+"""
+Startup benchmark: the import time of the CLI entry points, parsed from
+python -X importtime, and a check that heavy optional subsystems are not
+imported on the default path.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_startup [--runs N] [--top N] [--max-ms MS]
+
+Exits with status 1 if a forbidden module is imported or the median
+import time of ccontext.cli (what `ccontext --help` loads) exceeds --max-ms.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Entry points timed, from the cheapest to the full pipeline
+MODULES = ("ccontext.cli", "ccontext.main")
+
+# Only imported for --generate-pdf, --generate-md, --crawl or PDF/DOCX files
+FORBIDDEN = ("reportlab", "pypdf", "mammoth", "ccontext.run_crawlers")
+
+
+def import_times(module: str) -> Dict[str, Tuple[int, int]]:
+    """Imports module in a fresh interpreter; maps each module to (self, cumulative) us."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            continue  # The header line
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=100.0)
+    args = parser.parse_args()
+
+    failures: List[str] = []
+    for module in MODULES:
+        runs = [import_times(module) for _ in range(args.runs)]
+        median_ms = statistics.median(run[module][1] for run in runs) / 1000
+        print(f"{module}: {median_ms:.1f} ms (median of {args.runs})")
+
+        last = runs[-1]
+        heaviest = sorted(last.items(), key=lambda item: item[1][0], reverse=True)
+        for name, (self_us, cumulative_us) in heaviest[: args.top]:
+            print(
+                f"  {self_us / 1000:7.1f} ms self {cumulative_us / 1000:7.1f} ms cumulative  {name}"
+            )
+
+        imported = [
+            name
+            for name in last
+            if any(name == f or name.startswith(f + ".") for f in FORBIDDEN)
+        ]
+        if imported:
+            failures.append(f"{module} imports {', '.join(sorted(imported)[:5])}")
+        if module == MODULES[0] and median_ms > args.max_ms:
+            failures.append(f"{module} takes {median_ms:.1f} ms, over {args.max_ms} ms")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
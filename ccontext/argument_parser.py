@@ -3,9 +3,11 @@ import sys
 from colorama import Fore, Style
 import os
 
+from ccontext.chunk_planner import CHUNK_STRATEGIES
 
-def parse_arguments():
-    """Parse command-line arguments."""
+
+def parse_arguments(argv=None):
+    """Parse command-line arguments, from sys.argv unless argv is given."""
     parser = argparse.ArgumentParser(
         description="A script to display a directory structure and file contents with chunking if needed."
     )
@@ -68,13 +70,76 @@ def parse_arguments():
         action="store_true",
         help="Generate a Markdown file of the directory tree and file contents.",
     )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help='Write the output to this file instead of the clipboard, or to stdout with "-" (diagnostics then go to stderr). Chunks are written to numbered files.',
+    )
+    parser.add_argument(
+        "--git-index",
+        action="store_true",
+        help="List files with git ls-files instead of walking the directory (falls back to the walk outside a git work tree).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not read or update the token count and output caches in ~/.ccontext.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Read and tokenize files in this many worker processes (for very large repositories).",
+    )
+    parser.add_argument(
+        "--estimate",
+        action="store_true",
+        help="Only show the file tree with token estimates from file sizes, without reading files or generating output.",
+    )
+    parser.add_argument(
+        "--verify-tokens",
+        action="store_true",
+        help="Check the summed token counts against a full encode of the output.",
+    )
+    parser.add_argument(
+        "--chunk-strategy",
+        choices=CHUNK_STRATEGIES,
+        help="How files are packed into chunks: sequential (file order), ffd (first-fit decreasing, never more chunks than sequential) or locality (keeps directories together).",
+    )
+    parser.add_argument(
+        "--top-dirs",
+        type=int,
+        metavar="N",
+        help="After the file tree, list the N directories whose files cost the most tokens.",
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        metavar="N",
+        help="Only expand directories down to depth N in the file tree (0 expands all).",
+    )
+    parser.add_argument(
+        "--max-children",
+        type=int,
+        metavar="N",
+        help="Show only the N costliest entries of wider directories in the file tree, with one line totalling the rest (0 shows all).",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and emit the context again whenever files change.",
+    )
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="Run in this process even if a ccontext daemon is running.",
+    )
     parser.add_argument(
         "--crawl",
         action="store_true",
         help="Crawls according to the urls_to_crawl set in the config.json",
     )
 
-    args, unknown = parser.parse_known_args()
+    args, unknown = parser.parse_known_args(argv)
     if unknown:
         print(f"{Fore.RED}Unrecognized arguments: {' '.join(unknown)}{Fore.RESET}")
         parser.print_help()
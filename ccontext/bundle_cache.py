@@ -0,0 +1,261 @@
+# ccontext/bundle_cache.py
+import contextlib
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from colorama import Fore, Style
+
+from ccontext.configurator import USER_CONFIG_DIR
+from ccontext.file_node import FileNode
+from ccontext.file_tree import walk_tree
+from ccontext.token_ledger import TokenLedger
+
+BUNDLE_CACHE_DIR = USER_CONFIG_DIR / "bundles"
+DEFAULT_MAX_BUNDLES = 16
+
+# Bumped whenever the stored layout or the rendered output changes
+BUNDLE_FORMAT = 2
+
+
+def settings_key(root_path: str, settings: dict) -> str:
+    """Hashes the root and the effective settings that shape its rendered output."""
+    encoded = json.dumps(
+        [BUNDLE_FORMAT, root_path, settings], sort_keys=True, default=list
+    )
+    return hashlib.sha256(encoded.encode("utf-8", "surrogateescape")).hexdigest()
+
+
+class BundleCache:
+    """
+    The rendered output of the last run for one root and effective config,
+    stored under ~/.ccontext/bundles with the Merkle fingerprints of the
+    tree it was rendered from (see TreeListing.fingerprints). Only file
+    metadata is stored; contents are read again from the files themselves.
+
+    The root fingerprint is kept in a small file of its own. When it is
+    unchanged, the stored console output, initial content and token ledger
+    are emitted as they are, and no file is read before its section is
+    output. Otherwise, directories whose fingerprint is unchanged are taken
+    from the stored tree instead of being read again (see reuse_directory).
+    """
+
+    def __init__(
+        self,
+        root_path: str,
+        settings: dict,
+        cache_dir: Path = BUNDLE_CACHE_DIR,
+        max_bundles: int = DEFAULT_MAX_BUNDLES,
+    ):
+        self.root_path = root_path
+        self.cache_dir = Path(cache_dir)
+        self.max_bundles = max_bundles
+        key = settings_key(root_path, settings)[:32]
+        self.path = self.cache_dir / f"{key}.json"
+        self.root_fingerprint_path = self.cache_dir / f"{key}.root"
+        # Filled in by build_file_tree before reuse_directory is called
+        self.fingerprints: Dict[str, str] = {}
+        self.hit = False  # Whether the whole tree was taken from the bundle
+        self.stored: Optional[dict] = None
+        self._loaded = False
+        self._records: Optional[Dict[str, int]] = None  # Path -> stored record
+
+    @property
+    def console(self) -> List[str]:
+        """What the stored run printed before its output: the tree and reports."""
+        return self.stored["console"]
+
+    @property
+    def initial_content(self) -> str:
+        return self.stored["initial_content"]
+
+    def ledger(self) -> TokenLedger:
+        ledger = TokenLedger()
+        for label, tokens in self.stored["ledger"]:
+            ledger.add(label, tokens)
+        return ledger
+
+    def reuse_directory(self, relative_dir: str) -> Optional[FileNode]:
+        """
+        The stored node of relative_dir if nothing below it changed, for
+        build_file_tree's reuse_directory. Reusing the root is a hit.
+        """
+        fingerprint = self.fingerprints.get(relative_dir)
+        if fingerprint is None:
+            return None
+        if relative_dir == ".":
+            # Most runs are decided here, without loading the bundle
+            try:
+                stored_root = self.root_fingerprint_path.read_text("ascii")
+            except (OSError, ValueError):
+                return None
+            if stored_root.strip() != fingerprint:
+                return None
+        if not self._load():
+            return None
+        if self.stored["fingerprints"].get(relative_dir) != fingerprint:
+            return None
+        if self._records is None:
+            self._records = {
+                path: index for index, path in enumerate(self._record_paths())
+            }
+        index = self._records.get(relative_dir)
+        if index is None:
+            return None
+        if relative_dir == ".":
+            self.hit = True
+            os.utime(self.path)  # Most recently used, for eviction
+        return self._restore(index, relative_dir)
+
+    def _load(self) -> bool:
+        """Loads the stored bundle once. Returns whether there is a usable one."""
+        if not self._loaded:
+            self._loaded = True
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.stored = json.load(f)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                print(f"{Fore.YELLOW}Ignoring bundle {self.path}: {e}{Style.RESET_ALL}")
+            if self.stored is not None and self.stored.get("format") != BUNDLE_FORMAT:
+                self.stored = None
+        return self.stored is not None
+
+    def _record_paths(self):
+        """The relative path of each stored record, in order."""
+        directories = []  # Path of the directory at each depth
+        for depth, name, *_ in self.stored["tree"]:
+            del directories[depth:]
+            if depth == 0:
+                path = "."
+            elif depth == 1:
+                path = name
+            else:
+                path = os.path.join(directories[-1], name)
+            directories.append(path)
+            yield path
+
+    def _restore(self, index: int, path: str) -> FileNode:
+        """Rebuilds the stored node at index, found at path, and everything below it."""
+        records = self.stored["tree"]
+        base_depth = records[index][0]
+        parents: List[FileNode] = []
+        root = None
+        for record in records[index:]:
+            depth = record[0]
+            if root is not None and depth <= base_depth:
+                break
+            del parents[depth - base_depth :]
+            if parents:
+                parent_path = parents[-1].path
+                path = (
+                    record[1]
+                    if parent_path == "."
+                    else os.path.join(parent_path, record[1])
+                )
+            node = _node_from_record(record, path, self.root_path)
+            if parents:
+                parents[-1].add_child(node)
+            else:
+                root = node
+            parents.append(node)
+        return root
+
+    def store(
+        self,
+        root_node: FileNode,
+        console: List[str],
+        initial_content: str,
+        ledger: TokenLedger,
+    ):
+        """Stores the rendered output of root_node for the next run."""
+        bundle = {
+            "format": BUNDLE_FORMAT,
+            "fingerprints": self.fingerprints,
+            "console": console,
+            "initial_content": initial_content,
+            "ledger": ledger.entries,
+            "tree": [_node_record(depth, node) for depth, node in walk_tree(root_node)],
+        }
+        try:
+            self.cache_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+            _write_private(self.path, json.dumps(bundle))
+            # Written last, so a matching root fingerprint implies the bundle
+            _write_private(self.root_fingerprint_path, self.fingerprints.get(".", ""))
+            self._evict()
+        except (OSError, ValueError) as e:
+            print(f"{Fore.YELLOW}Could not store bundle: {e}{Style.RESET_ALL}")
+
+    def _evict(self):
+        """Removes the least recently used bundles beyond max_bundles."""
+        bundles = sorted(
+            self.cache_dir.glob("*.json"),
+            key=lambda path: path.stat().st_mtime,
+            reverse=True,
+        )
+        for path in bundles[self.max_bundles :]:
+            for stale_path in (path.with_suffix(".root"), path):
+                with contextlib.suppress(OSError):
+                    stale_path.unlink()
+
+
+def _write_private(path: Path, text: str):
+    """Replaces path with text, in a file only the user can read."""
+    temporary_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(temporary_path)  # Left over by a run that crashed
+    descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        with open(descriptor, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temporary_path, path)  # Readers never see half a file
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(temporary_path)
+        raise
+
+
+def _node_record(depth: int, node: FileNode) -> list:
+    """A node as a flat record: depth, name, excluded, then file metadata."""
+    if node.node_type == "directory":
+        return [depth, node.name, node.excluded]
+    mtime_ns = node.source_version[1] if node.source_version else None
+    return [
+        depth,
+        node.name,
+        node.excluded,
+        node.is_binary,
+        node.tokens,
+        node.size,
+        node.encoding,
+        node.content_length,
+        mtime_ns,
+    ]
+
+
+def _node_from_record(record: list, path: str, root_path: str) -> FileNode:
+    if len(record) == 3:
+        _, name, excluded = record
+        return FileNode(name, path, "directory", excluded)
+    _, name, excluded, is_binary, tokens, size, encoding, content_length, mtime_ns = (
+        record
+    )
+    node = FileNode(name, path, "file", excluded)
+    node.set_file_info(size, is_binary, encoding)
+    source_path = root_path if path == "." else os.path.join(root_path, path)
+    if encoding:
+        # Unchanged on disk, so read again from there once it is output
+        node.set_tokens_and_source(
+            tokens, content_length, source_path, (size, mtime_ns)
+        )
+    elif content_length:
+        # Uploadable files are only referenced
+        node.set_tokens_and_content(
+            tokens, f"<file>{os.path.abspath(source_path)}</file>"
+        )
+    else:
+        node.tokens = tokens
+    return node
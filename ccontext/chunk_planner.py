@@ -0,0 +1,230 @@
+# ccontext/chunk_planner.py
+import os
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from ccontext import tokenizer
+from ccontext.tokenizer import JOIN_TOKENS, split_on_token_boundaries
+
+CHUNK_STRATEGIES = ("sequential", "ffd", "locality")
+
+# Directories listed per chunk in the manifest
+MANIFEST_DIRECTORIES = 3
+
+
+class ChunkItem(NamedTuple):
+    """A piece of the output, or one part of a piece too large for any chunk."""
+
+    piece: int  # Index of the piece in the output
+    tokens: int
+    part: int = 0  # Position of the part within its piece
+    text: Optional[str] = None  # Text of the part, None for a whole piece
+
+
+class Chunk:
+    """The items planned into one chunk, with their total token cost."""
+
+    def __init__(self):
+        self.items: List[ChunkItem] = []
+        self.tokens = 0
+
+    def cost(self, items: Sequence[ChunkItem]) -> int:
+        """Tokens the items add to this chunk, including a join before each."""
+        joins = len(items) if self.items else len(items) - 1
+        return sum(item.tokens for item in items) + joins * JOIN_TOKENS
+
+    def add(self, items: Sequence[ChunkItem]):
+        self.tokens += self.cost(items)
+        self.items.extend(items)
+
+    def sort(self):
+        """Puts the items back in output order."""
+        self.items.sort(key=lambda item: (item.piece, item.part))
+
+    def materialize(self, piece_text: Callable[[int], str]) -> str:
+        """Assembles the text of this chunk only."""
+        return "".join(
+            piece_text(item.piece) if item.text is None else item.text
+            for item in self.items
+        ).strip()
+
+
+def chunk_capacity(max_tokens: int, overhead_tokens: int = 0) -> int:
+    """Tokens available for content in each chunk, after the buffer and overhead."""
+    buffer_tokens = int(max_tokens * tokenizer.BUFFER_SIZE)
+    capacity = max_tokens - buffer_tokens - overhead_tokens
+    if capacity <= JOIN_TOKENS:
+        raise ValueError(
+            f"max_tokens {max_tokens} leaves no room for content after the "
+            f"{buffer_tokens} buffer and {overhead_tokens} overhead tokens"
+        )
+    return capacity
+
+
+def plan_chunks(
+    piece_tokens: Sequence[int],
+    capacity: int,
+    strategy: str = "sequential",
+    groups: Optional[Sequence[str]] = None,
+    piece_text: Optional[Callable[[int], str]] = None,
+    keep_last: bool = False,
+) -> List[Chunk]:
+    """
+    Plans which pieces go into which chunk from their token counts alone.
+
+    - sequential: fills chunks in output order, like chunk_text.
+    - ffd: first-fit decreasing, or the sequential plan when that needs
+      fewer chunks, so it never needs more chunks than sequential.
+    - locality: first-fit decreasing over groups (such as the directory of
+      each file), so pieces of a group stay together when the group fits
+      in a chunk.
+
+    Within a chunk, pieces keep their output order, and chunks are ordered
+    by their first piece. Pieces larger than capacity are cut with
+    piece_text on token boundaries; without piece_text they get a chunk of
+    their own. With keep_last, the last piece (such as an end marker) stays
+    at the end of the last chunk.
+    """
+    if strategy not in CHUNK_STRATEGIES:
+        raise ValueError(f"Unknown chunk strategy: {strategy}")
+    if strategy == "sequential":
+        return _plan_sequential(piece_tokens, capacity, piece_text)
+
+    indices = list(range(len(piece_tokens)))
+    last = indices.pop() if keep_last and indices else None
+    packing_capacity = capacity
+    if last is not None:
+        # Leave room for the last piece in whichever chunk ends up last
+        packing_capacity -= piece_tokens[last] + JOIN_TOKENS
+    if strategy == "ffd":
+        units = [
+            _split_oversized(i, piece_tokens, packing_capacity, piece_text)
+            for i in indices
+        ]
+        units = [[item] for items in units for item in items]
+    else:
+        units = _group_units(
+            indices, piece_tokens, packing_capacity, groups, piece_text
+        )
+
+    chunks: List[Chunk] = []
+    for unit in sorted(units, key=lambda items: Chunk().cost(items), reverse=True):
+        for chunk in chunks:
+            if chunk.tokens + chunk.cost(unit) <= packing_capacity:
+                chunk.add(unit)
+                break
+        else:
+            chunk = Chunk()
+            chunk.add(unit)
+            chunks.append(chunk)
+
+    for chunk in chunks:
+        chunk.sort()
+    chunks.sort(key=lambda chunk: (chunk.items[0].piece, chunk.items[0].part))
+
+    if last is not None:
+        if not chunks:
+            chunks.append(Chunk())
+        chunks[-1].add([ChunkItem(last, piece_tokens[last])])
+    if strategy == "ffd":
+        # Decreasing order usually packs tighter, but not always, such as when
+        # cut pieces fill the rest of a chunk in order
+        sequential = _plan_sequential(piece_tokens, capacity, piece_text)
+        if len(sequential) <= len(chunks):
+            return sequential
+    return chunks
+
+
+def _plan_sequential(
+    piece_tokens: Sequence[int],
+    capacity: int,
+    piece_text: Optional[Callable[[int], str]],
+) -> List[Chunk]:
+    chunks = [Chunk()]
+
+    def add(item: ChunkItem):
+        if chunks[-1].items and chunks[-1].tokens + chunks[-1].cost([item]) > capacity:
+            chunks.append(Chunk())
+        chunks[-1].add([item])
+
+    for index, tokens in enumerate(piece_tokens):
+        if tokens <= capacity or piece_text is None:
+            add(ChunkItem(index, tokens))
+            continue
+        # Fill the current chunk, then whole chunks
+        room = capacity - chunks[-1].tokens - 2 * JOIN_TOKENS
+        for item in _split_oversized(index, piece_tokens, capacity, piece_text, room):
+            add(item)
+
+    return [chunk for chunk in chunks if chunk.items]
+
+
+def _split_oversized(
+    index: int,
+    piece_tokens: Sequence[int],
+    capacity: int,
+    piece_text: Optional[Callable[[int], str]],
+    first_size: Optional[int] = None,
+) -> List[ChunkItem]:
+    """Cuts a piece larger than capacity into parts that fit."""
+    tokens = piece_tokens[index]
+    if tokens <= capacity or piece_text is None:
+        return [ChunkItem(index, tokens)]
+    # A merge across the join with the neighbouring item can change the
+    # count, so parts are cut one token short and budgeted one token more
+    parts = split_on_token_boundaries(
+        piece_text(index), capacity - JOIN_TOKENS, first_size=first_size
+    )
+    return [
+        ChunkItem(index, part_tokens + JOIN_TOKENS, part, text)
+        for part, (text, part_tokens) in enumerate(parts)
+    ]
+
+
+def _group_units(
+    indices: List[int],
+    piece_tokens: Sequence[int],
+    capacity: int,
+    groups: Optional[Sequence[str]],
+    piece_text: Optional[Callable[[int], str]],
+) -> List[List[ChunkItem]]:
+    """
+    Gathers the items of each group, in output order, into units that are
+    packed together. A group too large for one chunk is cut into runs that
+    each fill a chunk.
+    """
+    grouped: Dict[str, List[ChunkItem]] = {}
+    for index in indices:
+        group = groups[index] if groups else ""
+        items = _split_oversized(index, piece_tokens, capacity, piece_text)
+        grouped.setdefault(group, []).extend(items)
+
+    units = []
+    for items in grouped.values():
+        run = Chunk()
+        for item in items:
+            if run.items and run.tokens + run.cost([item]) > capacity:
+                units.append(run.items)
+                run = Chunk()
+            run.add([item])
+        units.append(run.items)
+    return units
+
+
+def format_chunk_manifest(chunks: List[Chunk], labels: Sequence[str]) -> str:
+    """
+    Describes each chunk before any of its text is assembled: its tokens,
+    the number of pieces and the directories they come from.
+    """
+    lines = []
+    for number, chunk in enumerate(chunks, start=1):
+        pieces = list(dict.fromkeys(item.piece for item in chunk.items))
+        directories = list(
+            dict.fromkeys(os.path.dirname(labels[piece]) or "." for piece in pieces)
+        )
+        shown = ", ".join(directories[:MANIFEST_DIRECTORIES])
+        if len(directories) > MANIFEST_DIRECTORIES:
+            shown += f", +{len(directories) - MANIFEST_DIRECTORIES} more"
+        lines.append(
+            f"Chunk {number}: {chunk.tokens} tokens, {len(pieces)} pieces ({shown})"
+        )
+    return "\n".join(lines)
@@ -1,10 +1,11 @@
+import sys
+
 from ccontext.argument_parser import parse_arguments
-from ccontext.main import main as actual_main
 
 
-def main():
-    args = parse_arguments()
-    actual_main(
+def main_arguments(args) -> dict:
+    """Maps the parsed command-line arguments to the keyword arguments of main."""
+    return dict(
         root_path=args.root_path,
         excludes=args.excludes,
         includes=args.includes,
@@ -15,4 +16,37 @@ def main():
         generate_pdf_flag=args.generate_pdf,
         generate_md_flag=args.generate_md,
         crawl=args.crawl,
+        use_git_index=args.git_index,
+        use_token_cache=not args.no_cache,
+        workers=args.workers,
+        estimate=args.estimate,
+        verify_tokens=args.verify_tokens,
+        chunk_strategy=args.chunk_strategy,
+        output=args.output,
+        top_dirs=args.top_dirs,
+        max_depth=args.max_depth,
+        max_children=args.max_children,
+        watch=args.watch,
     )
+
+
+def main():
+    if sys.argv[1:2] == ["daemon"]:
+        from ccontext.daemon import daemon_command
+
+        sys.exit(daemon_command(sys.argv[2:]))
+
+    args = parse_arguments()
+    # A watch session runs until interrupted, it would hold the daemon up
+    if not args.no_daemon and not args.watch:
+        # A running daemon answers from its warm state
+        from ccontext.daemon import run_in_daemon
+
+        exit_code = run_in_daemon(sys.argv[1:])
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    # Imported after parsing, so --help does not load the whole pipeline
+    from ccontext.main import main as actual_main
+
+    actual_main(**main_arguments(args))
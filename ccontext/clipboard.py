@@ -1,11 +1,25 @@
 import os
 import platform
 import re
+import shutil
 import subprocess
 
 import pyperclip
 from colorama import Fore, Style
 
+FILE_PATTERN = re.compile(r"<file>(.*?)</file>")
+
+# Clipboard programs that read the text from stdin, tried in order. Other
+# platforms go through pyperclip.
+CLIPBOARD_COMMANDS = {
+    "Darwin": [["pbcopy"]],
+    "Linux": [
+        ["wl-copy"],
+        ["xclip", "-selection", "clipboard"],
+        ["xsel", "--clipboard", "--input"],
+    ],
+}
+
 
 def is_wsl2() -> bool:
     """Detect if running under WSL2."""
@@ -126,13 +140,9 @@ def copy_to_clipboard(text: str):
     Extracts file paths from <file> tags and copies them individually.
     Copies any remaining text to the clipboard with user confirmation between steps.
     """
-    file_pattern = r"<file>(.*?)</file>"
-
     # Extract file paths and non-file text
-    non_file_text = re.sub(file_pattern, "", text).strip()
-    file_paths = [
-        path for path in re.findall(file_pattern, text) if os.path.exists(path)
-    ]
+    non_file_text = FILE_PATTERN.sub("", text).strip()
+    file_paths = [path for path in FILE_PATTERN.findall(text) if os.path.exists(path)]
 
     # First step: Copy text content if present
     if non_file_text:
@@ -144,6 +154,11 @@ def copy_to_clipboard(text: str):
         except Exception as e:
             print(f"{Fore.RED}\nFailed to copy text to clipboard: {e}{Style.RESET_ALL}")
 
+    copy_file_references(file_paths)
+
+
+def copy_file_references(file_paths: list):
+    """Offers to copy the referenced binary files once the text is pasted."""
     if file_paths:
         print(
             f"\n{Fore.CYAN}Press Enter to copy binary file references to clipboard, or 'q' to skip: {Style.RESET_ALL}",
@@ -154,3 +169,94 @@ def copy_to_clipboard(text: str):
             copy_files_to_clipboard(file_paths)
         else:
             print(f"{Fore.YELLOW}File path copying skipped.{Style.RESET_ALL}")
+
+
+def _clipboard_command() -> list:
+    """Returns the first clipboard program available here, or None."""
+    system = platform.system()
+    if system == "Linux" and is_wsl2():
+        return None  # pyperclip knows how to reach the Windows clipboard
+    for command in CLIPBOARD_COMMANDS.get(system, []):
+        if command[0] == "wl-copy" and "WAYLAND_DISPLAY" not in os.environ:
+            continue
+        if command[0] in ("xclip", "xsel") and "DISPLAY" not in os.environ:
+            continue
+        if shutil.which(command[0]):
+            return command
+    return None
+
+
+class ClipboardSink:
+    """
+    Streams text into the stdin of the platform's clipboard program, so the
+    output is never held in memory as one string. <file> references are
+    taken out of each write and offered for copying once the text is in.
+    Falls back to collecting the text for pyperclip when no clipboard
+    program is available.
+    """
+
+    def __init__(self):
+        self.file_paths = []
+        self.buffer = None
+        self.process = None
+        self.error = None
+        command = _clipboard_command()
+        if command:
+            try:
+                self.process = subprocess.Popen(
+                    command,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.DEVNULL,
+                    env={**os.environ, "LC_CTYPE": "UTF-8"},
+                )
+            except OSError:
+                self.process = None
+        if self.process is None:
+            self.buffer = []
+
+    def write(self, text: str):
+        if "<file>" in text:
+            self.file_paths.extend(
+                path for path in FILE_PATTERN.findall(text) if os.path.exists(path)
+            )
+            text = FILE_PATTERN.sub("", text)
+        if self.buffer is not None:
+            self.buffer.append(text)
+            return
+        if self.error is None:
+            try:
+                self.process.stdin.write(text.encode("utf-8"))
+            except OSError as e:
+                self.error = e
+
+    def close(self):
+        try:
+            if self.buffer is not None:
+                text = "".join(self.buffer).strip()
+                self.buffer = []
+                if text:
+                    pyperclip.copy(text)
+            else:
+                try:
+                    self.process.stdin.close()
+                except OSError as e:
+                    self.error = self.error or e
+                if self.process.wait() != 0 and self.error is None:
+                    self.error = Exception(
+                        f"{self.process.args[0]} exited with status {self.process.returncode}"
+                    )
+                if self.error is not None:
+                    raise self.error
+            print(
+                f"{Fore.GREEN}\nText content copied to clipboard! Paste into LLM before proceeding.{Style.RESET_ALL}"
+            )
+        except Exception as e:
+            print(f"{Fore.RED}\nFailed to copy text to clipboard: {e}{Style.RESET_ALL}")
+
+        copy_file_references(self.file_paths)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,6 +1,11 @@
+import argparse
+import contextlib
+import json
 import os
 import shutil
+import threading
 from pathlib import Path
+from typing import Iterable, Optional
 
 try:
     from importlib import resources  # Python 3.7+
@@ -10,6 +15,13 @@ except ImportError:
 DEFAULT_CONFIG_FILENAME = "config.json"
 USER_CONFIG_DIR = Path.home() / ".ccontext"
 USER_CONFIG_PATH = USER_CONFIG_DIR / DEFAULT_CONFIG_FILENAME
+# Where ccontext-configure --prefetch-encodings stores tiktoken's BPE files
+ENCODING_CACHE_DIR = USER_CONFIG_DIR / "tiktoken"
+
+# Variables that choose tiktoken's cache directory, in its order of preference
+ENCODING_CACHE_VARIABLES = ("TIKTOKEN_CACHE_DIR", "DATA_GYM_CACHE_DIR")
+
+_encoding_cache_lock = threading.Lock()
 
 
 def copy_default_config():
@@ -32,5 +44,99 @@ def copy_default_config():
         print(f"Error copying default config: {e}")
 
 
-if __name__ == "__main__":
+def user_encoding_cache() -> Optional[str]:
+    """The cache directory the user chose for tiktoken, if any."""
+    for variable in ENCODING_CACHE_VARIABLES:
+        if variable in os.environ:
+            return os.environ[variable]
+    return None
+
+
+@contextlib.contextmanager
+def encoding_cache():
+    """
+    Points tiktoken's cache at ENCODING_CACHE_DIR within the block, unless
+    the user chose one, and yields the directory in use. The environment
+    is restored on exit, so nothing else in the process or its children
+    sees the change.
+    """
+    cache_dir = user_encoding_cache()
+    if cache_dir is not None:
+        yield cache_dir
+        return
+    with _encoding_cache_lock:
+        os.environ["TIKTOKEN_CACHE_DIR"] = str(ENCODING_CACHE_DIR)
+        try:
+            yield str(ENCODING_CACHE_DIR)
+        finally:
+            del os.environ["TIKTOKEN_CACHE_DIR"]
+
+
+def configured_model_type() -> str:
+    """The model_type of the user config, or of the default config."""
+    try:
+        if USER_CONFIG_PATH.exists():
+            with open(USER_CONFIG_PATH) as f:
+                return json.load(f).get("model_type", "gpt-4o")
+        with resources.path("ccontext", DEFAULT_CONFIG_FILENAME) as path:
+            with open(path) as f:
+                return json.load(f).get("model_type", "gpt-4o")
+    except (OSError, ValueError):
+        return "gpt-4o"
+
+
+def prefetch_encodings(models: Iterable[str], source: Optional[str] = None):
+    """
+    Stores the tiktoken encodings of models in the encoding cache, so later
+    runs never download them. With source, the cached files are copied from
+    that directory first (such as a copy of ~/.ccontext/tiktoken from a
+    machine with network access), which is all an air-gapped machine needs.
+    """
+    import tiktoken
+
+    with encoding_cache() as cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        if source:
+            shutil.copytree(source, cache_dir, dirs_exist_ok=True)
+            print(f"Copied encoding files from {source} to {cache_dir}")
+
+        for model in models:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except Exception as e:
+                print(f"Error loading the encoding for {model}: {e}")
+                continue
+            print(f"Encoding {encoding.name} for {model} is cached in {cache_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Set up the ccontext user config in ~/.ccontext."
+    )
+    parser.add_argument(
+        "--prefetch-encodings",
+        action="store_true",
+        help="Download the tokenizer encodings into ~/.ccontext/tiktoken, so runs work offline.",
+    )
+    parser.add_argument(
+        "--model",
+        action="append",
+        dest="models",
+        help="Model whose encoding is prefetched (repeatable, defaults to the configured model_type).",
+    )
+    parser.add_argument(
+        "--encodings-from",
+        metavar="DIR",
+        help="Copy already downloaded encoding files from DIR instead of downloading them.",
+    )
+    args = parser.parse_args()
+
     copy_default_config()
+    if args.prefetch_encodings or args.encodings_from:
+        prefetch_encodings(
+            args.models or [configured_model_type()], args.encodings_from
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,20 @@
 import os
 from ccontext.file_tree import (
+    TreeRow,
     format_file_tree,
     extract_file_contents,
+    render_tree_text,
     sum_file_tokens,
 )
 from ccontext.file_node import FileNode
-from typing import Tuple
+from typing import Optional, Sequence, Tuple
 
 
-def print_file_tree(root_node: FileNode, max_tokens: int) -> str:
+def print_file_tree(
+    root_node: FileNode, max_tokens: int, tree_rows: Optional[Sequence[TreeRow]] = None
+) -> str:
+    if tree_rows is not None:
+        return render_tree_text(tree_rows, max_tokens)
     return format_file_tree(root_node, max_tokens)
 
 
@@ -17,7 +23,11 @@ def gather_file_contents(root_node: FileNode, max_tokens: int) -> Tuple[list, in
 
 
 def combine_initial_content(
-    root_node: FileNode, root_path: str, context_prompt: str, max_tokens: int
+    root_node: FileNode,
+    root_path: str,
+    context_prompt: str,
+    max_tokens: int,
+    tree_rows: Optional[Sequence[TreeRow]] = None,
 ) -> str:
-    tree_output = print_file_tree(root_node, max_tokens)
+    tree_output = print_file_tree(root_node, max_tokens, tree_rows)
     return f"## {context_prompt}\n\n## Root Path: {root_path}\n\n{tree_output}"
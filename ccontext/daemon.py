@@ -0,0 +1,317 @@
+# ccontext/daemon.py
+import argparse
+import contextlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+from typing import List, Optional
+
+from colorama import Fore, Style
+
+from ccontext.configurator import USER_CONFIG_DIR
+
+SOCKET_PATH = USER_CONFIG_DIR / "daemon.sock"
+
+# Variables of the client's environment applied while serving its request,
+# so the clipboard and tokenizer behave as they would in the client
+CLIENT_ENVIRONMENT = (
+    "DISPLAY",
+    "WAYLAND_DISPLAY",
+    "XAUTHORITY",
+    "XDG_RUNTIME_DIR",
+    "TIKTOKEN_CACHE_DIR",
+    "DATA_GYM_CACHE_DIR",
+)
+
+# Seconds a client waits to connect before running in-process instead
+CONNECT_TIMEOUT = 1.0
+
+
+class _Connection:
+    """Newline-delimited JSON messages over a connected Unix socket."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.reader = sock.makefile("r", encoding="utf-8", newline="\n")
+        self.writer = sock.makefile("w", encoding="utf-8", newline="\n")
+        self.lock = threading.Lock()  # Walker threads print too
+
+    def send(self, **message):
+        line = json.dumps(message) + "\n"
+        with self.lock:
+            self.writer.write(line)
+            self.writer.flush()
+
+    def receive(self) -> Optional[dict]:
+        line = self.reader.readline()
+        return json.loads(line) if line else None
+
+    def close(self):
+        for stream in (self.reader, self.writer):
+            with contextlib.suppress(OSError):
+                stream.close()
+        self.sock.close()
+
+
+class _ClientStream:
+    """Stands in for stdout or stderr, forwarding everything to the client."""
+
+    closed = False
+
+    def __init__(self, connection: _Connection, name: str, isatty: bool):
+        self.connection = connection
+        self.name = name
+        self._isatty = isatty
+
+    def write(self, text: str) -> int:
+        if text:
+            self.connection.send(**{self.name: text})
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self) -> bool:
+        return self._isatty
+
+
+class _ClientInput:
+    """Stands in for stdin: each line is read on the client's terminal."""
+
+    def __init__(self, connection: _Connection):
+        self.connection = connection
+
+    def readline(self, *args) -> str:
+        self.connection.send(read=True)
+        reply = self.connection.receive()
+        if not reply or reply.get("line") is None:
+            raise EOFError
+        return reply["line"]
+
+
+@contextlib.contextmanager
+def _client_environment(request: dict):
+    """Runs with the client's working directory, environment and streams."""
+    connection = request["connection"]
+    saved_cwd = os.getcwd()
+    saved_env = {name: os.environ.get(name) for name in CLIENT_ENVIRONMENT}
+    saved_stdin = sys.stdin
+    try:
+        os.chdir(request["cwd"])
+        for name in CLIENT_ENVIRONMENT:
+            value = request["env"].get(name)
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        sys.stdin = _ClientInput(connection)
+        isatty = request.get("isatty", {})
+        with contextlib.redirect_stdout(
+            _ClientStream(connection, "stdout", isatty.get("stdout", False))
+        ), contextlib.redirect_stderr(
+            _ClientStream(connection, "stderr", isatty.get("stderr", False))
+        ):
+            yield
+    finally:
+        sys.stdin = saved_stdin
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        os.chdir(saved_cwd)
+
+
+def _run_request(request: dict) -> int:
+    """Runs one ccontext invocation for a client and returns its exit code."""
+    from ccontext.argument_parser import parse_arguments
+    from ccontext.cli import main_arguments
+    from ccontext.main import main
+
+    with _client_environment(request):
+        try:
+            args = parse_arguments(request["argv"])
+            main(**main_arguments(args), keep_warm=True)
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+        except (BrokenPipeError, ConnectionError):
+            raise  # The client went away, nothing to report to
+        except Exception:
+            traceback.print_exc()
+            return 1
+    return 0
+
+
+def serve(socket_path=SOCKET_PATH):
+    """
+    Serves ccontext requests on a Unix socket until stopped. Requests run
+    one at a time in this process, so imported modules, the loaded
+    encoding, the token caches and compiled glob matchers stay warm
+    between invocations.
+    """
+    socket_path = str(socket_path)
+    running = _connect(socket_path)
+    if running is not None:
+        running.close()
+        print(
+            f"{Fore.YELLOW}A ccontext daemon is already running on {socket_path}{Style.RESET_ALL}"
+        )
+        return 1
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(socket_path)  # Left behind by a daemon that did not stop cleanly
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)  # Only this user may connect
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    server.listen()
+    print(f"{Fore.GREEN}ccontext daemon listening on {socket_path}{Style.RESET_ALL}")
+
+    # Load what every request needs before the first one arrives
+    import ccontext.main  # noqa: F401
+
+    try:
+        while True:
+            sock, _ = server.accept()
+            connection = _Connection(sock)
+            try:
+                request = connection.receive()
+                if not request:
+                    continue
+                command = request.get("command", "run")
+                if command == "stop":
+                    connection.send(exit=0)
+                    break
+                if command == "status":
+                    connection.send(
+                        stdout=f"ccontext daemon running (pid {os.getpid()})\n"
+                    )
+                    connection.send(exit=0)
+                    continue
+                request["connection"] = connection
+                started = time.perf_counter()
+                exit_code = _run_request(request)
+                connection.send(exit=exit_code)
+                print(
+                    f"{' '.join(request['argv']) or '(no arguments)'} in {request['cwd']}: "
+                    f"exit {exit_code}, {time.perf_counter() - started:.2f}s"
+                )
+            except (BrokenPipeError, ConnectionError, ValueError) as e:
+                print(f"{Fore.YELLOW}Request aborted: {e}{Style.RESET_ALL}")
+            finally:
+                connection.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(socket_path)
+    print("ccontext daemon stopped")
+    return 0
+
+
+def _connect(socket_path: str) -> Optional[_Connection]:
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    sock.settimeout(None)
+    return _Connection(sock)
+
+
+def _relay(connection: _Connection) -> int:
+    """Copies the daemon's output to this process until the request ends."""
+    while True:
+        message = connection.receive()
+        if message is None:
+            print(
+                f"{Fore.RED}The ccontext daemon closed the connection{Style.RESET_ALL}",
+                file=sys.stderr,
+            )
+            return 1
+        if "stdout" in message:
+            sys.stdout.write(message["stdout"])
+            sys.stdout.flush()
+        elif "stderr" in message:
+            sys.stderr.write(message["stderr"])
+            sys.stderr.flush()
+        elif "read" in message:
+            line = sys.stdin.readline()
+            connection.send(line=line if line else None)
+        elif "exit" in message:
+            return message["exit"]
+
+
+def run_in_daemon(argv: List[str], socket_path=SOCKET_PATH) -> Optional[int]:
+    """
+    Runs ccontext with argv in the daemon, relaying its output and input.
+    Returns the exit code, or None when no daemon is running, in which case
+    the caller runs in-process instead.
+    """
+    connection = _connect(str(socket_path))
+    if connection is None:
+        return None
+    try:
+        connection.send(
+            argv=argv,
+            cwd=os.getcwd(),
+            env={name: os.environ.get(name) for name in CLIENT_ENVIRONMENT},
+            isatty={"stdout": sys.stdout.isatty(), "stderr": sys.stderr.isatty()},
+        )
+    except (BrokenPipeError, ConnectionError):
+        connection.close()
+        return None  # The daemon is shutting down, nothing ran yet
+    try:
+        return _relay(connection)
+    except (BrokenPipeError, ConnectionError) as e:
+        print(
+            f"{Fore.RED}Lost the ccontext daemon: {e}{Style.RESET_ALL}", file=sys.stderr
+        )
+        return 1
+    finally:
+        connection.close()
+
+
+def daemon_command(argv: List[str]) -> int:
+    """ccontext daemon [serve|stop|status]"""
+    parser = argparse.ArgumentParser(
+        prog="ccontext daemon",
+        description="Keep ccontext warm in the background. While it runs, ccontext commands are answered by the daemon.",
+    )
+    parser.add_argument(
+        "action", nargs="?", choices=("serve", "stop", "status"), default="serve"
+    )
+    parser.add_argument(
+        "--socket", default=str(SOCKET_PATH), help="Path of the Unix socket."
+    )
+    args = parser.parse_args(argv)
+
+    if not hasattr(socket, "AF_UNIX"):
+        print(
+            f"{Fore.RED}The daemon needs Unix sockets, which this platform lacks{Style.RESET_ALL}"
+        )
+        return 1
+    if args.action == "serve":
+        return serve(args.socket)
+
+    connection = _connect(args.socket)
+    if connection is None:
+        print("No ccontext daemon is running")
+        return 1
+    try:
+        connection.send(command=args.action)
+        return _relay(connection)
+    finally:
+        connection.close()
@@ -1,4 +1,48 @@
-from typing import List
+import os
+import threading
+from typing import List, Optional, Tuple
+
+from ccontext.utils import file_version, load_text
+
+# Characters of a file's contents kept at each end when the rest is not
+# resident, for the token ledger to measure the section boundaries
+CONTENT_EDGE_CHARS = 64
+
+# Characters of file contents kept in memory by default
+DEFAULT_CONTENT_BUDGET = 512 << 20
+
+
+class ContentBudget:
+    """
+    How many characters of file contents the nodes may keep in memory at
+    once. Contents beyond the budget are dropped after ingestion and read
+    again from disk when they are needed.
+    """
+
+    def __init__(self, max_chars: int = DEFAULT_CONTENT_BUDGET):
+        self.remaining = max_chars
+        self.lock = threading.Lock()
+
+    def reserve(self, chars: int) -> bool:
+        with self.lock:
+            if chars > self.remaining:
+                return False
+            self.remaining -= chars
+            return True
+
+    def release(self, chars: int):
+        with self.lock:
+            self.remaining += chars
+
+
+# Memory is per process, so is the budget
+content_budget = ContentBudget()
+
+
+def set_content_budget(max_chars: int):
+    """Replaces the budget for contents ingested from now on."""
+    global content_budget
+    content_budget = ContentBudget(max_chars)
 
 
 class FileNode:
@@ -8,25 +52,132 @@ class FileNode:
         self.node_type = node_type  # 'file' or 'directory'
         self.children = []
         self.tokens = 0  # Token count for files
-        self.content = ""  # Content of the file
+        self.estimated = False  # Whether tokens was estimated from the file size
+        self._content: Optional[str] = ""  # Content of the file, None if not resident
+        self.source_path: Optional[str] = None  # Where the content can be read again
+        self.source_version: Optional[Tuple[int, int]] = None  # See file_version
+        self.content_length = 0  # Length of the content in characters
+        # Ends of the content while not resident, None until it is read
+        self.edges: Optional[Tuple[str, str]] = ("", "")
         self.excluded = excluded  # Flag to mark if the node is excluded
+        self.is_binary = False  # Set once when the file is ingested
+        self.size = 0  # Size of the file in bytes
+        self.encoding: Optional[str] = None  # Encoding the content was decoded with
+        # Totals of the included files below a directory, set once the tree is built
+        self.total_tokens: Optional[int] = None
+        self.total_files = 0
+        self.total_bytes = 0
 
     def add_child(self, child_node):
         self.children.append(child_node)
 
-    def set_tokens_and_content(self, tokens: int, content: str):
+    @property
+    def content(self) -> str:
+        return self.get_content()
+
+    @content.setter
+    def content(self, content: str):
+        self.release_content()
+        self.source_path = None
+        self.source_version = None
+        self._content = content
+        self.content_length = len(content)
+
+    def set_tokens_and_content(
+        self,
+        tokens: int,
+        content: str,
+        source_path: Optional[str] = None,
+        source_stat: Optional[os.stat_result] = None,
+    ):
+        """
+        Stores the token count and content. With a source_path, the content
+        only stays in memory while the content budget allows, and is read
+        again from source_path when needed. source_stat is the stat of the
+        file the content was read from; reading it again fails with
+        SourceChangedError if the file no longer matches it.
+        """
         self.tokens = tokens
         self.content = content
+        if source_path is None:
+            return
+        self.source_path = source_path
+        if source_stat is not None:
+            self.source_version = file_version(source_stat)
+        if not content_budget.reserve(len(content)):
+            self._drop_content()
+
+    def set_tokens_and_source(
+        self,
+        tokens: int,
+        content_length: int,
+        source_path: str,
+        source_version: Tuple[int, int],
+    ):
+        """
+        Stores the token count of a text file that was ingested before, such
+        as by an earlier run, without its content. The content is read from
+        source_path when needed, as long as it still matches source_version.
+        """
+        self.content = ""
+        self.tokens = tokens
+        self._content = None
+        self.content_length = content_length
+        self.source_path = source_path
+        self.source_version = source_version
+        self.edges = None
+
+    def set_file_info(self, size: int, is_binary: bool, encoding: Optional[str] = None):
+        """Stores what ingestion learned about the file so renderers need no disk access."""
+        self.size = size
+        self.is_binary = is_binary
+        self.encoding = encoding
 
     def calculate_size(self) -> int:
         """
         Calculate the total size of the node and its children.
         Returns the total size in tokens.
         """
-        total_size = self.tokens
-        for child in self.children:
-            total_size += child.calculate_size()
+        if self.total_tokens is not None:
+            return self.total_tokens
+        total_size = 0
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            total_size += node.tokens
+            stack.extend(node.children)
         return total_size
 
     def get_content(self) -> str:
-        return self.content
+        """
+        Returns the content, reading it from disk if it is not resident.
+        Raises SourceChangedError if the file changed since it was ingested.
+        """
+        if self._content is not None:
+            return self._content
+        return load_text(self.source_path, self.source_version)
+
+    def release_content(self):
+        """
+        Frees the resident content once it has been emitted. It can still be
+        read again through get_content.
+        """
+        if self.source_path is not None and self._content is not None:
+            content_budget.release(len(self._content))
+            self._drop_content()
+
+    def content_edges(self) -> Tuple[str, str]:
+        """The first and last CONTENT_EDGE_CHARS characters of the content."""
+        if self._content is not None:
+            return _edges(self._content)
+        if self.edges is None:
+            self.edges = _edges(self.get_content())
+        return self.edges
+
+    def _drop_content(self):
+        self.edges = self.content_edges()
+        self._content = None
+
+
+def _edges(content: str) -> Tuple[str, str]:
+    return content[:CONTENT_EDGE_CHARS], content[-CONTENT_EDGE_CHARS:]
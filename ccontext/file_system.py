@@ -1,105 +1,180 @@
 # ccontext/file_system.py
 import os
+import re
+import subprocess
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Tuple, Union
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
-import mammoth
 from colorama import Style
-from pypdf import PdfReader
 from wcmatch import glob
 
-from ccontext.tokenizer import tokenize_text
+from ccontext.gitignore import GitignoreRules
+from ccontext.tokenizer import count_tokens
 from ccontext.utils import get_color_for_percentage, is_binary_file
 
+# Bytes read from git ls-files at a time
+GIT_READ_SIZE = 1 << 16
+
+# Characters that make a glob segment more than a plain name
+GLOB_MAGIC = set("*?[]\\{}()!@+|")
+
 
 class GitignoreHandler:
+    """
+    Applies .gitignore rules while the tree is being walked.
+
+    .gitignore files are discovered lazily: a directory's rules are parsed the
+    first time the directory is entered (or a path below it is checked) and
+    cached, so subtrees that are pruned by the walk are never read. Each
+    directory also caches its rule stack, the compiled rules of all
+    .gitignore files from the root down to it.
+    """
+
     def __init__(self, root_path: str):
         self.root_path = Path(root_path)
-        self.gitignore_patterns: Dict[Path, List[str]] = {}
-        self._find_all_gitignores()
-
-    def _find_all_gitignores(self):
-        """Recursively find all .gitignore files in the directory tree."""
-        for dirpath, _, filenames in os.walk(self.root_path):
-            if ".gitignore" in filenames:
-                dir_path = Path(dirpath)
-                patterns = self._parse_gitignore(dir_path / ".gitignore")
-                if patterns:
-                    self.gitignore_patterns[dir_path] = patterns
-
-    def _parse_gitignore(self, gitignore_path: Path) -> List[str]:
-        """Parse a single .gitignore file and return its patterns."""
+        self.gitignore_rules: Dict[str, Optional[GitignoreRules]] = {}
+        self.rule_stacks: Dict[str, Tuple[GitignoreRules, ...]] = {}
+
+    def _relative(self, path: Union[str, Path]) -> Optional[str]:
+        """Returns path relative to the root in posix form, "" for the root."""
+        path = Path(path)
+        if path.is_absolute():
+            try:
+                path = path.relative_to(self.root_path)
+            except ValueError:
+                return None
+        relative_path = path.as_posix()
+        return "" if relative_path == "." else relative_path
+
+    def load_directory(
+        self, dir_path: Union[str, Path], names=None
+    ) -> Optional[GitignoreRules]:
+        """
+        Parses and caches the .gitignore of dir_path, if it has one.
+        names, when given, is the directory listing the caller already has,
+        which saves probing the filesystem for the file.
+        """
+        relative_dir = self._relative(dir_path)
+        if relative_dir is None:
+            return None
+        if relative_dir in self.gitignore_rules:
+            return self.gitignore_rules[relative_dir]
+
+        rules = None
+        gitignore_path = self.root_path / relative_dir / ".gitignore"
+        if (".gitignore" in names) if names is not None else gitignore_path.is_file():
+            rules = self._parse_gitignore(gitignore_path, relative_dir)
+        self.gitignore_rules[relative_dir] = rules
+        return rules
+
+    def _parse_gitignore(
+        self, gitignore_path: Path, relative_dir: str
+    ) -> Optional[GitignoreRules]:
+        """Parse a single .gitignore file and compile its rules."""
         try:
             with open(gitignore_path, "r") as file:
                 lines = file.read().splitlines()
-
-            patterns = []
-            for line in lines:
-                line = line.strip()
-                # Skip empty lines and comments
-                if not line or line.startswith("#"):
-                    continue
-
-                # Handle negation patterns (!)
-                if line.startswith("!"):
-                    # Convert negation pattern to include pattern
-                    continue  # Skip for now as it requires special handling
-
-                # Handle directory-only patterns
-                is_dir_pattern = line.endswith("/")
-
-                # Convert .gitignore pattern to glob pattern
-                if not line.startswith("/"):
-                    # Pattern matches files in any directory
-                    pattern = f"**/{line}"
-                else:
-                    # Pattern is relative to the .gitignore file location
-                    pattern = line[1:]  # Remove leading slash
-
-                if is_dir_pattern:
-                    pattern = f"{pattern}**"
-
-                patterns.append(pattern)
-
-            return patterns
+            return GitignoreRules(relative_dir, lines) or None
         except Exception as e:
             print(f"Error parsing .gitignore at {gitignore_path}: {str(e)}")
-            return []
-
-    def should_ignore(self, path: Path) -> bool:
-        """Check if a path should be ignored based on all relevant .gitignore files."""
-        path = Path(path)
-        try:
-            relative_path = path.relative_to(self.root_path)
-        except ValueError:
+            return None
+
+    def forget_directory(self, dir_path: Union[str, Path]):
+        """
+        Drops the cached .gitignore of dir_path and the rule stacks of
+        dir_path and everything below it, so an edited .gitignore is parsed
+        again the next time the directory is entered.
+        """
+        relative_dir = self._relative(dir_path)
+        if relative_dir is None:
+            return
+        self.gitignore_rules.pop(relative_dir, None)
+        prefix = relative_dir + "/"
+        for stale in [
+            directory
+            for directory in self.rule_stacks
+            if not relative_dir
+            or directory == relative_dir
+            or directory.startswith(prefix)
+        ]:
+            del self.rule_stacks[stale]
+
+    def rule_stack(self, relative_dir: str) -> Tuple[GitignoreRules, ...]:
+        """Returns the rules that apply inside relative_dir, shallowest first."""
+        stack = self.rule_stacks.get(relative_dir)
+        if stack is None:
+            if relative_dir:
+                stack = self.rule_stack(relative_dir.rpartition("/")[0])
+            else:
+                stack = ()
+            rules = self.load_directory(self.root_path / relative_dir)
+            if rules:
+                stack = stack + (rules,)
+            self.rule_stacks[relative_dir] = stack
+        return stack
+
+    def should_ignore(self, path: Union[str, Path], is_dir: bool = None) -> bool:
+        """
+        Check if a path should be ignored based on all relevant .gitignore files.
+        Relative paths are taken relative to the root path. Deeper .gitignore
+        files take precedence and within a file the last matching rule wins,
+        so "!" rules can re-include what an earlier rule ignored.
+        """
+        relative_path = self._relative(path)
+        if not relative_path:
             return False
+        if is_dir is None:
+            is_dir = (self.root_path / relative_path).is_dir()
 
-        # Check patterns from root to the file's location
-        current = self.root_path
-        for part in relative_path.parts[:-1]:
-            current = current / part
-            if current in self.gitignore_patterns:
-                if self._matches_any_pattern(
-                    relative_path, self.gitignore_patterns[current]
-                ):
-                    return True
-
-        # Check patterns in the file's own directory
-        file_dir = path.parent
-        if file_dir in self.gitignore_patterns:
-            return self._matches_any_pattern(
-                relative_path, self.gitignore_patterns[file_dir]
-            )
-
+        for rules in reversed(self.rule_stack(relative_path.rpartition("/")[0])):
+            ignored = rules.match(relative_path, is_dir)
+            if ignored is not None:
+                return ignored
         return False
 
-    def _matches_any_pattern(self, path: Path, patterns: List[str]) -> bool:
-        """Check if a path matches any of the given patterns."""
-        path_str = str(path.as_posix())
-        return any(
-            glob.globmatch(path_str, pattern, flags=glob.GLOBSTAR)
-            for pattern in patterns
-        )
+
+def iter_git_files(root_path: str, exclude_standard: bool = True):
+    """
+    Streams the files of the git work tree at root_path as posix paths
+    relative to root_path: tracked files plus untracked ones that are not
+    ignored, minus tracked files deleted from the work tree.
+    Raises OSError or subprocess.CalledProcessError when git cannot list them.
+    """
+    deleted = subprocess.run(
+        ["git", "-C", root_path, "ls-files", "--deleted", "-z"],
+        capture_output=True,
+        check=True,
+    ).stdout.split(b"\0")
+    deleted = {os.fsdecode(path) for path in deleted if path}
+
+    command = ["git", "-C", root_path, "ls-files", "--cached", "--others", "-z"]
+    if exclude_standard:
+        command.append("--exclude-standard")
+
+    with subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    ) as process:
+        pending = b""
+        for block in iter(lambda: process.stdout.read(GIT_READ_SIZE), b""):
+            *paths, pending = (pending + block).split(b"\0")
+            for path in paths:
+                path = os.fsdecode(path)
+                if path not in deleted:
+                    yield path
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def list_git_files(root_path: str, exclude_standard: bool = True) -> Optional[list]:
+    """
+    Returns the files git knows about below root_path (see iter_git_files),
+    or None when git is not installed or root_path is not in a work tree.
+    """
+    try:
+        return list(iter_git_files(root_path, exclude_standard))
+    except (OSError, subprocess.CalledProcessError):
+        return None
 
 
 def get_file_token_length(file_path: str) -> int:
@@ -116,8 +191,7 @@ def get_file_token_length(file_path: str) -> int:
                 return -1
             try:
                 text = content.decode("utf-8")
-                tokens = tokenize_text(text)
-                return len(tokens)
+                return count_tokens(text)
             except UnicodeDecodeError:
                 return -1  # Treat as binary if we can't decode
     except Exception as e:
@@ -127,14 +201,16 @@ def get_file_token_length(file_path: str) -> int:
 
 def get_pdf_token_length(file_path: str) -> int:
     """Returns the token length of a PDF file."""
+    # pypdf is slow to import, so only load it when a PDF is read
+    from pypdf import PdfReader
+
     try:
         with open(file_path, "rb") as f:
             pdf_reader = PdfReader(f)
             text = ""
             for page in pdf_reader.pages:
                 text += page.extract_text()
-            tokens = tokenize_text(text)
-            return len(tokens)
+            return count_tokens(text)
     except Exception as e:
         print(f"Error processing PDF {file_path}: {str(e)}")
         return -1
@@ -142,42 +218,145 @@ def get_pdf_token_length(file_path: str) -> int:
 
 def get_docx_token_length(file_path: str) -> int:
     """Returns the token length of a DOCX file."""
+    import mammoth
+
     try:
         with open(file_path, "rb") as docx_file:
             result = mammoth.extract_raw_text(docx_file)
             text = result.value
-            tokens = tokenize_text(text)
-            return len(tokens)
+            return count_tokens(text)
     except Exception as e:
         print(f"Error processing DOCX {file_path}: {str(e)}")
         return -1
 
 
+class GlobMatcher:
+    """
+    A list of wcmatch glob patterns compiled into a single matcher.
+
+    The common "**/name", "**/*.ext" and "**/name/**" shapes are indexed by
+    basename, suffix and path component, so most paths are rejected with a
+    dict lookup and one str.endswith call. A candidate is then confirmed with
+    that pattern's own wcmatch regex, so results are exactly those of
+    glob.globmatch. All other patterns share one combined regex.
+
+    Matchers are immutable, as as_glob_matcher shares them between callers:
+    combine returns a new matcher with more patterns.
+    """
+
+    def __init__(self, patterns: Iterable[str] = ()):
+        self.patterns: Tuple[str, ...] = tuple(patterns)
+        self._compiled = False
+
+    def __contains__(self, pattern: str) -> bool:
+        return pattern in self.patterns
+
+    def __iter__(self):
+        return iter(self.patterns)
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def __repr__(self) -> str:
+        return f"GlobMatcher({self.patterns!r})"
+
+    def combine(self, patterns: Iterable[str]) -> "GlobMatcher":
+        """Returns a matcher for these patterns and those not already in it."""
+        added = tuple(pattern for pattern in patterns if pattern not in self.patterns)
+        return as_glob_matcher(self.patterns + added) if added else self
+
+    def _compile(self):
+        self._basenames: Dict[str, List[re.Pattern]] = {}
+        self._suffixes: Dict[str, List[re.Pattern]] = {}
+        self._components: Dict[str, List[re.Pattern]] = {}
+        fallback = []
+
+        for pattern in self.patterns:
+            regex = glob.translate(pattern, flags=glob.GLOBSTAR)[0][0]
+            name = pattern[3:] if pattern.startswith("**/") else None
+            if name and not GLOB_MAGIC.intersection(name) and "/" not in name:
+                index, key = self._basenames, name
+            elif (
+                name
+                and name.startswith("*")
+                and not GLOB_MAGIC.intersection(name[1:])
+                and "/" not in name
+                and len(name) > 1
+            ):
+                index, key = self._suffixes, name[1:]
+            elif (
+                name
+                and name.endswith("/**")
+                and not GLOB_MAGIC.intersection(name[:-3])
+                and "/" not in name[:-3]
+                and len(name) > 3
+            ):
+                index, key = self._components, name[:-3]
+            else:
+                fallback.append(regex)
+                continue
+            index.setdefault(key, []).append(re.compile(regex))
+
+        self._suffix_tuple = tuple(self._suffixes)
+        self._fallback = re.compile("|".join(fallback)) if fallback else None
+        self._compiled = True
+
+    def matches(self, path: str) -> bool:
+        """Returns True if the posix path matches any of the patterns."""
+        if not self._compiled:
+            self._compile()
+
+        basename = path.rstrip("/").rpartition("/")[2]
+        for regex in self._basenames.get(basename, ()):
+            if regex.match(path):
+                return True
+        if self._suffix_tuple and basename.endswith(self._suffix_tuple):
+            for suffix, regexes in self._suffixes.items():
+                if basename.endswith(suffix) and any(r.match(path) for r in regexes):
+                    return True
+        if self._components:
+            for component in path.split("/"):
+                for regex in self._components.get(component, ()):
+                    if regex.match(path):
+                        return True
+        return self._fallback is not None and self._fallback.match(path) is not None
+
+
+def as_glob_matcher(patterns: Union[GlobMatcher, Iterable[str], None]) -> GlobMatcher:
+    """Returns patterns as a GlobMatcher, reusing compiled matchers for plain lists."""
+    if isinstance(patterns, GlobMatcher):
+        return patterns
+    return _cached_glob_matcher(tuple(patterns or ()))
+
+
+@lru_cache(maxsize=32)
+def _cached_glob_matcher(patterns: Tuple[str, ...]) -> GlobMatcher:
+    return GlobMatcher(patterns)
+
+
 def is_excluded(
     path: str,
-    excludes: List[str],
-    includes: List[str],
+    excludes: Union[GlobMatcher, List[str]],
+    includes: Union[GlobMatcher, List[str]],
     gitignore_handler: GitignoreHandler | None = None,
+    is_dir: bool = None,
 ) -> bool:
-    """Checks if a path should be excluded using wcmatch and gitignore rules."""
+    """
+    Checks if a path should be excluded using wcmatch and gitignore rules.
+    is_dir saves the gitignore check a stat when the caller already knows it.
+    """
     normalized_path = Path(path).as_posix()
 
     # First check includes - if included, never exclude
-    if any(
-        glob.globmatch(normalized_path, pattern, flags=glob.GLOBSTAR)
-        for pattern in includes
-    ):
+    if as_glob_matcher(includes).matches(normalized_path):
         return False
 
     # Check gitignore rules if handler is provided
-    if gitignore_handler and gitignore_handler.should_ignore(Path(path)):
+    if gitignore_handler and gitignore_handler.should_ignore(normalized_path, is_dir):
         return True
 
     # Finally check explicit exclude patterns
-    return any(
-        glob.globmatch(normalized_path, pattern, flags=glob.GLOBSTAR)
-        for pattern in excludes
-    )
+    return as_glob_matcher(excludes).matches(normalized_path)
 
 
 def collect_excludes_includes(
@@ -187,8 +366,11 @@ def collect_excludes_includes(
     included_folders_files: Union[str, List[str], None],
     root_path: str,
     ignore_gitignore: bool,
-) -> Tuple[List[str], List[str], GitignoreHandler]:
-    """Combines default excluded items with additional exclusions and includes."""
+) -> Tuple[GlobMatcher, GlobMatcher, GitignoreHandler]:
+    """
+    Combines default excluded items with additional exclusions and includes.
+    Both are returned as compiled GlobMatchers for is_excluded.
+    """
 
     # Convert all inputs to lists
     def to_list(value: Union[str, List[str], None]) -> List[str]:
@@ -217,7 +399,7 @@ def collect_excludes_includes(
     # Create gitignore handler if needed
     gitignore_handler = None if ignore_gitignore else GitignoreHandler(root_path)
 
-    return excludes, includes, gitignore_handler
+    return as_glob_matcher(excludes), as_glob_matcher(includes), gitignore_handler
 
 
 def print_tree(
@@ -1,170 +1,879 @@
 # ccontext/file_tree.py
+import contextlib
+import heapq
 import os
+import threading
 import time
-from typing import List, Tuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
 from colorama import Fore, Style
 
 from ccontext.file_node import FileNode
-from ccontext.file_system import GitignoreHandler, is_excluded
-from ccontext.tokenizer import tokenize_text
+from ccontext.file_system import (
+    GitignoreHandler,
+    GlobMatcher,
+    as_glob_matcher,
+    is_excluded,
+    list_git_files,
+)
+from ccontext.process_pool import ingest_in_processes
+from ccontext.token_cache import TokenCache, hash_content
+from ccontext.token_estimator import TokenEstimator
+from ccontext.tokenizer import count_tokens, get_token_counter
+from ccontext.tree_index import EXCLUDED, TreeListing
 from ccontext.utils import (
+    BINARY_SNIFF_SIZE,
+    format_bytes,
+    format_number,
     get_color_for_percentage,
-    is_binary_file,
+    is_binary_data,
+    is_binary_prefix,
     is_verbose,
+    read_file_data,
     should_upload_file,
 )
 
+# Directory listing is I/O bound, so use more threads than cores (same
+# heuristic as ThreadPoolExecutor's default, capped for network filesystems).
+DEFAULT_WALK_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+# Bytes of text, or files, collected before a batch is handed to the
+# tokenizer threads; the file limit bounds what many tiny files hold on to
+TOKEN_BATCH_BYTES = 8 << 20
+TOKEN_BATCH_FILES = 4096
+
+# Files read by one task of the ingestion thread pool
+INGEST_CHUNK_FILES = 64
+
+# Closes the file contents section of the output
+END_OF_CONTENTS_MARKER = "### ========== End of Detailed File Contents ==========\n"
+
 
 def build_file_tree(
     root_path: str,
-    excludes: List[str],
-    includes: List[str],
+    excludes: GlobMatcher,
+    includes: GlobMatcher,
     uploadable_extensions: set,
     gitignore_handler: GitignoreHandler = None,
+    max_workers: Optional[int] = None,
+    use_git_index: bool = False,
+    token_cache: Optional[TokenCache] = None,
+    process_workers: int = 0,
+    estimator: Optional[TokenEstimator] = None,
+    subtree: Optional[str] = None,
+    reuse_directory: Optional[Callable[[str], Optional[FileNode]]] = None,
+    compact_threshold: int = 0,
+    fingerprints: Optional[Dict[str, str]] = None,
 ) -> FileNode:
+    """
+    Builds the FileNode tree for root_path.
+
+    Directories are listed with os.scandir and fanned out across a bounded
+    thread pool into a TreeListing. Children are listed in sorted order, so
+    the resulting tree is identical to a serial walk. Files are read once
+    the listing is complete, see ingest_files.
+
+    With use_git_index, the file list is taken from git ls-files instead
+    (git applies the .gitignore rules itself), falling back to the walk when
+    root_path is not inside a git work tree.
+
+    A token_cache supplies the counts of files unchanged since earlier runs.
+    With process_workers, included files are read and tokenized in that
+    many worker processes instead of on threads. With an estimator, files
+    are not read at all: their tokens are estimated from their size, unless
+    the token_cache has an exact count.
+
+    With subtree, a path relative to root_path, only the node for that path
+    is built, walking its directories, with paths and exclusions as in the
+    full tree so it can replace the node of an earlier build.
+
+    reuse_directory is called with the relative path of each included
+    directory, from the top down, once the whole tree is listed and before
+    any file is read. When it returns a node, that node's children are
+    used instead, and nothing below the directory is read.
+
+    A fingerprints dict is filled with the Merkle fingerprint of every
+    listed directory (see TreeListing.fingerprints) before reuse_directory
+    is called, at the cost of one stat per file.
+
+    With a compact_threshold, a listing of at least that many entries is
+    stored as a TreeIndex instead of FileNodes, and the root of its view is
+    returned; reuse_directory does not apply to it.
+    """
     # Record the start time
     start_time = time.time()
+    max_workers = max_workers or DEFAULT_WALK_WORKERS
+    excludes = as_glob_matcher(excludes)
+    includes = as_glob_matcher(includes)
 
-    def traverse_directory(current_path: str) -> FileNode:
-        relative_path = os.path.relpath(current_path, start=root_path)
-        node_type = "directory" if os.path.isdir(current_path) else "file"
-        excluded = is_excluded(relative_path, excludes, includes, gitignore_handler)
-        node = FileNode(
-            os.path.basename(current_path),
-            relative_path,
-            node_type,
-            excluded,
+    if use_git_index and not subtree:
+        git_files = list_git_files(
+            root_path, exclude_standard=gitignore_handler is not None
+        )
+        if git_files is not None:
+            return build_file_tree_from_paths(
+                root_path,
+                git_files,
+                excludes,
+                includes,
+                uploadable_extensions,
+                max_workers,
+                token_cache,
+                process_workers,
+                estimator,
+                compact_threshold,
+                reuse_directory,
+                fingerprints,
+            )
+        print(
+            f"{Fore.YELLOW}git ls-files unavailable for {root_path}, walking the directory instead.{Style.RESET_ALL}"
         )
 
-        # Check elapsed time
-        elapsed_time = time.time() - start_time
-
-        # Check if 10 seconds have elapsed and print path in red if true
-        if elapsed_time > 10:
-            print(Fore.RED + relative_path + Style.RESET_ALL)
-
-        if node_type == "directory" and not excluded:
-            try:
-                items = sorted(os.listdir(current_path))
-                for item in items:
-                    full_path = os.path.join(current_path, item)
-                    child_node = traverse_directory(full_path)
-                    node.add_child(child_node)
-            except PermissionError:
-                print(
-                    f"{Fore.YELLOW}Permission denied: {current_path}{Style.RESET_ALL}"
+    def scan_directory(
+        index: int, current_path: str, relative_dir: str
+    ) -> List[Tuple[int, str, str]]:
+        """
+        Lists the children of the directory at index and returns the
+        subdirectories to scan, as (index, path, relative path).
+        """
+        try:
+            with os.scandir(current_path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+            if gitignore_handler:
+                # Parse this directory's .gitignore before judging its children
+                gitignore_handler.load_directory(
+                    current_path, {entry.name for entry in entries}
+                )
+            children = []
+            subdirectories = []
+            for offset, entry in enumerate(entries):
+                relative_path = (
+                    entry.name
+                    if relative_dir == "."
+                    else os.path.join(relative_dir, entry.name)
                 )
-            except Exception as e:
-                print(
-                    f"{Fore.YELLOW}Error accessing {current_path}: {str(e)}{Style.RESET_ALL}"
+                is_dir = _entry_is_dir(entry)
+                excluded = is_excluded(
+                    relative_path, excludes, includes, gitignore_handler, is_dir
                 )
-        elif node_type == "file" and not excluded:
-            tokens, content = tokenize_file_content(current_path, uploadable_extensions)
-            node.set_tokens_and_content(tokens, content)
+                # Check if 10 seconds have elapsed and print path in red if true
+                if time.time() - start_time > 10:
+                    print(Fore.RED + relative_path + Style.RESET_ALL)
+                stat = None
+                if fingerprints is not None and not is_dir:
+                    with contextlib.suppress(OSError):
+                        stat = entry.stat()
+                children.append((entry.name, is_dir, excluded, stat))
+                if is_dir and not excluded:
+                    subdirectories.append((offset, entry.path, relative_path))
+            first = listing.add_children(index, children)
+        except PermissionError:
+            print(f"{Fore.YELLOW}Permission denied: {current_path}{Style.RESET_ALL}")
+            return []
+        except Exception as e:
+            print(
+                f"{Fore.YELLOW}Error accessing {current_path}: {str(e)}{Style.RESET_ALL}"
+            )
+            return []
+        return [
+            (first + offset, path, relative)
+            for offset, path, relative in subdirectories
+        ]
+
+    start_path = os.path.join(root_path, subtree) if subtree else root_path
+    relative_root = os.path.relpath(start_path, start=root_path)
+    is_dir = os.path.isdir(start_path)
+    listing = TreeListing(
+        os.path.basename(start_path),
+        relative_root,
+        is_dir,
+        is_excluded(relative_root, excludes, includes, gitignore_handler, is_dir),
+        stats=fingerprints is not None,
+    )
+    if fingerprints is not None and not is_dir:
+        with contextlib.suppress(OSError):
+            listing.set_stat(0, os.stat(start_path))
+    if is_dir and not listing.flags[0] & EXCLUDED:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {executor.submit(scan_directory, 0, start_path, relative_root)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for directory in future.result():
+                        pending.add(executor.submit(scan_directory, *directory))
+
+    return _build_from_listing(
+        listing,
+        root_path,
+        uploadable_extensions,
+        max_workers,
+        token_cache,
+        process_workers,
+        estimator,
+        reuse_directory,
+        compact_threshold,
+        fingerprints,
+    )
+
+
+def build_file_tree_from_paths(
+    root_path: str,
+    relative_paths: Iterable[str],
+    excludes: GlobMatcher,
+    includes: GlobMatcher,
+    uploadable_extensions: set,
+    max_workers: Optional[int] = None,
+    token_cache: Optional[TokenCache] = None,
+    process_workers: int = 0,
+    estimator: Optional[TokenEstimator] = None,
+    compact_threshold: int = 0,
+    reuse_directory: Optional[Callable[[str], Optional[FileNode]]] = None,
+    fingerprints: Optional[Dict[str, str]] = None,
+) -> FileNode:
+    """
+    Builds the FileNode tree from a list of posix file paths relative to
+    root_path, such as the output of git ls-files, without listing any
+    directory. Excludes, includes, reuse_directory and fingerprints work
+    as in build_file_tree.
+    """
+    # Nested dicts of directory name -> children, None marks a file
+    layout = {}
+    for relative_path in relative_paths:
+        *directories, name = relative_path.split("/")
+        level = layout
+        for directory in directories:
+            level = level.setdefault(directory, {})
+        level[name] = None
+
+    listing = TreeListing(
+        os.path.basename(root_path),
+        ".",
+        True,
+        is_excluded(".", excludes, includes, None, True),
+        stats=fingerprints is not None,
+    )
+    stack = [(0, ".", layout)] if not listing.flags[0] & EXCLUDED else []
+    while stack:
+        index, relative_dir, level = stack.pop()
+        names = sorted(level)
+        children = []
+        for name in names:
+            relative_path = (
+                name if relative_dir == "." else os.path.join(relative_dir, name)
+            )
+            is_dir = level[name] is not None
+            stat = None
+            if fingerprints is not None and not is_dir:
+                with contextlib.suppress(OSError):
+                    stat = os.stat(os.path.join(root_path, relative_path))
+            children.append(
+                (
+                    name,
+                    is_dir,
+                    is_excluded(relative_path, excludes, includes, None, is_dir),
+                    stat,
+                )
+            )
+        first = listing.add_children(index, children)
+        for offset, (name, is_dir, excluded, _) in enumerate(children):
+            if is_dir and not excluded:
+                relative_path = (
+                    name if relative_dir == "." else os.path.join(relative_dir, name)
+                )
+                stack.append((first + offset, relative_path, level[name]))
+
+    return _build_from_listing(
+        listing,
+        root_path,
+        uploadable_extensions,
+        max_workers,
+        token_cache,
+        process_workers,
+        estimator,
+        reuse_directory,
+        compact_threshold,
+        fingerprints,
+    )
+
+
+def _build_from_listing(
+    listing: TreeListing,
+    root_path: str,
+    uploadable_extensions: set,
+    max_workers: Optional[int] = None,
+    token_cache: Optional[TokenCache] = None,
+    process_workers: int = 0,
+    estimator: Optional[TokenEstimator] = None,
+    reuse_directory: Optional[Callable[[str], Optional[FileNode]]] = None,
+    compact_threshold: int = 0,
+    fingerprints: Optional[Dict[str, str]] = None,
+) -> FileNode:
+    """Turns a listing into a tree, FileNodes or a TreeIndex, and reads its files."""
+    if fingerprints is not None:
+        fingerprints.update(listing.fingerprints())
+    compact = compact_threshold and len(listing) >= compact_threshold
+    if compact:
+        tree, files = listing.tree_index(root_path)
+        root_node = tree.root()
+    else:
+        root_node, files = listing.file_nodes(root_path, reuse_directory)
+    del listing  # Only the tree is needed from here on
+
+    ingest_files(
+        files,
+        uploadable_extensions,
+        max_workers,
+        token_cache,
+        process_workers,
+        estimator,
+    )
+    # A TreeIndex derives its totals from the arrays
+    if root_node.node_type == "directory" and not compact:
+        aggregate_directories(root_node)
+    return root_node
+
+
+def ingest_files(
+    files: Sequence[Tuple[FileNode, str]],
+    uploadable_extensions: set,
+    max_workers: Optional[int] = None,
+    token_cache: Optional[TokenCache] = None,
+    process_workers: int = 0,
+    estimator: Optional[TokenEstimator] = None,
+):
+    """
+    Fills in the (node, file path) pairs with load_file, on a thread pool in
+    runs of INGEST_CHUNK_FILES, or on process_workers worker processes.
+    """
+    if process_workers and not estimator:
+        # Excluded files are only sniffed, which is not worth a process
+        for node, file_path in files:
+            if node.excluded:
+                sniff_file(node, file_path)
+        ingest_in_processes(
+            [(node, file_path) for node, file_path in files if not node.excluded],
+            uploadable_extensions,
+            process_workers,
+            token_cache,
+        )
+        return
+
+    def ingest_chunk(start: int):
+        for node, file_path in files[start : start + INGEST_CHUNK_FILES]:
+            load_file(
+                node,
+                file_path,
+                uploadable_extensions,
+                token_cache,
+                pending_counts,
+                estimator,
+            )
+
+    pending_counts = PendingTokenCounts(token_cache)
+    with ThreadPoolExecutor(
+        max_workers=max_workers or DEFAULT_WALK_WORKERS
+    ) as executor:
+        list(executor.map(ingest_chunk, range(0, len(files), INGEST_CHUNK_FILES)))
+    pending_counts.finish()
+
+
+def _entry_is_dir(entry: os.DirEntry) -> bool:
+    """Uses the type cached on the DirEntry, following symlinks like os.path.isdir."""
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
+def load_file(
+    node: FileNode,
+    file_path: str,
+    uploadable_extensions: set,
+    token_cache: Optional[TokenCache] = None,
+    pending_counts: Optional["PendingTokenCounts"] = None,
+    estimator: Optional[TokenEstimator] = None,
+):
+    """
+    Fills in a file node: excluded files are only sniffed for the binary
+    icon in the tree, included files are fully ingested, or estimated when
+    an estimator is given.
+    """
+    if node.excluded:
+        sniff_file(node, file_path)
+    elif estimator:
+        estimate_file(node, file_path, uploadable_extensions, estimator, token_cache)
+    else:
+        ingest_file(node, file_path, uploadable_extensions, token_cache, pending_counts)
+
+
+def sniff_file(node: FileNode, file_path: str):
+    """Records size and binary status from the first bytes of the file."""
+    try:
+        with open(file_path, "rb") as f:
+            node.set_file_info(
+                os.fstat(f.fileno()).st_size,
+                is_binary_data(f.read(BINARY_SNIFF_SIZE)),
+            )
+    except OSError:
+        pass
+
+
+def estimate_file(
+    node: FileNode,
+    file_path: str,
+    uploadable_extensions: set,
+    estimator: TokenEstimator,
+    token_cache: Optional[TokenCache] = None,
+):
+    """
+    Sniffs a file and estimates its tokens from its size, preferring an
+    exact count from the token_cache. Only the leading bytes are read.
+    """
+    try:
+        with open(file_path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            head = f.read(BINARY_SNIFF_SIZE)
+    except OSError as e:
+        print(f"{Fore.YELLOW}Error reading file {file_path}: {str(e)}{Style.RESET_ALL}")
+        return
+
+    if should_upload_file(file_path, uploadable_extensions):
+        node.set_file_info(stat.st_size, is_binary_data(head))
+        node.tokens = 1
+        return
+
+    tokens = token_cache.get(file_path, stat) if token_cache else None
+    # Binary as in a full run: null bytes or invalid UTF-8. Only text files
+    # have exact counts in the token_cache.
+    is_binary = tokens is None and is_binary_prefix(head, len(head) >= stat.st_size)
+    node.set_file_info(stat.st_size, is_binary)
+    if is_binary:
+        return
+    if tokens is None:
+        tokens = estimator.estimate(file_path, stat.st_size)
+        node.estimated = True
+    node.tokens = tokens
+
 
-        return node
+class PendingTokenCounts:
+    """
+    Collects the text files whose tokens still need counting while the tree
+    is walked, and counts them in batches on the shared TokenCounter. A
+    batch is counted by whichever walker thread fills it, so counting
+    overlaps with the rest of the walk.
+    """
 
-    return traverse_directory(root_path)
+    def __init__(
+        self,
+        token_cache: Optional[TokenCache] = None,
+        batch_bytes: int = TOKEN_BATCH_BYTES,
+        batch_files: int = TOKEN_BATCH_FILES,
+    ):
+        self.token_cache = token_cache
+        self.batch_bytes = batch_bytes
+        self.batch_files = batch_files
+        self.counter = get_token_counter()
+        self.lock = threading.Lock()
+        self.batch = []
+        self.batch_size = 0
 
+    def add(
+        self,
+        node: FileNode,
+        file_path: str,
+        stat: os.stat_result,
+        data: bytes,
+        text: str,
+    ):
+        content_hash = hash_content(data) if self.token_cache else None
+        with self.lock:
+            # The text is kept here, as the node may not keep its content
+            self.batch.append((node, file_path, stat, content_hash, text))
+            self.batch_size += len(data)
+            if (
+                self.batch_size < self.batch_bytes
+                and len(self.batch) < self.batch_files
+            ):
+                return
+            batch, self.batch, self.batch_size = self.batch, [], 0
+        self._count(batch)
 
-def tokenize_file_content(
-    file_path: str, uploadable_extensions: set
-) -> Tuple[int, str]:
-    """Returns token count and content for a file."""
+    def finish(self):
+        """Counts whatever is left once the walk is done."""
+        with self.lock:
+            batch, self.batch, self.batch_size = self.batch, [], 0
+        self._count(batch)
+
+    def _count(self, batch: list):
+        counts = self.counter.count_batch([text for *_, text in batch])
+        for (node, file_path, stat, content_hash, _), tokens in zip(batch, counts):
+            node.tokens = tokens
+            if self.token_cache:
+                self.token_cache.put(file_path, stat, tokens, content_hash)
+
+
+def ingest_file(
+    node: FileNode,
+    file_path: str,
+    uploadable_extensions: set,
+    token_cache: Optional[TokenCache] = None,
+    pending_counts: Optional[PendingTokenCounts] = None,
+):
+    """
+    Reads a file once: sniffs its binary status, decodes and tokenizes text
+    and stores the results on the node. With a token_cache, unchanged files
+    skip tokenization. With pending_counts, counting is deferred to its next
+    batch.
+    """
     try:
-        # First check if file should be uploaded regardless of binary status
-        if should_upload_file(file_path, uploadable_extensions):
-            file_ref = f"<file>{os.path.abspath(file_path)}</file>"
-            return 1, file_ref
-
-        # If not uploadable, check if it's binary
-        if is_binary_file(file_path):
-            return 0, ""  # Skip binary files that aren't in uploadable list
-
-        # Handle text files
-        with open(file_path, "r", encoding="utf-8") as f:
-            text_content = f.read()
-            if is_verbose():
-                print(file_path)
-            tokens = tokenize_text(text_content)
-            return len(tokens), text_content
+        file_data = read_file_data(file_path, uploadable_extensions)
+        stat = file_data.stat
+        if file_data.uploadable:
+            node.set_file_info(stat.st_size, file_data.is_binary)
+            node.set_tokens_and_content(1, file_data.content)
+            return
+        if file_data.is_binary:
+            node.set_file_info(stat.st_size, True)
+            return  # Skip binary files that aren't in uploadable list
+
+        if is_verbose():
+            print(file_path)
+        node.set_file_info(stat.st_size, False, "utf-8")
+        tokens = token_cache.get(file_path, stat) if token_cache else None
+        node.set_tokens_and_content(tokens or 0, file_data.content, file_path, stat)
+        if tokens is not None:
+            return
+        if pending_counts is not None:
+            pending_counts.add(node, file_path, stat, file_data.data, file_data.content)
+            return
+        node.tokens = count_tokens(file_data.content)
+        if token_cache:
+            token_cache.put(file_path, stat, node.tokens, hash_content(file_data.data))
 
     except Exception as e:
         print(f"{Fore.YELLOW}Error reading file {file_path}: {str(e)}{Style.RESET_ALL}")
-        return 0, ""
+
+
+def file_section_header(node: FileNode) -> str:
+    """The heading that precedes a file's contents in the output."""
+    return f"\n#### 📄 {node.path}\n**Contents:**\n"
+
+
+def file_section(node: FileNode) -> str:
+    """A file's heading and contents, as they appear in the output."""
+    return f"{file_section_header(node)}{node.content}\n"
+
+
+def iter_file_nodes(node: FileNode) -> Iterator[FileNode]:
+    """Yields the file nodes below node in output order."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.node_type == "file":
+            yield node
+        elif node.node_type == "directory":
+            stack.extend(reversed(node.children))
+
+
+def iter_file_contents(node: FileNode) -> Iterator[str]:
+    """Yields the output section of each file, one at a time."""
+    return map(file_section, iter_file_nodes(node))
 
 
 def extract_file_contents(node: FileNode) -> list:
-    contents = []
-    if node.node_type == "file":
-        contents.append(f"\n#### 📄 {node.path}\n**Contents:**\n{node.content}\n")
-    elif node.node_type == "directory":
-        for child in node.children:
-            contents.extend(extract_file_contents(child))
-    return contents
+    return list(iter_file_contents(node))
+
+
+class FileSections(Sequence):
+    """
+    The output sections of the files below a node, built only when accessed,
+    so the whole context is never held as strings at once. Each node
+    releases its content once its section is built; it is read from disk
+    again if the section is needed twice.
+    """
+
+    def __init__(self, root_node: FileNode):
+        self.nodes = list(iter_file_nodes(root_node))
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._emit(node) for node in self.nodes[index]]
+        return self._emit(self.nodes[index])
+
+    def __iter__(self) -> Iterator[str]:
+        return map(self._emit, self.nodes)
+
+    @staticmethod
+    def _emit(node: FileNode) -> str:
+        """Builds the section and lets the node release its content."""
+        section = file_section(node)
+        node.release_content()
+        return section
+
+
+def walk_tree(
+    node: FileNode, descend_excluded: bool = True
+) -> Iterator[Tuple[int, FileNode]]:
+    """
+    Yields (depth, node) for node and everything below it in display order,
+    with an explicit stack so deep trees cannot hit the recursion limit.
+    """
+    stack = [(0, node)]
+    while stack:
+        depth, node = stack.pop()
+        yield depth, node
+        if node.node_type == "directory" and (descend_excluded or not node.excluded):
+            stack.extend((depth + 1, child) for child in reversed(node.children))
+
+
+def aggregate_directories(root_node: FileNode):
+    """
+    Sets the total tokens, included files and bytes of every directory,
+    bottom-up in a single pass: directories are visited in reverse display
+    order, so children are always summed before their parent.
+    """
+    directories = [
+        node for _, node in walk_tree(root_node) if node.node_type == "directory"
+    ]
+    for directory in reversed(directories):
+        aggregate_directory(directory)
+
+
+def aggregate_directory(directory: FileNode):
+    """Sets the totals of one directory from those of its children."""
+    tokens = files = size = 0
+    for child in directory.children:
+        if child.node_type == "directory":
+            tokens += child.total_tokens
+            files += child.total_files
+            size += child.total_bytes
+        else:
+            tokens += child.tokens
+            if not child.excluded:
+                files += 1
+                size += child.size
+    directory.total_tokens = tokens
+    directory.total_files = files
+    directory.total_bytes = size
 
 
 def sum_file_tokens(node: FileNode) -> int:
-    if node.node_type == "file":
-        return node.tokens
-    else:
-        return sum(sum_file_tokens(child) for child in node.children)
+    if node.node_type == "directory" and node.total_tokens is not None:
+        return node.total_tokens
+    return sum(file_node.tokens for file_node in iter_file_nodes(node))
 
 
-def format_file_tree(
-    node: FileNode, max_tokens: int, indent: str = "", useColors: bool = False
-) -> str:
-    output = ""
+class TreeRow(NamedTuple):
+    """One line of the file tree, independent of the output format."""
+
+    depth: int
+    name: str
+    path: str
+    is_directory: bool
+    excluded: bool
+    is_binary: bool
+    estimated: bool
+    tokens: int  # Total of the files below, for a directory
+    files: int  # Included files below a directory, 1 for an included file
+    bytes: int
+    hidden: bool  # Inside an excluded directory, so not shown in text
+    collapsed: int = 0  # Entries summarized by this row, which is not a node
+
+
+def _tree_row(depth: int, node: FileNode, hidden: bool = False) -> TreeRow:
     if node.node_type == "directory":
-        if node.excluded:
-            output += f"{indent}[Excluded] 🚫📁 {node.name}\n"
-        else:
-            output += f"{indent}📁 {node.name}\n"
-            for child in node.children:
-                output += format_file_tree(
-                    child, max_tokens, indent + "    ", useColors
-                )
+        tokens, files, size = node.total_tokens, node.total_files, node.total_bytes
     else:
-        percentage = node.tokens / max_tokens if max_tokens else 0
+        tokens, files, size = node.tokens, int(not node.excluded), node.size
+    return TreeRow(
+        depth,
+        node.name,
+        node.path,
+        node.node_type == "directory",
+        node.excluded,
+        node.is_binary,
+        node.estimated,
+        tokens,
+        files,
+        size,
+        hidden,
+    )
+
+
+def _visible_children(
+    node: FileNode, max_children: int
+) -> Tuple[List[FileNode], List[FileNode]]:
+    """
+    Splits the children of a directory into those shown, in their order,
+    and the rest: all are shown unless there are more than max_children,
+    in which case only the max_children with the most tokens are.
+    """
+    children = node.children
+    if not max_children or len(children) <= max_children:
+        return children, []
+
+    def tokens(child: FileNode) -> int:
+        return child.total_tokens if child.node_type == "directory" else child.tokens
+
+    top = heapq.nlargest(
+        max_children, range(len(children)), key=lambda i: tokens(children[i])
+    )
+    shown = set(top)
+    return (
+        [children[i] for i in sorted(shown)],
+        [child for i, child in enumerate(children) if i not in shown],
+    )
+
+
+def layout_tree(
+    node: FileNode, max_children: int = 0, max_depth: int = 0
+) -> List[TreeRow]:
+    """
+    Lays out the tree once, in display order. Every output format is a
+    serialization of these rows: render_tree_text for the terminal and the
+    prompt, and the Markdown and PDF generators.
+
+    With max_children, a directory with more children only shows the
+    max_children costing the most tokens, followed by one collapsed row
+    totalling the others. With max_depth, directories that deep are shown
+    with their totals but not expanded.
+    """
+    if node.node_type == "directory" and node.total_tokens is None:
+        aggregate_directories(node)
+    rows = []
+    # Entries are (depth, node, hidden); a TreeRow is a collapsed row
+    stack = [(0, node, False)]
+    while stack:
+        entry = stack.pop()
+        if isinstance(entry, TreeRow):
+            rows.append(entry)
+            continue
+        depth, node, hidden = entry
+        rows.append(_tree_row(depth, node, hidden))
+        if node.node_type != "directory" or (max_depth and depth >= max_depth):
+            continue
+        shown, rest = _visible_children(node, max_children)
+        if rest:
+            stack.append(_collapsed_row(depth + 1, node, rest, hidden or node.excluded))
+        stack.extend(
+            (depth + 1, child, hidden or node.excluded) for child in reversed(shown)
+        )
+    return rows
+
+
+def _collapsed_row(
+    depth: int, parent: FileNode, nodes: List[FileNode], hidden: bool
+) -> TreeRow:
+    rows = [_tree_row(depth, node) for node in nodes]
+    return TreeRow(
+        depth,
+        "",
+        parent.path,
+        False,
+        False,
+        False,
+        any(row.estimated for row in rows),
+        sum(row.tokens for row in rows),
+        sum(row.files for row in rows),
+        sum(row.bytes for row in rows),
+        hidden,
+        len(rows),
+    )
+
+
+def directory_totals(row: TreeRow, color: str = "", reset: str = "") -> str:
+    """The totals shown next to a directory, such as "1,234 tokens, 5 files"."""
+    files = "file" if row.files == 1 else "files"
+    return f"{color}{format_number(row.tokens)}{reset} tokens, {format_number(row.files)} {files}"
+
+
+def collapsed_summary(row: TreeRow, color: str = "", reset: str = "") -> str:
+    """The text of a collapsed row, such as "… and 120 more: 1,234 tokens, 118 files"."""
+    return f"… and {format_number(row.collapsed)} more: {directory_totals(row, color, reset)}"
+
+
+def render_tree_text(
+    rows: Sequence[TreeRow], max_tokens: int, indent: str = "", useColors: bool = False
+) -> str:
+    """Serializes the rows as the text tree, with ANSI colors if useColors."""
+    lines = []
+    for row in rows:
+        if row.hidden:
+            continue
+        prefix = indent + "    " * row.depth
+        percentage = row.tokens / max_tokens if max_tokens else 0
         color = get_color_for_percentage(percentage) if useColors else ""
         reset = Style.RESET_ALL if useColors else ""
 
-        # Check if it's a binary file - use a safer approach to check files
-        try:
-            # Use absolute path or node path as fallback
-            if os.path.isabs(node.path):
-                file_path = node.path
-            else:
-                file_path = os.path.join(os.getcwd(), node.path)
+        if row.collapsed:
+            lines.append(f"{prefix}{collapsed_summary(row, color, reset)}\n")
+            continue
 
-            # Check if file exists before attempting to determine if it's binary
-            if os.path.exists(file_path):
-                is_binary = is_binary_file(file_path)
+        if row.is_directory:
+            if row.excluded:
+                lines.append(f"{prefix}[Excluded] 🚫📁 {row.name}\n")
             else:
-                # If file doesn't exist, handle it gracefully
-                is_binary = False
-        except Exception as e:
-            # In case of any error, handle it gracefully
-            print(
-                f"{Fore.YELLOW}Error checking file {node.path}: {str(e)}{Style.RESET_ALL}"
-            )
-            is_binary = False
+                totals = directory_totals(row, color, reset)
+                lines.append(f"{prefix}📁 {row.name} ({totals})\n")
+            continue
 
-        file_emoji = "📎" if is_binary else "📄"
+        file_emoji = "📎" if row.is_binary else "📄"
 
         # Format the name - yellow for binary files
-        if is_binary:
+        if row.is_binary:
             name_display = (
-                f"{Fore.YELLOW}{node.name}{Style.RESET_ALL}" if useColors else node.name
+                f"{Fore.YELLOW}{row.name}{Style.RESET_ALL}" if useColors else row.name
             )
         else:
-            name_display = node.name
+            name_display = row.name
 
-        if node.excluded:
-            output += f"{indent}[Excluded] 🚫{file_emoji} {name_display}\n"
+        if row.excluded:
+            lines.append(f"{prefix}[Excluded] 🚫{file_emoji} {name_display}\n")
         else:
-            output += (
-                f"{indent}{file_emoji} {color}{node.tokens}{reset} {name_display}\n"
+            approximate = "~" if row.estimated else ""
+            lines.append(
+                f"{prefix}{file_emoji} {color}{approximate}{row.tokens}{reset} {name_display}\n"
             )
-    return output
+    return "".join(lines)
+
+
+def format_file_tree(
+    node: FileNode, max_tokens: int, indent: str = "", useColors: bool = False
+) -> str:
+    return render_tree_text(layout_tree(node), max_tokens, indent, useColors)
+
+
+def format_top_directories(root_node: FileNode, count: int) -> str:
+    """Ranks the directories below the root by the tokens of their subtree."""
+    if root_node.node_type == "directory" and root_node.total_tokens is None:
+        aggregate_directories(root_node)
+    total = sum_file_tokens(root_node)
+    directories = [
+        node
+        for depth, node in walk_tree(root_node, descend_excluded=False)
+        if node.node_type == "directory" and depth > 0 and not node.excluded
+    ]
+    top = heapq.nlargest(count, directories, key=lambda node: node.total_tokens)
+    lines = [f"Top {len(top)} directories by tokens:"]
+    for rank, node in enumerate(top, start=1):
+        row = _tree_row(0, node)
+        share = row.tokens / total if total else 0
+        lines.append(
+            f"{rank:>4}. {row.path}: {directory_totals(row)}, "
+            f"{format_bytes(row.bytes)} ({share:.1%} of tokens)"
+        )
+    return "\n".join(lines)
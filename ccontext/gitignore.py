@@ -0,0 +1,151 @@
+# ccontext/gitignore.py
+import re
+from typing import List, Optional
+
+# Matches any number of leading directories, including none
+ANY_DIRECTORIES = "(?:.*/)?"
+
+
+def translate_pattern(pattern: str) -> str:
+    """
+    Translates a single .gitignore glob into a regular expression.
+    Wildcards never match "/", except for "**" between slashes.
+    """
+    i, n = 0, len(pattern)
+    regex = []
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            j = i
+            while j < n and pattern[j] == "*":
+                j += 1
+            bounded_left = i == 0 or pattern[i - 1] == "/"
+            bounded_right = j == n or pattern[j] == "/"
+            if j - i == 2 and bounded_left and bounded_right:
+                if j == n:
+                    regex.append(".*")  # "foo/**" matches everything inside
+                    i = j
+                else:
+                    regex.append(ANY_DIRECTORIES)  # "**/" matches zero or more dirs
+                    i = j + 1
+                continue
+            regex.append("[^/]*")
+            i = j
+            continue
+        if c == "?":
+            regex.append("[^/]")
+        elif c == "[":
+            j = i + 1
+            if j < n and pattern[j] in "!^":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            j = pattern.find("]", j)
+            if j == -1:
+                regex.append(re.escape(c))
+            else:
+                body = pattern[i + 1 : j].replace("\\", "\\\\")
+                if body[0] in "!^":
+                    body = "^" + body[1:]
+                regex.append(f"(?!/)[{body}]")
+                i = j
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            regex.append(re.escape(pattern[i]))
+        else:
+            regex.append(re.escape(c))
+        i += 1
+    return "".join(regex)
+
+
+class GitignoreRules:
+    """
+    The rules of a single .gitignore file, compiled once into two combined
+    regexes: one for directories and one for files (which skips rules that
+    end in "/"). Rules are tried in reverse so the first alternative that
+    matches is the last matching rule in the file, as git expects.
+    """
+
+    def __init__(self, base: str, lines: List[str]):
+        # Directory of the .gitignore relative to the root, "" for the root
+        self.base = base
+        self.prefix = f"{base}/" if base else ""
+        self.negations = []
+        dir_alternatives = []
+        file_alternatives = []
+
+        for line in lines:
+            rule = self._parse_line(line)
+            if rule is None:
+                continue
+            regex, negate, dir_only = rule
+            name = f"r{len(self.negations)}"
+            self.negations.append(negate)
+            if negate:
+                # Re-including a directory does not re-include its contents
+                dir_alternatives.append(f"(?P<{name}>{regex})")
+                if not dir_only:
+                    file_alternatives.append(f"(?P<{name}>{regex})")
+                continue
+            # An ignored directory also covers everything below it
+            dir_alternatives.append(f"(?P<{name}>{regex}(?:/.*)?)")
+            if dir_only:
+                file_alternatives.append(f"(?P<{name}>{regex}/.*)")
+            else:
+                file_alternatives.append(f"(?P<{name}>{regex}(?:/.*)?)")
+
+        self.dir_regex = self._combine(dir_alternatives)
+        self.file_regex = self._combine(file_alternatives)
+
+    @staticmethod
+    def _parse_line(line: str):
+        """Returns (regex, negate, dir_only) for a line, or None for blanks and comments."""
+        line = line.rstrip("\r")
+        # Trailing spaces are ignored unless escaped with a backslash
+        while line.endswith(" ") and not line.endswith("\\ "):
+            line = line[:-1]
+        if not line or line.startswith("#"):
+            return None
+
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            return None
+
+        # A slash at the start or in the middle anchors the pattern to the
+        # directory of the .gitignore, otherwise it matches at any depth
+        anchored = "/" in line
+        line = line.lstrip("/")
+        regex = translate_pattern(line)
+        if not anchored:
+            regex = ANY_DIRECTORIES + regex
+        return regex, negate, dir_only
+
+    @staticmethod
+    def _combine(alternatives: List[str]) -> Optional["re.Pattern"]:
+        if not alternatives:
+            return None
+        return re.compile("|".join(reversed(alternatives)), re.DOTALL)
+
+    def __bool__(self) -> bool:
+        return bool(self.negations)
+
+    def match(self, relative_path: str, is_dir: bool) -> Optional[bool]:
+        """
+        Matches a path relative to the root against these rules.
+        Returns True if ignored, False if re-included by a "!" rule, or None
+        when no rule applies.
+        """
+        if not relative_path.startswith(self.prefix):
+            return None
+        regex = self.dir_regex if is_dir else self.file_regex
+        if regex is None:
+            return None
+        m = regex.fullmatch(relative_path, len(self.prefix))
+        if m is None:
+            return None
+        return not self.negations[int(m.lastgroup[1:])]
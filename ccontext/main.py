@@ -1,21 +1,39 @@
+import contextlib
 import importlib.resources as resources
 import json
 import os
+import sys
 from pathlib import Path
 
 from colorama import Fore, Style
 
 from ccontext.argument_parser import parse_arguments
+from ccontext.bundle_cache import DEFAULT_MAX_BUNDLES, BundleCache
 from ccontext.configurator import copy_default_config
+from ccontext.file_node import DEFAULT_CONTENT_BUDGET, set_content_budget
 from ccontext.content_handler import combine_initial_content
 from ccontext.file_system import collect_excludes_includes
-from ccontext.file_tree import build_file_tree, extract_file_contents, format_file_tree
-from ccontext.md_generator import generate_md
+from ccontext.file_tree import (
+    FileSections,
+    build_file_tree,
+    format_top_directories,
+    layout_tree,
+    render_tree_text,
+    sum_file_tokens,
+)
 from ccontext.output_handler import handle_chunking_and_output
-from ccontext.pdf_generator import generate_pdf
-from ccontext.run_crawlers import run_crawler
+from ccontext.output_sinks import check_output_path
+from ccontext.token_cache import DEFAULT_MAX_ENTRIES, TokenCache, shared_token_cache
+from ccontext.token_estimator import TokenEstimator
+from ccontext.token_ledger import TokenLedger
 from ccontext.tokenizer import set_model_type_and_buffer
-from ccontext.utils import initialize_environment, set_verbose
+from ccontext.tree_index import DEFAULT_COMPACT_THRESHOLD, TreeNodeView
+from ccontext.utils import (
+    SourceChangedError,
+    format_number,
+    initialize_environment,
+    set_verbose,
+)
 
 DEFAULT_CONFIG_FILENAME = "config.json"
 USER_CONFIG_DIR = Path.home() / ".ccontext"
@@ -65,96 +83,339 @@ def main(
     generate_pdf_flag: bool = False,
     generate_md_flag: bool = False,
     crawl: bool = False,
+    use_git_index: bool = False,
+    use_token_cache: bool = True,
+    workers: int = None,
+    estimate: bool = False,
+    verify_tokens: bool = False,
+    chunk_strategy: str = None,
+    output: str = None,
+    top_dirs: int = None,
+    max_depth: int = None,
+    max_children: int = None,
+    keep_warm: bool = False,
+    watch: bool = False,
 ):
-    root_path = os.path.abspath(root_path or os.getcwd())
-    config = load_config(root_path, config_path)
-
-    # Get uploadable extensions from config
-    uploadable_extensions = set(config.get("uploadable_extensions", []))
-
-    # Command line arguments have the highest priority
-    cmd_includes = includes or []
-    cmd_excludes = excludes or []
-
-    # Collect excludes and includes, with priority rules applied
-    config_includes = config.get("included_folders_files", [])
-    config_excludes = config.get("excluded_folders_files", [])
-
-    # Always ensure crawl4ai output directories are excluded
-    if "**/crawl4ai-output" not in config_excludes:
-        config_excludes.append("**/crawl4ai-output/**")
-
-    excludes, includes, gitignore_handler = collect_excludes_includes(
-        config_excludes,
-        cmd_excludes,
-        cmd_includes,
-        config_includes,
-        root_path,
-        ignore_gitignore,
-    )
+    # With output on stdout ("-"), everything else is printed to stderr
+    stdout = sys.stdout
+    diagnostics = sys.stderr if output == "-" else stdout
+    with contextlib.redirect_stdout(diagnostics):
+        check_output_path(output)
+        root_path = os.path.abspath(root_path or os.getcwd())
+        config = load_config(root_path, config_path)
 
-    max_tokens = max_tokens or int(config.get("max_tokens", 32000))
+        process_workers = workers or config.get("workers", 0)
 
-    verbose = verbose or config.get("verbose", False)
-    set_verbose(verbose or config.get("verbose", False))
+        # The encoding loads in the background while the excludes are
+        # collected and the tree is walked, unless only estimating. Worker
+        # processes load their own, so it is not worth a thread then.
+        set_model_type_and_buffer(
+            config.get("model_type", "gpt-4o"),
+            config.get("buffer_size", 0.05),
+            preload=not (estimate or process_workers),
+        )
 
-    context_prompt = config.get(
-        "context_prompt",
-        DEFAULT_CONTEXT_PROMPT,
-    )
-    set_model_type_and_buffer(
-        config.get("model_type", "gpt-4o"), config.get("buffer_size", 0.05)
-    )
-    # END CONFIG LOGIC
-
-    # START MAIN LOGIC
-    # init colorama
-    initialize_environment()
-
-    print(f"{Fore.CYAN}Root Path: {root_path}\n{Style.RESET_ALL}")
-
-    # crawling should happen before tree building
-    if crawl:
-        urls_to_crawl = config.get("urls_to_crawl", [])
-        for url_config in urls_to_crawl:
-            # Convert to crawl4ai config format if needed
-            if "url" not in url_config and "website" in url_config:
-                url_config["url"] = url_config.pop("website")
-
-            # Set default output filename if not present
-            if "outputFileName" not in url_config:
-                url = url_config["url"]
-                url_config["outputFileName"] = (
-                    f"crawl_result_{url.replace('://', '_').replace('/', '_')}.md"
+        # Get uploadable extensions from config
+        uploadable_extensions = set(config.get("uploadable_extensions", []))
+
+        # Command line arguments have the highest priority
+        cmd_includes = includes or []
+        cmd_excludes = excludes or []
+
+        # Collect excludes and includes, with priority rules applied
+        config_includes = config.get("included_folders_files", [])
+        config_excludes = config.get("excluded_folders_files", [])
+
+        # Always ensure crawl4ai output directories are excluded
+        if "**/crawl4ai-output" not in config_excludes:
+            config_excludes.append("**/crawl4ai-output/**")
+
+        excludes, includes, gitignore_handler = collect_excludes_includes(
+            config_excludes,
+            cmd_excludes,
+            cmd_includes,
+            config_includes,
+            root_path,
+            ignore_gitignore,
+        )
+
+        max_tokens = max_tokens or int(config.get("max_tokens", 32000))
+
+        verbose = verbose or config.get("verbose", False)
+        set_verbose(verbose or config.get("verbose", False))
+
+        context_prompt = config.get(
+            "context_prompt",
+            DEFAULT_CONTEXT_PROMPT,
+        )
+        set_content_budget(
+            config.get("content_memory_mb", DEFAULT_CONTENT_BUDGET >> 20) << 20
+        )
+        # END CONFIG LOGIC
+
+        # START MAIN LOGIC
+        # init colorama
+        initialize_environment()
+
+        print(f"{Fore.CYAN}Root Path: {root_path}\n{Style.RESET_ALL}")
+
+        # crawling should happen before tree building
+        if crawl:
+            from ccontext.run_crawlers import run_crawler
+
+            urls_to_crawl = config.get("urls_to_crawl", [])
+            for url_config in urls_to_crawl:
+                # Convert to crawl4ai config format if needed
+                if "url" not in url_config and "website" in url_config:
+                    url_config["url"] = url_config.pop("website")
+
+                # Set default output filename if not present
+                if "outputFileName" not in url_config:
+                    url = url_config["url"]
+                    url_config["outputFileName"] = (
+                        f"crawl_result_{url.replace('://', '_').replace('/', '_')}.md"
+                    )
+
+                run_crawler(url_config)
+
+            # Ensure crawl4ai output directories are excluded
+            excludes = excludes.combine(["**/crawl4ai-output/**"])
+
+        if max_children is None:
+            max_children = config.get("tree_max_children", 0)
+        if max_depth is None:
+            max_depth = config.get("tree_max_depth", 0)
+        if top_dirs is None:
+            top_dirs = config.get("top_dirs", 0)
+        use_git_index = use_git_index or config.get("use_git_index", False)
+        chunk_strategy = chunk_strategy or config.get("chunk_strategy", "sequential")
+
+        def deliver(initial_content, root_node, ledger):
+            # Generate the output, one file section at a time
+            handle_chunking_and_output(
+                initial_content,
+                FileSections(root_node),
+                max_tokens,
+                verbose,
+                ledger,
+                verify_tokens or config.get("verify_token_ledger", False),
+                chunk_strategy,
+                output,
+                stdout,
+            )
+
+        def stop_on_changed_source(error):
+            # Emitting the current text would break the counted chunk sizes
+            print(
+                f"{Fore.RED}{error}, the output is incomplete. Run ccontext again to include the change.{Style.RESET_ALL}"
+            )
+            sys.exit(1)
+
+        # Everything besides the files that shapes the tree
+        tree_settings = dict(
+            excludes=list(excludes),
+            includes=list(includes),
+            gitignore=gitignore_handler is not None,
+            use_git_index=use_git_index,
+            uploadable_extensions=sorted(uploadable_extensions),
+            model_type=config.get("model_type", "gpt-4o"),
+        )
+
+        # The daemon keeps the tree of each root and patches it from a
+        # watcher between runs, instead of walking it again. Estimates and
+        # the git index build it differently, so they are not kept.
+        resident_key = None
+        resident_root = None
+        if (
+            keep_warm
+            and not (estimate or watch or use_git_index)
+            and config.get("daemon_keep_tree", True)
+            and os.path.isdir(root_path)
+        ):
+            from ccontext.watcher import resident_tree
+
+            resident_key = (root_path, json.dumps(tree_settings, sort_keys=True))
+            resident_root = resident_tree(resident_key)
+
+        bundles = None
+        if (
+            use_token_cache
+            and config.get("bundle_cache", True)
+            and resident_root is None
+            and not (estimate or watch or generate_pdf_flag or generate_md_flag)
+            and not (verify_tokens or config.get("verify_token_ledger", False))
+        ):
+            # Everything besides the tree that shapes the rendered output
+            bundles = BundleCache(
+                root_path,
+                dict(
+                    tree_settings,
+                    max_tokens=max_tokens,
+                    context_prompt=context_prompt,
+                    max_children=max_children,
+                    max_depth=max_depth,
+                    top_dirs=top_dirs,
+                ),
+                max_bundles=config.get("bundle_cache_max_entries", DEFAULT_MAX_BUNDLES),
+            )
+
+        token_cache = None
+        if use_token_cache and config.get("token_cache", True):
+            cache_args = (
+                config.get("model_type", "gpt-4o"),
+                config.get("token_cache_max_entries", DEFAULT_MAX_ENTRIES),
+            )
+            # The daemon keeps its caches open and loaded between runs
+            if keep_warm:
+                token_cache = shared_token_cache(*cache_args)
+            else:
+                token_cache = TokenCache(cache_args[0], max_entries=cache_args[1])
+            token_cache.load(root_path)
+
+        estimator = None
+        if estimate:
+            # Calibrate the bytes-per-token ratios from earlier exact counts
+            estimator = TokenEstimator.from_history(
+                token_cache.history() if token_cache else []
+            )
+
+        if resident_root is not None:
+            root_node = resident_root
+        else:
+            # Build file tree with gitignore support
+            root_node = build_file_tree(
+                root_path,
+                excludes,
+                includes,
+                uploadable_extensions,
+                gitignore_handler,
+                use_git_index=use_git_index,
+                token_cache=token_cache,
+                process_workers=process_workers,
+                estimator=estimator,
+                # Unchanged directories are taken from the last run's bundle
+                reuse_directory=bundles.reuse_directory if bundles else None,
+                fingerprints=bundles.fingerprints if bundles else None,
+                # Very large trees are kept as arrays instead of FileNode objects,
+                # which watch mode and the daemon could not patch
+                compact_threshold=(
+                    0
+                    if watch or resident_key
+                    else config.get("compact_tree_threshold", DEFAULT_COMPACT_THRESHOLD)
+                ),
+            )
+            if resident_key:
+                from ccontext.watcher import TreeUpdater, keep_resident_tree
+
+                keep_resident_tree(
+                    resident_key,
+                    TreeUpdater(
+                        root_node,
+                        root_path,
+                        excludes,
+                        includes,
+                        uploadable_extensions,
+                        gitignore_handler,
+                        token_cache,
+                    ),
+                    poll_interval=config.get("watch_poll_interval_ms", 1000) / 1000,
+                    backend=config.get("watch_backend", "auto"),
                 )
 
-            run_crawler(url_config)
+        if token_cache and (keep_warm or watch):
+            token_cache.flush()
+        elif token_cache:
+            token_cache.close()
 
-        # Ensure crawl4ai output directories are excluded
-        if "**/crawl4ai-output" not in excludes:
-            excludes.append("**/crawl4ai-output/**")
+        if bundles and bundles.hit:
+            # Nothing below the root changed: emit the last output as is
+            print(
+                f"{Fore.CYAN}No changes since the last run, reusing its output.{Style.RESET_ALL}\n"
+            )
+            for text in bundles.console:
+                print(text)
+            try:
+                deliver(bundles.initial_content, root_node, bundles.ledger())
+            except SourceChangedError as e:
+                stop_on_changed_source(e)
+            return
 
-    # Build file tree with gitignore support
-    root_node = build_file_tree(
-        root_path, excludes, includes, uploadable_extensions, gitignore_handler
-    )
+        def emit(root_node):
+            # Returns what was printed, the initial content and the ledger of
+            # the output, or None for an estimate
+            # Lay the tree out once; the CLI, prompt, MD and PDF trees serialize it
+            tree_rows = layout_tree(
+                root_node, max_children=max_children, max_depth=max_depth
+            )
+            console = [render_tree_text(tree_rows, max_tokens, useColors=True)]
+            if top_dirs > 0:
+                console.append(format_top_directories(root_node, top_dirs) + "\n")
+            for text in console:
+                print(text)
 
-    # Always print the file tree in the CLI using the format_file_tree function
-    tree_output = format_file_tree(root_node, max_tokens, useColors=True)
-    print(tree_output)
+            if estimate:
+                # Dry run: nothing was read, so there is no output to generate
+                total_tokens = sum_file_tokens(root_node)
+                print(
+                    f"Estimated tokens: ~{format_number(total_tokens)}/{format_number(max_tokens)}"
+                )
+                return None
 
-    if generate_pdf_flag:
-        generate_pdf(root_path, root_node)
+            # The PDF and Markdown generators are only imported when requested,
+            # reportlab alone takes longer to import than the rest of ccontext
+            if generate_pdf_flag:
+                from ccontext.pdf_generator import generate_pdf
 
-    if generate_md_flag:
-        generate_md(root_node, root_path)
+                generate_pdf(root_path, root_node, tree_rows)
 
-    # Generate clipboard output
-    file_contents_list = extract_file_contents(root_node)
-    initial_content = combine_initial_content(
-        root_node, root_path, context_prompt, max_tokens
-    )
-    handle_chunking_and_output(initial_content, file_contents_list, max_tokens, verbose)
+            if generate_md_flag:
+                from ccontext.md_generator import generate_md
+
+                generate_md(root_node, root_path, tree_rows)
+
+            initial_content = combine_initial_content(
+                root_node, root_path, context_prompt, max_tokens, tree_rows
+            )
+            ledger = TokenLedger.from_tree(initial_content, root_node)
+            deliver(initial_content, root_node, ledger)
+            return console, initial_content, ledger
+
+        try:
+            emitted = emit(root_node)
+            # A compact tree is too large to be worth storing node by node
+            if bundles and emitted and not isinstance(root_node, TreeNodeView):
+                bundles.store(root_node, *emitted)
+        except SourceChangedError as e:
+            if not watch:
+                stop_on_changed_source(e)
+            # The watcher reports the change, which emits the context again
+            print(
+                f"{Fore.YELLOW}{e}, emitting again once it is applied.{Style.RESET_ALL}"
+            )
+
+        if watch:
+            from ccontext.watcher import TreeUpdater, watch_tree
+
+            # Patch the tree on every change and emit the context again
+            updater = TreeUpdater(
+                root_node,
+                root_path,
+                excludes,
+                includes,
+                uploadable_extensions,
+                gitignore_handler,
+                token_cache,
+                estimator,
+            )
+            watch_tree(
+                updater,
+                emit,
+                debounce=config.get("watch_debounce_ms", 300) / 1000,
+                poll_interval=config.get("watch_poll_interval_ms", 1000) / 1000,
+                backend=config.get("watch_backend", "auto"),
+            )
+            if token_cache and not keep_warm:
+                token_cache.close()
 
 
 if __name__ == "__main__":
@@ -170,4 +431,15 @@ if __name__ == "__main__":
         args.generate_pdf,
         args.generate_md,
         args.crawl,
+        args.git_index,
+        not args.no_cache,
+        args.workers,
+        args.estimate,
+        args.verify_tokens,
+        args.chunk_strategy,
+        args.output,
+        args.top_dirs,
+        args.max_depth,
+        args.max_children,
+        watch=args.watch,
     )
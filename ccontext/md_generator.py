@@ -1,8 +1,14 @@
-import os
 from pathlib import Path
+from typing import Optional, Sequence
 
 from ccontext.file_node import FileNode
-from ccontext.utils import is_binary_file
+from ccontext.file_tree import (
+    TreeRow,
+    collapsed_summary,
+    directory_totals,
+    iter_file_nodes,
+    layout_tree,
+)
 
 
 class MDGenerator:
@@ -24,56 +30,63 @@ class MDGenerator:
             f.writelines(self.md_content)
         print(f"Markdown file generated at {self.output_path}")
 
-    def generate_md(self, root_node: FileNode, root_path: str):
+    def generate_md(
+        self,
+        root_node: FileNode,
+        root_path: str,
+        tree_rows: Optional[Sequence[TreeRow]] = None,
+    ):
         self.add_section(
             "## [[SYSTEM INSTRUCTIONS]]",
             "The following output presents a detailed directory structure and file contents from a specified root path. The file tree includes both excluded and included files and directories, clearly marking exclusions. Each file's content is displayed with comprehensive headings and separators to enhance readability and facilitate detailed parsing for extracting hierarchical and content-related insights. If the data represents a codebase, interpret and handle it as such, providing appropriate assistance as a programmer AI assistant.\n## [[END SYSTEM INSTRUCTIONS]]",
         )
         self.add_section(f"## Root Path: {root_path}")
         self.add_section("## FILE TREE ##")
-        self.format_file_tree(root_node)
+        self.format_file_tree(
+            layout_tree(root_node) if tree_rows is None else tree_rows
+        )
         self.add_section("## END FILE TREE ##")
         self.add_section("\n#### Detailed File Contents")
         self.add_file_contents(root_node)
         self.save_md()
 
-    def format_file_tree(
-        self, node: FileNode, indent: str = "", parent_anchor: str = ""
-    ):
-        anchor = f"{parent_anchor}-{node.name.lower().replace(' ', '-')}"
-        if node.node_type == "directory":
-            self.md_content.append(f"{indent}📁 {node.name}\n")
-            for child in node.children:
-                self.format_file_tree(child, indent + ("-" * 4), anchor)
-        elif node.node_type == "file":
-            anchor = node.path.lower().replace("/", "-").replace(" ", "-")
-            # Check if it's a binary file
-            is_binary = is_binary_file(os.path.join(os.getcwd(), node.path))
-            file_emoji = "📎" if is_binary else "📄"
+    def format_file_tree(self, rows: Sequence[TreeRow], indent: str = ""):
+        for row in rows:
+            prefix = indent + "-" * 4 * row.depth
+            if row.collapsed:
+                self.md_content.append(f"{prefix} {collapsed_summary(row)}\n")
+                continue
+            if row.is_directory:
+                totals = f" ({directory_totals(row)})" if not row.excluded else ""
+                self.md_content.append(f"{prefix}📁 {row.name}{totals}\n")
+                continue
+            anchor = row.path.lower().replace("/", "-").replace(" ", "-")
+            file_emoji = "📎" if row.is_binary else "📄"
 
             # Add a note for binary files using emphasis
-            name_display = f"*{node.name}*" if is_binary else node.name
+            name_display = f"*{row.name}*" if row.is_binary else row.name
             self.md_content.append(
-                f"{indent} [{file_emoji} {node.tokens} {name_display}](#{anchor})\n"
+                f"{prefix} [{file_emoji} {row.tokens} {name_display}](#{anchor})\n"
             )
 
     def add_file_contents(self, node: FileNode):
-        if node.node_type == "file":
+        for node in iter_file_nodes(node):
             anchor = node.path.lower().replace("/", "-").replace(" ", "-")
             content = node.get_content()
             self.add_section(
                 f'##### 📄 <a id="{anchor}"></a>{node.path} - {node.tokens} tokens',
                 f"```\n{content}\n```",
             )
-        elif node.node_type == "directory":
-            for child in node.children:
-                self.add_file_contents(child)
 
 
-def generate_md(root_node: FileNode, root_path: str):
+def generate_md(
+    root_node: FileNode,
+    root_path: str,
+    tree_rows: Optional[Sequence[TreeRow]] = None,
+):
     output_path = str(Path(root_path) / "ccontext-output.md")
     md_gen = MDGenerator(output_path)
-    md_gen.generate_md(root_node, root_path)
+    md_gen.generate_md(root_node, root_path, tree_rows)
 
 
 if __name__ == "__main__":
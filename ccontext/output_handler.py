@@ -1,20 +1,111 @@
+import os
+import sys
+from typing import Iterator, Optional, Sequence, TextIO
+
 from colorama import Fore, Style
 
-from ccontext.clipboard import copy_to_clipboard
-from ccontext.tokenizer import chunk_text, tokenize_text
+from ccontext.chunk_planner import chunk_capacity, format_chunk_manifest, plan_chunks
+from ccontext.file_tree import END_OF_CONTENTS_MARKER
+from ccontext.output_sinks import (
+    StreamSink,
+    TeeSink,
+    is_interactive_output,
+    open_output_sink,
+)
+from ccontext.token_ledger import TokenLedger
+from ccontext.tokenizer import (
+    JOIN_TOKENS,
+    count_tokens,
+    get_token_counter,
+    tail_within_tokens,
+)
 from ccontext.utils import format_number
 
+# Lines of the previous chunk repeated at the start of the next one, and
+# the most tokens they may take
+PREVIOUS_CHUNK_LINES = 10
+PREVIOUS_CHUNK_TAIL_TOKENS = 256
+
+# Chunk count used to measure the wrapper text, covering up to 999,999 chunks
+MAX_CHUNK_COUNT = 999_999
+
+
+def wrap_chunk(chunk: str, index: int, total: int, previous_chunk: str = "") -> str:
+    """Wraps a chunk in the text that tells the LLM where it stands."""
+    chunk_header = f"### Chunk {index + 1} of {total}"
+    if index == 0:
+        return f"""## Initialization\nThe following content will be delivered in multiple chunks. This is to ensure all data is processed correctly. There will be a total of {total} chunks. Thoroughly read the chunk and reply with a short summary of the content that was inserted. Until you receive the final chunk, this will be marked by '###This is the final chunk.###', you will have to make a summary of all the summaries that you gave. Once you have received the final chunk, reply with the final summary. '\n\n{chunk_header}: File Tree and Initial File Contents\n{chunk}\n###More chunks to follow...###"""
+    if index == total - 1:
+        return f"{chunk_header}\n{chunk}\n###This is the final chunk.###"
+    previous_chunk_summary = "Previous chunk ended with:\n" + tail_within_tokens(
+        "\n".join(previous_chunk.splitlines()[-PREVIOUS_CHUNK_LINES:]),
+        PREVIOUS_CHUNK_TAIL_TOKENS,
+    )
+    return f"{chunk_header} (continued from Chunk {index})\n{previous_chunk_summary}\n{chunk}\n###More chunks to follow...###"
+
+
+def chunk_wrapper_tokens() -> int:
+    """
+    The most tokens wrap_chunk adds to a chunk: the longest wrapper measured
+    with the widest chunk numbers, plus the bounded previous chunk tail and
+    the joins around the chunk and the tail.
+    """
+    total = MAX_CHUNK_COUNT
+    first = count_tokens(wrap_chunk("", 0, total))
+    middle = count_tokens(wrap_chunk("", total - 2, total)) + (
+        PREVIOUS_CHUNK_TAIL_TOKENS + JOIN_TOKENS
+    )
+    last = count_tokens(wrap_chunk("", total - 1, total))
+    return max(first, middle, last) + 2 * JOIN_TOKENS
+
 
 def handle_chunking_and_output(
     initial_content: str,
-    file_contents_list: list,
+    file_contents_list: Sequence[str],
     max_tokens: int,
     verbose: bool,
+    ledger: Optional[TokenLedger] = None,
+    verify_tokens: bool = False,
+    chunk_strategy: str = "sequential",
+    output: Optional[str] = None,
+    stdout: Optional[TextIO] = None,
 ):
-    """Calculate token length and handle chunking if necessary."""
-    end_marker = "### ========== End of Detailed File Contents ==========\n"
-    full_output = initial_content + "".join(file_contents_list) + end_marker
-    total_tokens = len(tokenize_text(full_output))
+    """
+    Calculate token length and handle chunking if necessary. With a ledger
+    for the same contents, the counts come from the ledger instead of
+    encoding the output again; verify_tokens checks them with a full encode,
+    and checks that every wrapped chunk fits max_tokens.
+
+    Chunks are planned from token counts with chunk_strategy (see
+    chunk_planner.plan_chunks), a manifest of the plan is printed, and the
+    text of each chunk is only assembled when it is delivered.
+
+    The output is streamed piece by piece to the clipboard, or with output
+    to stdout ("-", written to stdout) or a file, so the whole context is
+    never joined into one string. file_contents_list may be a lazy sequence
+    such as file_tree.FileSections.
+    """
+    end_marker = END_OF_CONTENTS_MARKER
+    piece_count = len(file_contents_list) + 2
+
+    def piece_text(index: int) -> str:
+        if index == 0:
+            return initial_content
+        if index == piece_count - 1:
+            return end_marker
+        return file_contents_list[index - 1]
+
+    def iter_pieces() -> Iterator[str]:
+        yield initial_content
+        yield from file_contents_list
+        yield end_marker
+
+    if ledger is None:
+        total_tokens = sum(get_token_counter().count_batch(list(iter_pieces())))
+    elif verify_tokens:
+        total_tokens = ledger.verify("".join(iter_pieces()))
+    else:
+        total_tokens = ledger.total
 
     token_info = f"\nTokens: {Fore.GREEN if total_tokens <= max_tokens else Fore.RED}{format_number(total_tokens)}{Style.RESET_ALL}/{format_number(max_tokens)}"
 
@@ -24,43 +115,55 @@ def handle_chunking_and_output(
         )
         print(f"\n{token_info}")
 
-        chunks = chunk_text(
-            [initial_content] + file_contents_list + [end_marker], max_tokens
+        if ledger:
+            piece_tokens, labels = ledger.piece_tokens, ledger.labels
+        else:
+            piece_tokens = get_token_counter().count_batch(list(iter_pieces()))
+            labels = [""] * piece_count
+        chunks = plan_chunks(
+            piece_tokens,
+            chunk_capacity(max_tokens, chunk_wrapper_tokens()),
+            chunk_strategy,
+            groups=[os.path.dirname(label) for label in labels],
+            piece_text=piece_text,
+            keep_last=True,
         )
 
-        # uncomment to view all chunks, warning: stdout overload
-        # print("CHUNKS: ", chunks)
+        # Print the plan before any chunk is assembled
+        print(format_chunk_manifest(chunks, labels))
 
-        # Print chunk sizes
-        chunk_sizes = [len(tokenize_text(chunk)) for chunk in chunks]
-        for i, size in enumerate(chunk_sizes):
-            print(f"Chunk {i + 1}: {size} tokens")
-
-        for i, chunk in enumerate(chunks):
+        interactive = is_interactive_output(output)
+        previous_chunk = ""
+        for i, planned_chunk in enumerate(chunks):
             chunk_header = f"### Chunk {i + 1} of {len(chunks)}"
-            if i == 0:
-                chunk = f"""## Initialization\nThe following content will be delivered in multiple chunks. This is to ensure all data is processed correctly. There will be a total of {len(chunks)} chunks. Thoroughly read the chunk and reply with a short summary of the content that was inserted. Until you receive the final chunk, this will be marked by '###This is the final chunk.###', you will have to make a summary of all the summaries that you gave. Once you have received the final chunk, reply with the final summary. '\n\n{chunk_header}: File Tree and Initial File Contents\n{chunk}\n###More chunks to follow...###"""
-            elif i == len(chunks) - 1:
-                chunk = f"{chunk_header}\n{chunk}\n###This is the final chunk.###"
-            else:
-                previous_chunk_summary = "Previous chunk ended with:\n" + "\n".join(
-                    chunks[i - 1].splitlines()[-10:]
-                )
-                chunk = f"{chunk_header} (continued from Chunk {i})\n{previous_chunk_summary}\n{chunk}\n###More chunks to follow...###"
+            chunk_text = planned_chunk.materialize(piece_text)
+            chunk = wrap_chunk(chunk_text, i, len(chunks), previous_chunk)
+            previous_chunk = chunk_text
+            if verify_tokens:
+                wrapped_tokens = count_tokens(chunk)
+                if wrapped_tokens > max_tokens:
+                    print(
+                        f"{Fore.RED}Chunk {i + 1} is {wrapped_tokens} tokens with its wrapper, over the {max_tokens} limit.{Style.RESET_ALL}"
+                    )
 
-            print(
-                f"{Fore.MAGENTA}(Chunk {i + 1}/{len(chunks)}){Style.RESET_ALL} {Fore.CYAN}Press Enter to continue or type 'q' to abort: {Style.RESET_ALL}",
-                end="",
-            )
-            user_input = input()
-            if user_input.lower() == "q":
-                print(f"{Fore.YELLOW}Operation aborted by user.{Style.RESET_ALL}")
-                break
+            if interactive:
+                print(
+                    f"{Fore.MAGENTA}(Chunk {i + 1}/{len(chunks)}){Style.RESET_ALL} {Fore.CYAN}Press Enter to continue or type 'q' to abort: {Style.RESET_ALL}",
+                    end="",
+                )
+                user_input = input()
+                if user_input.lower() == "q":
+                    print(f"{Fore.YELLOW}Operation aborted by user.{Style.RESET_ALL}")
+                    break
 
             if verbose:
                 print(f"\n{chunk_header}:")
                 print(chunk)
-            copy_to_clipboard(chunk)
+            if output == "-":
+                # Chunks on stdout are separated by a blank line
+                chunk = f"{chunk}\n\n"
+            with open_output_sink(output, i + 1, stdout) as sink:
+                sink.write(chunk)
 
         if verbose:
             print(
@@ -68,6 +171,9 @@ def handle_chunking_and_output(
             )
     else:
         print(token_info)
-        if verbose:
-            print(full_output)
-        copy_to_clipboard(full_output)
+        sink = open_output_sink(output, stdout=stdout)
+        if verbose and output != "-":
+            sink = TeeSink(sink, StreamSink(sys.stdout))
+        with sink:
+            for piece in iter_pieces():
+                sink.write(piece)
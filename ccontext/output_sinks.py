@@ -0,0 +1,108 @@
+# ccontext/output_sinks.py
+import os
+import sys
+from typing import Optional, TextIO
+
+from colorama import Fore, Style
+
+from ccontext.clipboard import ClipboardSink
+
+
+class StreamSink:
+    """Writes the output straight to an open text stream, such as stdout."""
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+
+    def write(self, text: str):
+        self.stream.write(text)
+
+    def close(self):
+        self.stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FileSink(StreamSink):
+    """Writes the output to a file, replacing it."""
+
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            stream = open(path, "w", encoding="utf-8")
+        except OSError as e:
+            exit_on_unwritable_output(path, e.strerror or str(e))
+        super().__init__(stream)
+
+    def close(self):
+        self.stream.close()
+        print(f"{Fore.GREEN}Output written to {self.path}{Style.RESET_ALL}")
+
+
+class TeeSink:
+    """Writes the output to several sinks at once."""
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def write(self, text: str):
+        for sink in self.sinks:
+            sink.write(text)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def exit_on_unwritable_output(path: str, reason: str):
+    print(f"{Fore.RED}Cannot write the output to {path}: {reason}{Style.RESET_ALL}")
+    sys.exit(1)
+
+
+def check_output_path(output: Optional[str]):
+    """
+    Exits with an error if file output cannot be written where it was asked
+    for, before any work is done and before any chunk is written.
+    """
+    if not output or output == "-":
+        return
+    directory = os.path.dirname(os.path.abspath(output))
+    if not os.path.isdir(directory):
+        exit_on_unwritable_output(output, f"{directory} is not a directory")
+    if os.path.isdir(output):
+        exit_on_unwritable_output(output, "it is a directory")
+
+
+def is_interactive_output(output: Optional[str]) -> bool:
+    """Whether chunks go to the clipboard one at a time, waiting for the user."""
+    return not output
+
+
+def open_output_sink(
+    output: Optional[str],
+    chunk_number: Optional[int] = None,
+    stdout: Optional[TextIO] = None,
+):
+    """
+    Opens the sink for output: the clipboard when output is empty, stdout
+    for "-", otherwise a file. With a chunk_number, each chunk of file
+    output goes to its own file, numbered before the extension.
+    """
+    if not output:
+        return ClipboardSink()
+    if output == "-":
+        return StreamSink(stdout or sys.stdout)
+    if chunk_number is not None:
+        base, ext = os.path.splitext(output)
+        output = f"{base}.{chunk_number}{ext}"
+    return FileSink(output)
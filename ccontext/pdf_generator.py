@@ -1,4 +1,5 @@
 import os
+from typing import Optional, Sequence
 
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
@@ -17,7 +18,13 @@ from reportlab.platypus import (
 )
 
 from ccontext.file_node import FileNode
-from ccontext.utils import is_binary_file
+from ccontext.file_tree import (
+    TreeRow,
+    collapsed_summary,
+    directory_totals,
+    iter_file_nodes,
+    layout_tree,
+)
 
 
 class PDFGenerator:
@@ -72,7 +79,12 @@ class PDFGenerator:
         )
         return custom_styles
 
-    def create_pdf(self, root_node: FileNode, root_path: str):
+    def create_pdf(
+        self,
+        root_node: FileNode,
+        root_path: str,
+        tree_rows: Optional[Sequence[TreeRow]] = None,
+    ):
         self.doc = SimpleDocTemplate(self.output_path, pagesize=letter)
         self.story.append(
             Paragraph("Directory and File Contents", self.styles["Title"])
@@ -80,7 +92,9 @@ class PDFGenerator:
         self.story.append(Spacer(1, 0.2 * inch))
         self.add_table_of_contents()
         self.story.append(Paragraph(f"Root Path: {root_path}", self.styles["Heading2"]))
-        self.add_tree_section(root_node)
+        self.add_tree_section(
+            layout_tree(root_node) if tree_rows is None else tree_rows
+        )
         self.add_file_sections(root_node)
         self.doc.build(
             self.story,
@@ -91,75 +105,83 @@ class PDFGenerator:
         print(f"Total context size: ", root_node.calculate_size())
         print(f"PDF generated at {self.output_path}")
 
-    def add_tree_section(self, node: FileNode, indent: str = ""):
+    def add_tree_section(self, rows: Sequence[TreeRow], indent: str = ""):
         self.story.append(Paragraph("## FILE TREE ##", self.styles["Heading2"]))
-        self.format_file_tree(node, indent)
+        self.format_file_tree(rows, indent)
         self.story.append(Paragraph("## END FILE TREE ##", self.styles["Heading2"]))
         self.story.append(PageBreak())
 
-    def format_file_tree(self, node: FileNode, indent: str):
-        if node.node_type == "directory":
-            icon = "📁" if not node.excluded else "🚫📁"
-            self.story.append(
-                Paragraph(
-                    f"{indent}<font name='NotoEmoji'>{icon}</font> {node.name}",
-                    self.custom_styles["FileTree"],
+    def format_file_tree(self, rows: Sequence[TreeRow], indent: str):
+        for row in rows:
+            prefix = indent + "&nbsp;&nbsp;&nbsp;&nbsp;" * row.depth
+            if row.collapsed:
+                self.story.append(
+                    Paragraph(
+                        f"{prefix}{collapsed_summary(row)}",
+                        self.custom_styles["FileTree"],
+                    )
                 )
-            )
-            for child in node.children:
-                self.format_file_tree(child, indent + "&nbsp;&nbsp;&nbsp;&nbsp;")
-        else:
+                continue
+            if row.is_directory:
+                icon = "📁" if not row.excluded else "🚫📁"
+                totals = f" ({directory_totals(row)})" if not row.excluded else ""
+                self.story.append(
+                    Paragraph(
+                        f"{prefix}<font name='NotoEmoji'>{icon}</font> {row.name}{totals}",
+                        self.custom_styles["FileTree"],
+                    )
+                )
+                continue
+
             section_anchor = f"section_{len(self.toc)}"
-            self.toc.append((node.path, section_anchor))
+            self.toc.append((row.path, section_anchor))
 
-            # Check if it's a binary file
-            is_binary = is_binary_file(os.path.join(os.getcwd(), node.path))
-            file_emoji = "📎" if is_binary else "📄"
-            icon = file_emoji if not node.excluded else f"🚫{file_emoji}"
+            file_emoji = "📎" if row.is_binary else "📄"
+            icon = file_emoji if not row.excluded else f"🚫{file_emoji}"
 
             # Format name with yellow color for binary files
-            name_style = ' color="yellow"' if is_binary else ""
+            name_style = ' color="yellow"' if row.is_binary else ""
             self.story.append(
                 Paragraph(
-                    f"{indent}<font name='NotoEmoji'>{icon}</font> {node.tokens} "
-                    f'<a href="#{section_anchor}"><font{name_style}>{node.name}</font></a>',
+                    f"{prefix}<font name='NotoEmoji'>{icon}</font> {row.tokens} "
+                    f'<a href="#{section_anchor}"><font{name_style}>{row.name}</font></a>',
                     self.custom_styles["FileTree"],
                 )
             )
 
     def add_file_sections(self, node: FileNode):
-        if node.node_type == "file":
-            section_anchor = None
-            for i, (path, anchor) in enumerate(self.toc):
-                if path == node.path:
-                    section_anchor = anchor
-                    break
-            if section_anchor:
+        # The first anchor of each path, looked up once per file
+        anchors = {}
+        for path, anchor in self.toc:
+            anchors.setdefault(path, anchor)
+        for node in iter_file_nodes(node):
+            section_anchor = anchors.get(node.path)
+            if not section_anchor:
+                # Collapsed out of the tree, but its contents still belong here
+                section_anchor = f"section_{len(self.toc)}"
+                self.toc.append((node.path, section_anchor))
+            self.story.append(
+                Paragraph(
+                    f'<a name="{section_anchor}"></a>{node.path} - {node.tokens} tokens',
+                    self.styles["Heading2"],
+                )
+            )
+            self.story.append(Spacer(1, 0.1 * inch))
+            try:
+                # Use get_content to handle potentially large content
+                content = node.get_content()  # Adjust max_length as needed
+                self.story.append(
+                    Preformatted(content, self.custom_styles["FileContent"])
+                )
+            except Exception as e:
+                print(f"Error adding file content for {node.path}: {e}")
                 self.story.append(
                     Paragraph(
-                        f'<a name="{section_anchor}"></a>{node.path} - {node.tokens} tokens',
-                        self.styles["Heading2"],
+                        "<Error reading file content>",
+                        self.custom_styles["FileContent"],
                     )
                 )
-                self.story.append(Spacer(1, 0.1 * inch))
-                try:
-                    # Use get_content to handle potentially large content
-                    content = node.get_content()  # Adjust max_length as needed
-                    self.story.append(
-                        Preformatted(content, self.custom_styles["FileContent"])
-                    )
-                except Exception as e:
-                    print(f"Error adding file content for {node.path}: {e}")
-                    self.story.append(
-                        Paragraph(
-                            "<Error reading file content>",
-                            self.custom_styles["FileContent"],
-                        )
-                    )
-                self.story.append(PageBreak())
-        elif node.node_type == "directory":
-            for child in node.children:
-                self.add_file_sections(child)
+            self.story.append(PageBreak())
 
     def add_table_of_contents(self):
         toc_entries = []
@@ -197,10 +219,14 @@ class PDFGenerator:
         return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
 
 
-def generate_pdf(root_path: str, root_node: FileNode):
+def generate_pdf(
+    root_path: str,
+    root_node: FileNode,
+    tree_rows: Optional[Sequence[TreeRow]] = None,
+):
     output_path = os.path.join(root_path, "ccontext-output.pdf")
     pdf_gen = PDFGenerator(output_path)
-    pdf_gen.create_pdf(root_node, root_path)
+    pdf_gen.create_pdf(root_node, root_path, tree_rows)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,174 @@
+# ccontext/process_pool.py
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+
+from colorama import Fore, Style
+
+from ccontext import tokenizer
+from ccontext.file_node import FileNode
+from ccontext.token_cache import TokenCache, hash_content
+from ccontext.utils import read_file_data
+
+# Files are grouped into batches of about this many bytes, so small files do
+# not pay one inter-process round trip each
+PROCESS_BATCH_BYTES = 4 << 20
+PROCESS_BATCH_FILES = 256
+
+# Workers are started from a clean process rather than forked from this
+# one, which may have threads running that hold locks, such as the token
+# counter's pool or the encoding preload
+WORKER_START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+def _init_worker(model_type: str, buffer_size: float):
+    """Loads the encoding once per worker process."""
+    tokenizer.set_model_type_and_buffer(model_type, buffer_size)
+    tokenizer.get_encoding()
+
+
+def _ingest_batch(
+    batch: List[Tuple[int, str, Optional[tuple]]],
+    uploadable_extensions: set,
+    keep_content: bool,
+) -> list:
+    """
+    Reads and tokenizes a batch of files in a worker process. Each item is
+    (path id, file path, cached (size, mtime_ns, inode, tokens) or None).
+
+    Returns one compact tuple per file: (path id, tokens, is binary,
+    uploadable, stat, content or None, content hash, error).
+    """
+    results = []
+    for path_id, file_path, cached in batch:
+        try:
+            file_data = read_file_data(file_path, uploadable_extensions)
+        except Exception as e:
+            results.append((path_id, 0, False, False, None, None, None, str(e)))
+            continue
+
+        stat = file_data.stat
+        content = file_data.content if keep_content else None
+        if file_data.uploadable or file_data.is_binary:
+            tokens = 1 if file_data.uploadable else 0
+            results.append(
+                (
+                    path_id,
+                    tokens,
+                    file_data.is_binary,
+                    file_data.uploadable,
+                    stat,
+                    content,
+                    None,
+                    None,
+                )
+            )
+            continue
+
+        content_hash = None
+        if cached and cached[:3] == (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            tokens = cached[3]
+        else:
+            tokens = tokenizer.count_tokens(file_data.content)
+            content_hash = hash_content(file_data.data)
+        results.append(
+            (path_id, tokens, False, False, stat, content, content_hash, None)
+        )
+    return results
+
+
+def _shard_by_size(sizes: List[int]) -> List[List[int]]:
+    """
+    Orders path ids largest first and groups them into batches, so the big
+    files start early and small files at the end fill in the gaps.
+    """
+    batches = []
+    batch, batch_bytes = [], 0
+    for path_id in sorted(range(len(sizes)), key=sizes.__getitem__, reverse=True):
+        batch.append(path_id)
+        batch_bytes += sizes[path_id]
+        if batch_bytes >= PROCESS_BATCH_BYTES or len(batch) >= PROCESS_BATCH_FILES:
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _file_size(file_path: str) -> int:
+    try:
+        return os.stat(file_path).st_size
+    except OSError:
+        return 0
+
+
+def ingest_in_processes(
+    files: List[Tuple[FileNode, str]],
+    uploadable_extensions: set,
+    workers: int,
+    token_cache: Optional[TokenCache] = None,
+    keep_content: bool = True,
+):
+    """
+    Reads and tokenizes the given (node, file path) pairs in a pool of worker
+    processes and fills in the nodes, like ingest_file does in-process.
+    """
+    if not files:
+        return
+
+    with ThreadPoolExecutor() as executor:
+        sizes = list(executor.map(_file_size, [file_path for _, file_path in files]))
+
+    def cached_entry(file_path: str) -> Optional[tuple]:
+        entry = token_cache.entries.get(file_path) if token_cache else None
+        return entry[:4] if entry else None
+
+    # A thread still loading the encoding would hold its lock in the workers
+    tokenizer.wait_for_preload()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context(WORKER_START_METHOD),
+        initializer=_init_worker,
+        initargs=(tokenizer.MODEL_TYPE, tokenizer.BUFFER_SIZE),
+    ) as executor:
+        futures = [
+            executor.submit(
+                _ingest_batch,
+                [
+                    (path_id, files[path_id][1], cached_entry(files[path_id][1]))
+                    for path_id in batch
+                ],
+                uploadable_extensions,
+                keep_content,
+            )
+            for batch in _shard_by_size(sizes)
+        ]
+        for future in as_completed(futures):
+            for result in future.result():
+                _apply_result(files, result, token_cache)
+
+
+def _apply_result(
+    files: List[Tuple[FileNode, str]], result: tuple, token_cache: Optional[TokenCache]
+):
+    path_id, tokens, is_binary, uploadable, stat, content, content_hash, error = result
+    node, file_path = files[path_id]
+    if error is not None:
+        print(f"{Fore.YELLOW}Error reading file {file_path}: {error}{Style.RESET_ALL}")
+        return
+
+    is_text = not (is_binary or uploadable)
+    node.set_file_info(stat.st_size, is_binary, "utf-8" if is_text else None)
+    if is_text:
+        node.set_tokens_and_content(tokens, content or "", file_path, stat)
+    else:
+        node.set_tokens_and_content(tokens, content or "")
+    if not token_cache or not is_text:
+        return
+    if content_hash is None:
+        token_cache.get(file_path, stat)  # Marks the cached entry as used
+    else:
+        token_cache.put(file_path, stat, tokens, content_hash)
@@ -0,0 +1,191 @@
+# ccontext/token_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from colorama import Fore, Style
+
+from ccontext.configurator import USER_CONFIG_DIR
+
+TOKEN_CACHE_PATH = USER_CONFIG_DIR / "token_cache.sqlite3"
+DEFAULT_MAX_ENTRIES = 200_000
+
+# Seconds to wait for another ccontext process holding the write lock
+BUSY_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_counts (
+    path TEXT NOT NULL,
+    model TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    tokens INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    last_used INTEGER NOT NULL,
+    PRIMARY KEY (path, model)
+)
+"""
+
+
+def hash_content(data: bytes) -> str:
+    """Returns the content hash stored alongside token counts."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class TokenCache:
+    """
+    Persistent token counts, stored in SQLite under ~/.ccontext.
+
+    An entry is valid for a file as long as its absolute path, size,
+    mtime_ns and inode and the tokenizer model are unchanged. Entries for
+    the root being processed are loaded with one query, looked up from
+    memory by the walker threads, and new counts are written back in a
+    single transaction by flush(). The database runs in WAL mode so several
+    ccontext processes can share it, and flush() evicts the least recently
+    used entries beyond max_entries.
+    """
+
+    def __init__(
+        self,
+        model_type: str,
+        cache_path: Path = TOKEN_CACHE_PATH,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.model_type = model_type
+        self.cache_path = Path(cache_path)
+        self.max_entries = max_entries
+        self.entries: Dict[str, Tuple[int, int, int, int, str]] = {}
+        self.pending: Dict[str, Tuple[int, int, int, int, str]] = {}
+        self.used: List[str] = []
+        self.loaded_roots: Set[str] = set()
+        self.lock = threading.Lock()
+        self.connection: Optional[sqlite3.Connection] = None
+
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            self.connection = sqlite3.connect(
+                str(self.cache_path), timeout=BUSY_TIMEOUT, check_same_thread=False
+            )
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(SCHEMA)
+            self.connection.commit()
+        except sqlite3.Error as e:
+            self._disable(e)
+
+    def _disable(self, error: Exception):
+        print(
+            f"{Fore.YELLOW}Token cache disabled ({self.cache_path}): {error}{Style.RESET_ALL}"
+        )
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = None
+
+    def load(self, root_path: str):
+        """Loads the cached entries for all files below root_path, once."""
+        prefix = os.path.join(os.path.abspath(root_path), "")
+        if self.connection is None or prefix in self.loaded_roots:
+            return
+        self.loaded_roots.add(prefix)
+        try:
+            rows = self.connection.execute(
+                "SELECT path, size, mtime_ns, inode, tokens, content_hash "
+                "FROM token_counts WHERE model = ? AND path >= ? AND path < ?",
+                (self.model_type, prefix, prefix + "\uffff"),
+            ).fetchall()
+        except sqlite3.Error as e:
+            self._disable(e)
+            return
+        self.entries.update((row[0], row[1:]) for row in rows)
+
+    def history(self) -> List[Tuple[str, int, int]]:
+        """Returns (path, size, tokens) of every cached count for this model."""
+        if self.connection is None:
+            return []
+        try:
+            return self.connection.execute(
+                "SELECT path, size, tokens FROM token_counts WHERE model = ?",
+                (self.model_type,),
+            ).fetchall()
+        except sqlite3.Error as e:
+            self._disable(e)
+            return []
+
+    def get(self, file_path: str, stat: os.stat_result) -> Optional[int]:
+        """Returns the cached token count for the file, if it is still valid."""
+        entry = self.entries.get(file_path)
+        if entry is None or entry[:3] != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            return None
+        with self.lock:
+            self.used.append(file_path)
+        return entry[3]
+
+    def put(self, file_path: str, stat: os.stat_result, tokens: int, content_hash: str):
+        """Records the token count of a file for the next flush()."""
+        entry = (stat.st_size, stat.st_mtime_ns, stat.st_ino, tokens, content_hash)
+        with self.lock:
+            self.entries[file_path] = entry
+            self.pending[file_path] = entry
+
+    def flush(self):
+        """Writes new entries and access times, then evicts old entries."""
+        if self.connection is None or not (self.pending or self.used):
+            return
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            used, self.used = self.used, []
+
+        now = int(time.time())
+        try:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO token_counts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        (path, self.model_type, *entry, now)
+                        for path, entry in pending.items()
+                    ),
+                )
+                self.connection.executemany(
+                    "UPDATE token_counts SET last_used = ? WHERE path = ? AND model = ?",
+                    ((now, path, self.model_type) for path in used),
+                )
+                (count,) = self.connection.execute(
+                    "SELECT COUNT(*) FROM token_counts"
+                ).fetchone()
+                if count > self.max_entries:
+                    self.connection.execute(
+                        "DELETE FROM token_counts WHERE rowid IN ("
+                        "SELECT rowid FROM token_counts ORDER BY last_used LIMIT ?)",
+                        (count - self.max_entries,),
+                    )
+        except sqlite3.Error as e:
+            self._disable(e)
+
+    def close(self):
+        self.flush()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+# Caches kept open for the life of the process, by model and maximum size
+_shared_caches: Dict[Tuple[str, int], TokenCache] = {}
+
+
+def shared_token_cache(
+    model_type: str, max_entries: int = DEFAULT_MAX_ENTRIES
+) -> TokenCache:
+    """
+    Returns a TokenCache that stays open and loaded between runs in the same
+    process, as in the daemon. Call flush() after each run instead of close().
+    """
+    key = (model_type, max_entries)
+    cache = _shared_caches.get(key)
+    if cache is None:
+        cache = _shared_caches[key] = TokenCache(model_type, max_entries=max_entries)
+    return cache
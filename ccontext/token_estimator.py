@@ -0,0 +1,71 @@
+# ccontext/token_estimator.py
+import os
+from typing import Dict, Iterable, Tuple
+
+# Typical for source code and English prose with the GPT encodings
+DEFAULT_BYTES_PER_TOKEN = 4.0
+
+# Bytes of exactly counted files an extension needs before its own ratio is
+# trusted over the overall one
+MIN_CALIBRATION_BYTES = 64 << 10
+
+
+class TokenEstimator:
+    """
+    Estimates token counts from file sizes with per-extension bytes-per-token
+    ratios, so the tree can be shown without reading or tokenizing files.
+    """
+
+    def __init__(
+        self,
+        ratios: Dict[str, float] = None,
+        default_ratio: float = DEFAULT_BYTES_PER_TOKEN,
+    ):
+        self.ratios = ratios or {}
+        self.default_ratio = default_ratio
+
+    @classmethod
+    def from_history(
+        cls,
+        history: Iterable[Tuple[str, int, int]],
+        min_bytes: int = MIN_CALIBRATION_BYTES,
+    ) -> "TokenEstimator":
+        """
+        Calibrates the ratios from exact (path, size, tokens) counts, such as
+        those in the token cache. Extensions with too little history use the
+        overall ratio, and that falls back to DEFAULT_BYTES_PER_TOKEN.
+        """
+        totals: Dict[str, list] = {}
+        total_bytes = total_tokens = 0
+        for path, size, tokens in history:
+            if size <= 0 or tokens <= 0:
+                continue
+            ext_totals = totals.setdefault(_extension(path), [0, 0])
+            ext_totals[0] += size
+            ext_totals[1] += tokens
+            total_bytes += size
+            total_tokens += tokens
+
+        default_ratio = DEFAULT_BYTES_PER_TOKEN
+        if total_bytes >= min_bytes:
+            default_ratio = total_bytes / total_tokens
+        ratios = {
+            ext: ext_bytes / ext_tokens
+            for ext, (ext_bytes, ext_tokens) in totals.items()
+            if ext_bytes >= min_bytes
+        }
+        return cls(ratios, default_ratio)
+
+    def estimate(self, file_path: str, size: int) -> int:
+        """Returns the estimated token count of a text file of the given size."""
+        if size <= 0:
+            return 0
+        ratio = self.ratios.get(_extension(file_path), self.default_ratio)
+        return max(1, round(size / ratio))
+
+
+def _extension(file_path: str) -> str:
+    """The lowercased extension, or the file name for files like Makefile."""
+    name = os.path.basename(file_path)
+    ext = os.path.splitext(name)[1].lower()
+    return ext or name
@@ -0,0 +1,97 @@
+# ccontext/token_ledger.py
+from typing import List, Tuple
+
+from colorama import Fore, Style
+
+from ccontext.file_node import CONTENT_EDGE_CHARS, FileNode
+from ccontext.file_tree import (
+    END_OF_CONTENTS_MARKER,
+    file_section_header,
+    iter_file_nodes,
+)
+from ccontext.tokenizer import count_tokens, get_token_counter
+
+# Characters of the content next to the heading and trailing newline that
+# are encoded with them, so merges across the boundary are measured
+BOUNDARY_CHARS = CONTENT_EDGE_CHARS
+
+
+class TokenLedger:
+    """
+    Token counts of each piece of the output: the initial content, one
+    section per file and the end marker, in output order. File sections
+    reuse the counts taken while building the tree and only add the
+    measured cost of their heading, so the total never requires encoding
+    the assembled output.
+
+    Encoding the pieces separately can differ from encoding their
+    concatenation by a token where a merge crosses a boundary, which is
+    what verify() measures.
+    """
+
+    def __init__(self):
+        self.entries: List[Tuple[str, int]] = []
+
+    def add(self, label: str, tokens: int):
+        self.entries.append((label, tokens))
+
+    @classmethod
+    def from_tree(cls, initial_content: str, root_node: FileNode) -> "TokenLedger":
+        """Builds the ledger for the output of extract_file_contents(root_node)."""
+        ledger = cls()
+        ledger.add("initial content", count_tokens(initial_content))
+
+        nodes = list(iter_file_nodes(root_node))
+
+        # The heading and the trailing newline are measured in context: the
+        # cost of "header + head" minus "head", and of "tail + \n" minus
+        # "tail". Sections whose content was not counted while ingesting,
+        # such as <file> references, are short and counted whole.
+        def counted_whole(node: FileNode) -> bool:
+            return node.encoding is None or node.content_length <= 2 * BOUNDARY_CHARS
+
+        texts = []
+        for node in nodes:
+            header = file_section_header(node)
+            if counted_whole(node):
+                texts.append(f"{header}{node.get_content()}\n")
+                continue
+            # Only the ends are needed, which stay resident with the node
+            head, tail = node.content_edges()
+            texts.extend((header + head, head, tail + "\n", tail))
+        counts = iter(get_token_counter().count_batch(texts))
+
+        for node in nodes:
+            if counted_whole(node):
+                ledger.add(node.path, next(counts))
+                continue
+            with_header, head, with_trailer, tail = (next(counts) for _ in range(4))
+            tokens = with_header - head + node.tokens + with_trailer - tail
+            ledger.add(node.path, tokens)
+
+        ledger.add("end marker", count_tokens(END_OF_CONTENTS_MARKER))
+        return ledger
+
+    @property
+    def piece_tokens(self) -> List[int]:
+        """The token count of each piece, in output order."""
+        return [tokens for _, tokens in self.entries]
+
+    @property
+    def labels(self) -> List[str]:
+        """What each piece is: a file path, or a name for the other pieces."""
+        return [label for label, _ in self.entries]
+
+    @property
+    def total(self) -> int:
+        return sum(tokens for _, tokens in self.entries)
+
+    def verify(self, full_output: str) -> int:
+        """Encodes the full output, reports any drift and returns the exact count."""
+        exact = count_tokens(full_output)
+        drift = self.total - exact
+        color = Fore.GREEN if drift == 0 else Fore.YELLOW
+        print(
+            f"{color}Token ledger: {self.total}, full encode: {exact} ({drift:+d}){Style.RESET_ALL}"
+        )
+        return exact
@@ -1,19 +1,98 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
 import tiktoken
-from typing import List
+
+from ccontext.configurator import (
+    ENCODING_CACHE_DIR,
+    encoding_cache,
+    user_encoding_cache,
+)
 from ccontext.file_node import FileNode
 
+# tiktoken releases the GIL while encoding, so threads scale across cores
+DEFAULT_TOKENIZER_THREADS = os.cpu_count() or 1
+
+# Tokens budgeted for each join between pieces of a chunk, where a merge
+# across the boundary can change the count
+JOIN_TOKENS = 1
 
-def set_model_type_and_buffer(model_type: str, buffer_size: float):
+_encodings: Dict[str, tiktoken.Encoding] = {}
+_encodings_lock = threading.Lock()
+_token_counter: Optional["TokenCounter"] = None
+_preload_thread: Optional[threading.Thread] = None
+
+
+def set_model_type_and_buffer(model_type: str, buffer_size: float, preload=False):
     """
     Sets the model type and buffer size for tokenization.
 
     Args:
         model_type (str): The type of model to use for encoding.
         buffer_size (float): The buffer size as a fraction of max_tokens.
+        preload (bool): Start loading the encoding on a background thread,
+            so it overlaps with other work. get_encoding waits for it.
     """
-    global MODEL_TYPE, BUFFER_SIZE
+    global MODEL_TYPE, BUFFER_SIZE, _preload_thread
     MODEL_TYPE = model_type
     BUFFER_SIZE = buffer_size
+    if preload and model_type not in _encodings:
+        _preload_thread = threading.Thread(
+            target=_preload_encoding, name="ccontext-encoding", daemon=True
+        )
+        _preload_thread.start()
+
+
+def wait_for_preload():
+    """
+    Waits until a background load started by set_model_type_and_buffer is
+    done, so that no thread holds the encodings lock, such as before forking.
+    """
+    if _preload_thread is not None:
+        _preload_thread.join()
+
+
+def _preload_encoding():
+    try:
+        get_encoding()
+    except Exception:
+        pass  # The first foreground get_encoding retries and reports the error
+
+
+def get_encoding() -> tiktoken.Encoding:
+    """
+    Returns the encoding for the current model type. Each encoding is loaded
+    once per process and shared by all callers.
+
+    Returns:
+        tiktoken.Encoding: The encoding for MODEL_TYPE.
+    """
+    model_type = MODEL_TYPE
+    encoding = _encodings.get(model_type)
+    if encoding is None:
+        with _encodings_lock:
+            encoding = _encodings.get(model_type)
+            if encoding is None:
+                encoding = _load_encoding(model_type)
+                _encodings[model_type] = encoding
+    return encoding
+
+
+def _load_encoding(model_type: str) -> tiktoken.Encoding:
+    """
+    Loads an encoding from the files ccontext-configure --prefetch-encodings
+    stored in ~/.ccontext, or else from tiktoken's own cache, which
+    downloads them on first use.
+    """
+    if user_encoding_cache() is None and ENCODING_CACHE_DIR.is_dir():
+        try:
+            with encoding_cache():
+                return tiktoken.encoding_for_model(model_type)
+        except Exception:
+            pass  # Not prefetched for this model, tiktoken's cache may have it
+    return tiktoken.encoding_for_model(model_type)
 
 
 def tokenize_text(text: str) -> list:
@@ -26,8 +105,61 @@ def tokenize_text(text: str) -> list:
     Returns:
         list: A list of token ids.
     """
-    encoding = tiktoken.encoding_for_model(MODEL_TYPE)
-    return encoding.encode(text)
+    return get_encoding().encode(text)
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts the tokens in the given text. Special tokens such as
+    <|endoftext|> are counted as ordinary text.
+
+    Args:
+        text (str): The text to be counted.
+
+    Returns:
+        int: The number of tokens.
+    """
+    return len(get_encoding().encode_ordinary(text))
+
+
+class TokenCounter:
+    """
+    Counts tokens for batches of texts across a thread pool, sharing one
+    encoding between all threads.
+    """
+
+    def __init__(self, num_threads: int = DEFAULT_TOKENIZER_THREADS):
+        self.executor = ThreadPoolExecutor(
+            max_workers=num_threads, thread_name_prefix="ccontext-tokenizer"
+        )
+
+    def count(self, text: str) -> int:
+        return count_tokens(text)
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        """
+        Counts the tokens of each text.
+
+        Args:
+            texts (Sequence[str]): The texts to be counted.
+
+        Returns:
+            List[int]: The token count of each text, in order.
+        """
+        if len(texts) < 2:
+            return [count_tokens(text) for text in texts]
+        get_encoding()  # Load once before the threads need it
+        return list(self.executor.map(count_tokens, texts))
+
+
+def get_token_counter() -> TokenCounter:
+    """Returns the process-wide TokenCounter."""
+    global _token_counter
+    if _token_counter is None:
+        with _encodings_lock:
+            if _token_counter is None:
+                _token_counter = TokenCounter()
+    return _token_counter
 
 
 def chunk_text(file_contents: list, max_tokens: int) -> list:
@@ -41,103 +173,221 @@ def chunk_text(file_contents: list, max_tokens: int) -> list:
     Returns:
         list: A list of strings, each representing a chunk.
     """
+    return chunk_text_with_sizes(file_contents, max_tokens)[0]
+
+
+def chunk_text_with_sizes(
+    file_contents: list,
+    max_tokens: int,
+    token_counts: Optional[Sequence[int]] = None,
+    overhead_tokens: int = 0,
+) -> Tuple[List[str], List[int]]:
+    """
+    Splits the file contents like chunk_text and also returns the token
+    count of each chunk, summed from its pieces.
+
+    Each piece is counted at most once. Pieces larger than a chunk are
+    encoded once and cut on token boundaries, preferably after a newline,
+    and each part is encoded again to check that it fits. Every join
+    between pieces is budgeted one token, since a merge across it can
+    change the count.
+
+    Args:
+        file_contents (list): A list of strings representing file contents.
+        max_tokens (int): The maximum number of tokens allowed per chunk.
+        token_counts (Optional[Sequence[int]]): Known token counts of the
+            file contents, such as TokenLedger.piece_tokens, so they are not
+            encoded again.
+        overhead_tokens (int): Tokens reserved in every chunk for the text
+            it is wrapped in when delivered.
+
+    Returns:
+        Tuple[List[str], List[int]]: The chunks and their token counts.
+    """
     # Calculate the number of tokens to reserve as a buffer
     buffer_tokens = int(max_tokens * BUFFER_SIZE)
-    available_tokens = max_tokens - buffer_tokens
+    available_tokens = max_tokens - buffer_tokens - overhead_tokens
+    if available_tokens <= JOIN_TOKENS:
+        raise ValueError(
+            f"max_tokens {max_tokens} leaves no room for content after the "
+            f"{buffer_tokens} buffer and {overhead_tokens} overhead tokens"
+        )
 
-    current_chunk = ""  # The current chunk being built
+    current_chunk = []  # The pieces of the current chunk
     current_chunk_tokens = 0  # The token count of the current chunk
     chunks = []  # List to store all the chunks
+    chunk_sizes = []  # The token count of each chunk
 
     def add_chunk():
         """
         Adds the current chunk to the list of chunks and resets the current chunk.
         """
         nonlocal current_chunk, current_chunk_tokens
-        if current_chunk.strip():  # Check if the current chunk is not empty
-            chunks.append(current_chunk.strip())
-        current_chunk = ""
+        chunk = "".join(current_chunk).strip()
+        if chunk:  # Check if the current chunk is not empty
+            chunks.append(chunk)
+            chunk_sizes.append(current_chunk_tokens)
+        current_chunk = []
         current_chunk_tokens = 0
 
-    for file_content in file_contents:
+    def add_piece(piece: str, token_count: int):
+        nonlocal current_chunk_tokens
+        cost = token_count + (JOIN_TOKENS if current_chunk else 0)
+        if current_chunk_tokens + cost > available_tokens:
+            add_chunk()
+            cost = token_count
+        current_chunk.append(piece)
+        current_chunk_tokens += cost
+
+    for index, file_content in enumerate(file_contents):
         # Ensure the file content is a string
         if not isinstance(file_content, str):
             raise ValueError(f"Expected a string but got {type(file_content)}")
 
-        # Tokenize the current file content
-        tokens = tokenize_text(file_content)
-        token_count = len(tokens)
-
-        # If the file content exceeds the available tokens, split it into smaller pieces
-        if token_count > available_tokens:
-            split_contents = [
-                file_content[i : i + available_tokens]
-                for i in range(0, len(file_content), available_tokens)
-            ]
-            for split_content in split_contents:
-                split_tokens = tokenize_text(split_content)
-                split_token_count = len(split_tokens)
-                if current_chunk_tokens + split_token_count > available_tokens:
-                    add_chunk()
-                current_chunk += split_content
-                current_chunk_tokens += split_token_count
+        # Count the tokens of the current file content, unless already known
+        if token_counts is not None:
+            token_count = token_counts[index]
         else:
-            # If adding the current file content exceeds the available tokens, create a new chunk
-            if current_chunk_tokens + token_count > available_tokens:
-                add_chunk()
-            current_chunk += file_content
-            current_chunk_tokens += token_count
+            token_count = count_tokens(file_content)
+
+        if token_count <= available_tokens:
+            add_piece(file_content, token_count)
+            continue
+
+        # Too large for any chunk: fill the current chunk, then whole chunks
+        # A merge across the join with the neighbouring piece can change the
+        # count, so parts are cut one token short of the room they go into
+        room = available_tokens - current_chunk_tokens - 2 * JOIN_TOKENS
+        for part, part_tokens in split_on_token_boundaries(
+            file_content, available_tokens - JOIN_TOKENS, first_size=room
+        ):
+            part_tokens += JOIN_TOKENS
+            add_piece(part, part_tokens)
 
     # Add the final chunk if it contains any content
-    if current_chunk.strip():
+    if current_chunk:
         add_chunk()
 
-    return chunks
+    return chunks, chunk_sizes
 
 
-def chunk_nodes(root_node: FileNode, max_tokens: int) -> List[List[FileNode]]:
+def split_on_token_boundaries(
+    text: str, max_part_tokens: int, first_size: Optional[int] = None
+) -> List[Tuple[str, int]]:
+    """
+    Encodes text once and cuts it into parts of at most max_part_tokens
+    tokens (first_size for the first part, if given and positive), decoding
+    each token range back to text. Cuts are moved back to just after a
+    newline when one is in the last quarter of the range, and never fall
+    inside a multi-byte character.
+
+    A decoded part can encode differently on its own than as a slice of the
+    whole text, so each part is encoded again and cut shorter until it fits.
+    Only a part of a single token, or of a single character, can exceed
+    the limit.
+
+    Returns:
+        List[Tuple[str, int]]: Each part with its token count on its own.
+    """
+    encoding = get_encoding()
+    token_bytes = encoding.decode_tokens_bytes(encoding.encode_ordinary(text))
+    # Byte offset at which each token starts, plus the end
+    offsets = [0]
+    for piece in token_bytes:
+        offsets.append(offsets[-1] + len(piece))
+    data = text.encode("utf-8")
+
+    def is_char_boundary(index: int) -> bool:
+        return index == len(token_bytes) or (data[offsets[index]] & 0xC0) != 0x80
+
+    def back_to_char_boundary(start: int, end: int) -> int:
+        while end > start + 1 and not is_char_boundary(end):
+            end -= 1
+        # A single token inside a character has to extend to its end
+        while not is_char_boundary(end):
+            end += 1
+        return end
+
+    parts = []
+    start = 0
+    size = first_size if first_size and first_size > 0 else max_part_tokens
+    while start < len(token_bytes):
+        end = min(start + size, len(token_bytes))
+        if end < len(token_bytes):
+            for cut in range(end, end - size // 4, -1):
+                if token_bytes[cut - 1].endswith(b"\n") and is_char_boundary(cut):
+                    end = cut
+                    break
+            else:
+                end = back_to_char_boundary(start, end)
+        while True:
+            part = data[offsets[start] : offsets[end]].decode("utf-8")
+            part_tokens = len(encoding.encode_ordinary(part))
+            if part_tokens <= size:
+                break
+            shorter = back_to_char_boundary(start, end - (part_tokens - size))
+            if shorter >= end:
+                break  # A single token or character cannot be cut
+            end = shorter
+        parts.append((part, part_tokens))
+        start = end
+        size = max_part_tokens
+    return parts
+
+
+def tail_within_tokens(text: str, max_tokens: int) -> str:
+    """
+    Returns the end of text limited to about max_tokens tokens, starting on
+    a character boundary.
+    """
+    encoding = get_encoding()
+    tokens = encoding.encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return text
+    tail = b"".join(encoding.decode_tokens_bytes(tokens[len(tokens) - max_tokens :]))
+    # Skip the continuation bytes of a character cut at the start
+    start = 0
+    while start < len(tail) and (tail[start] & 0xC0) == 0x80:
+        start += 1
+    return tail[start:].decode("utf-8")
+
+
+def chunk_nodes(
+    root_node: FileNode, max_tokens: int, strategy: str = "sequential"
+) -> List[List[FileNode]]:
     """
     Splits the file nodes into chunks that fit within the max_tokens limit.
 
     Args:
         root_node (FileNode): The root node of the file tree.
         max_tokens (int): The maximum number of tokens allowed per chunk.
+        strategy (str): The packing strategy, see chunk_planner.plan_chunks.
 
     Returns:
         List[List[FileNode]]: A list of lists, each representing a chunk of nodes.
     """
+    # The planner builds on this module, so it is imported when needed
+    from ccontext.chunk_planner import plan_chunks
+
     buffer_tokens = int(max_tokens * BUFFER_SIZE)
     available_tokens = max_tokens - buffer_tokens
 
-    current_chunk = []
-    current_chunk_tokens = 0
-    chunks = []
-
-    def add_chunk():
-        nonlocal current_chunk, current_chunk_tokens
-        if current_chunk:
-            chunks.append(current_chunk)
-        current_chunk = []
-        current_chunk_tokens = 0
-
-    def traverse(node: FileNode):
-        nonlocal current_chunk, current_chunk_tokens
-
+    nodes = []
+    stack = [root_node]
+    while stack:
+        node = stack.pop()
         if node.node_type == "file":
-            if current_chunk_tokens + node.tokens > available_tokens:
-                add_chunk()
-            current_chunk.append(node)
-            current_chunk_tokens += node.tokens
+            nodes.append(node)
         elif node.node_type == "directory":
-            for child in node.children:
-                traverse(child)
-
-    traverse(root_node)
-
-    if current_chunk:
-        add_chunk()
+            stack.extend(reversed(node.children))
 
-    return chunks
+    chunks = plan_chunks(
+        [node.tokens for node in nodes],
+        available_tokens,
+        strategy,
+        groups=[os.path.dirname(node.path) for node in nodes],
+    )
+    return [[nodes[item.piece] for item in chunk.items] for chunk in chunks]
 
 
 # Set the default model type and buffer size
@@ -0,0 +1,636 @@
+# ccontext/tree_index.py
+import hashlib
+import os
+import threading
+from array import array
+from itertools import accumulate
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from ccontext import file_node
+from ccontext.file_node import CONTENT_EDGE_CHARS, FileNode
+from ccontext.utils import load_text
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, the arrays work without it
+    np = None
+
+# Bits of TreeListing.flags and TreeIndex.flags
+DIRECTORY = 1
+EXCLUDED = 2
+BINARY = 4
+ESTIMATED = 8
+TEXT = 16  # Decoded as UTF-8 and readable again from disk
+REFERENCE = 32  # Referenced as <file>path</file>, like uploadable files
+
+# Nodes from which build_file_tree stores the tree as a TreeIndex by default
+DEFAULT_COMPACT_THRESHOLD = 250_000
+
+
+class TreeListing:
+    """
+    The entries a walk found, before any file is read: interned names,
+    directory and exclusion flags, and the children of each scanned
+    directory as one sorted, contiguous block. With stats, the size, mtime
+    and inode of each file too, from which fingerprints are computed.
+
+    Walker threads append blocks in whatever order directories are
+    scanned, so the listing is turned into a tree in preorder afterwards,
+    either as FileNodes (file_nodes) or as a TreeIndex (tree_index).
+    """
+
+    def __init__(
+        self, name: str, path: str, is_dir: bool, excluded: bool, stats: bool = False
+    ):
+        self.path = path  # Of the first entry, relative to the root
+        self.names: List[str] = []
+        self.name_ids: Dict[str, int] = {}
+        self.name_id = array("I")
+        self.flags = array("B")
+        self.first_child = array("q")
+        self.child_count = array("q")
+        # Size, mtime_ns and inode of each file, -1 where unknown
+        self.stats: Optional[Tuple[array, array, array]] = (
+            (array("q"), array("q"), array("q")) if stats else None
+        )
+        self.lock = threading.Lock()
+        self._append(name, is_dir, excluded)
+
+    def __len__(self) -> int:
+        return len(self.flags)
+
+    def _append(
+        self,
+        name: str,
+        is_dir: bool,
+        excluded: bool,
+        stat: Optional[os.stat_result] = None,
+    ):
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        self.name_id.append(name_id)
+        self.flags.append((DIRECTORY if is_dir else 0) | (EXCLUDED if excluded else 0))
+        self.first_child.append(0)
+        self.child_count.append(0)
+        if self.stats is not None:
+            sizes, mtimes, inodes = self.stats
+            sizes.append(stat.st_size if stat else -1)
+            mtimes.append(stat.st_mtime_ns if stat else -1)
+            inodes.append(stat.st_ino if stat else -1)
+
+    def set_stat(self, index: int, stat: os.stat_result):
+        """Records the stat of the entry at index, such as the first."""
+        sizes, mtimes, inodes = self.stats
+        sizes[index], mtimes[index], inodes[index] = (
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_ino,
+        )
+
+    def add_children(
+        self,
+        parent: int,
+        entries: Sequence[Tuple[str, bool, bool, Optional[os.stat_result]]],
+    ) -> int:
+        """
+        Appends the (name, is_dir, excluded, stat) entries of a directory,
+        in order, and returns the index of the first. stat is only used
+        with stats, and may be None.
+        """
+        with self.lock:
+            first = len(self.flags)
+            for entry in entries:
+                self._append(*entry)
+            self.first_child[parent] = first
+            self.child_count[parent] = len(entries)
+        return first
+
+    def children(self, index: int) -> range:
+        first = self.first_child[index]
+        return range(first, first + self.child_count[index])
+
+    def name(self, index: int) -> str:
+        return self.names[self.name_id[index]]
+
+    def file_nodes(
+        self,
+        root_path: str,
+        reuse_directory: Optional[Callable[[str], Optional[FileNode]]] = None,
+    ) -> Tuple[FileNode, List[Tuple[FileNode, str]]]:
+        """
+        Builds the FileNode tree. Returns its root and the (node, file path)
+        of each file, in output order. Included directories for which
+        reuse_directory returns a node take its children instead.
+        """
+
+        def make_node(index: int, path: str) -> FileNode:
+            flags = self.flags[index]
+            node_type = "directory" if flags & DIRECTORY else "file"
+            return FileNode(self.name(index), path, node_type, bool(flags & EXCLUDED))
+
+        root = make_node(0, self.path)
+        files = []
+        stack = [(0, root)]
+        while stack:
+            index, node = stack.pop()
+            if node.node_type == "file":
+                files.append((node, _source_path(root_path, node.path)))
+                continue
+            if node.excluded:
+                continue
+            reused = reuse_directory and reuse_directory(node.path)
+            if reused is not None:
+                node.children = reused.children
+                continue
+            for child in self.children(index):
+                name = self.name(child)
+                path = name if node.path == "." else os.path.join(node.path, name)
+                node.add_child(make_node(child, path))
+            stack.extend(zip(reversed(self.children(index)), reversed(node.children)))
+        return root, files
+
+    def fingerprints(self) -> Dict[str, str]:
+        """
+        Returns a Merkle fingerprint for every scanned directory, keyed by
+        its relative path. A directory's fingerprint hashes the name and
+        exclusion of each entry, with the size, mtime and inode of files
+        and the fingerprint of subdirectories, so it changes whenever
+        anything below it does. A listing of a single file fingerprints
+        its stat. Requires stats.
+        """
+        sizes, mtimes, inodes = self.stats
+
+        def details(index: int) -> str:
+            if sizes[index] < 0:
+                return ""
+            return f"{sizes[index]}\0{mtimes[index]}\0{inodes[index]}"
+
+        if not self.flags[0] & DIRECTORY:
+            digest = hashlib.blake2b(details(0).encode(), digest_size=16)
+            return {self.path: digest.hexdigest()}
+
+        # A directory's block always follows its own entry, so going through
+        # the entries backwards hashes subdirectories before their parent
+        digests: Dict[int, str] = {}
+        for index in reversed(range(len(self))):
+            if not self.flags[index] & DIRECTORY or self.flags[index] & EXCLUDED:
+                continue
+            digest = hashlib.blake2b(digest_size=16)
+            for child in self.children(index):
+                flags = self.flags[child]
+                is_dir = bool(flags & DIRECTORY)
+                excluded = bool(flags & EXCLUDED)
+                child_details = digests.get(child, "") if is_dir else details(child)
+                digest.update(
+                    f"{self.name(child)}\0{is_dir:d}{excluded:d}\0{child_details}\n".encode(
+                        "utf-8", "surrogateescape"
+                    )
+                )
+            digests[index] = digest.hexdigest()
+
+        # Keyed by path, from the top down
+        fingerprints = {}
+        stack = [(0, self.path)] if 0 in digests else []
+        while stack:
+            index, path = stack.pop()
+            fingerprints[path] = digests[index]
+            for child in self.children(index):
+                if child in digests:
+                    name = self.name(child)
+                    stack.append(
+                        (child, name if path == "." else os.path.join(path, name))
+                    )
+        return fingerprints
+
+    def tree_index(self, root_path: str) -> Tuple["TreeIndex", "IndexedFiles"]:
+        """
+        Copies the listing into a TreeIndex, in preorder. Returns it and its
+        files as (view, file path) pairs, in output order.
+        """
+        tree = TreeIndex(root_path, self.path, self.names)
+        files = array("q")
+        # None closes the subtree of the entry on top of open_entries
+        stack = [(0, -1)]
+        open_entries = []
+        while stack:
+            entry = stack.pop()
+            if entry is None:
+                tree.subtree_end[open_entries.pop()] = len(tree)
+                continue
+            index, parent = entry
+            flags = self.flags[index]
+            position = tree.append(self.name_id[index], parent, flags)
+            if flags & DIRECTORY:
+                open_entries.append(position)
+                stack.append(None)
+                stack.extend(
+                    (child, position) for child in reversed(self.children(index))
+                )
+            else:
+                tree.subtree_end[position] = position + 1
+                files.append(position)
+        return tree, IndexedFiles(tree, files)
+
+
+def _source_path(root_path: str, relative_path: str) -> str:
+    return root_path if relative_path == "." else os.path.join(root_path, relative_path)
+
+
+class TreeIndex:
+    """
+    A compact, array-backed tree, for repositories with millions of
+    entries. build_file_tree fills it straight from the walk's listing,
+    without creating a FileNode per entry.
+
+    Nodes are stored in preorder in parallel arrays: parent index, name id
+    into a pool of interned names, flags, tokens, size, mtime and the end
+    of each subtree. Subtree totals come from one prefix sum per column,
+    vectorized with numpy when it is installed. Contents stay resident
+    within the content budget like those of FileNodes. Of the others only
+    the edges are kept, encoded in one shared pool, and they are read again
+    from disk when emitted; short ones fit in the pool whole.
+
+    root() returns a TreeNodeView, a FileNode that reads from and writes to
+    the arrays, so ingestion and the renderers work unchanged.
+    """
+
+    def __init__(
+        self, root_path: str, path: str = ".", names: Optional[List[str]] = None
+    ):
+        self.root_path = root_path
+        self.root_relative_path = path
+        self.names = names if names is not None else []
+        self.name_id = array("I")
+        self.parent = array("q")
+        self.flags = array("B")
+        self.tokens = array("q")
+        self.size = array("q")
+        self.mtime_ns = array("q")
+        self.content_length = array("q")
+        self.subtree_end = array("q")
+        # Contents kept in memory, by index
+        self.resident: Dict[int, str] = {}
+        # UTF-8 head and tail of contents that are not resident
+        self.edge_data = bytearray()
+        self.edge_start = array("q")
+        self.head_length = array("I")
+        self.tail_length = array("I")
+        self.dead_edge_bytes = 0  # Bytes of edge_data no node refers to
+        self.lock = threading.Lock()
+        self._prefix_sums = {}
+
+    def append(self, name_id: int, parent: int, flags: int) -> int:
+        """Appends an entry in preorder and returns its index."""
+        for column in (
+            self.tokens,
+            self.size,
+            self.mtime_ns,
+            self.content_length,
+            self.subtree_end,
+            self.edge_start,
+        ):
+            column.append(0)
+        self.head_length.append(0)
+        self.tail_length.append(0)
+        self.name_id.append(name_id)
+        self.parent.append(parent)
+        self.flags.append(flags)
+        self._prefix_sums.clear()
+        return len(self.parent) - 1
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def root(self) -> "TreeNodeView":
+        return TreeNodeView(self, 0)
+
+    def children(self, index: int) -> Iterator[int]:
+        """Yields the indices of the children of a directory."""
+        child = index + 1
+        end = self.subtree_end[index]
+        while child < end:
+            yield child
+            child = self.subtree_end[child]
+
+    def path(self, index: int) -> str:
+        """The path relative to the root of the tree, like FileNode.path."""
+        parts = []
+        while index > 0:
+            parts.append(self.names[self.name_id[index]])
+            index = self.parent[index]
+        if self.root_relative_path != ".":
+            parts.append(self.root_relative_path)
+        return os.path.join(*reversed(parts)) if parts else "."
+
+    def source_path(self, index: int) -> str:
+        return _source_path(self.root_path, self.path(index))
+
+    def set_edges(self, index: int, content: str):
+        """
+        Keeps the ends of a content that is about to leave memory, or all of
+        it when it is not longer than the two ends. They replace the node's
+        earlier ends in place when they fit; otherwise those become dead
+        bytes, and the pool is compacted once they make up half of it.
+        """
+        if len(content) <= 2 * CONTENT_EDGE_CHARS:
+            head, tail = content.encode("utf-8"), b""
+        else:
+            head = content[:CONTENT_EDGE_CHARS].encode("utf-8")
+            tail = content[-CONTENT_EDGE_CHARS:].encode("utf-8")
+        edge_length = len(head) + len(tail)
+        with self.lock:
+            slot_length = self.head_length[index] + self.tail_length[index]
+            if edge_length <= slot_length:
+                start = self.edge_start[index]
+                self.edge_data[start : start + edge_length] = head + tail
+                self.dead_edge_bytes += slot_length - edge_length
+            else:
+                self.edge_start[index] = len(self.edge_data)
+                self.edge_data += head
+                self.edge_data += tail
+                self.dead_edge_bytes += slot_length
+            self.head_length[index] = len(head)
+            self.tail_length[index] = len(tail)
+            if self.dead_edge_bytes * 2 > len(self.edge_data):
+                self._compact_edges()
+
+    def _compact_edges(self):
+        """Copies the live ends into a new pool, dropping the dead bytes."""
+        edge_data = bytearray()
+        for index in range(len(self)):
+            length = self.head_length[index] + self.tail_length[index]
+            if length:
+                start = self.edge_start[index]
+                self.edge_start[index] = len(edge_data)
+                edge_data += self.edge_data[start : start + length]
+        self.edge_data = edge_data
+        self.dead_edge_bytes = 0
+
+    def edges(self, index: int) -> Tuple[str, str]:
+        """The head and tail kept by set_edges."""
+        start = self.edge_start[index]
+        middle = start + self.head_length[index]
+        end = middle + self.tail_length[index]
+        with self.lock:
+            head, tail = self.edge_data[start:middle], self.edge_data[middle:end]
+        return head.decode("utf-8"), tail.decode("utf-8")
+
+    def _column(self, column: str) -> array:
+        if column == "tokens":
+            return self.tokens
+        # Only included files count towards files and bytes
+        included = (not flags & (DIRECTORY | EXCLUDED) for flags in self.flags)
+        if column == "files":
+            return array("q", included)
+        return array(
+            "q", (size if keep else 0 for keep, size in zip(included, self.size))
+        )
+
+    def prefix_sums(self, column: str = "tokens"):
+        """
+        Running totals of a column ("tokens", "files" or "bytes") in preorder,
+        with a leading zero.
+        """
+        prefix = self._prefix_sums.get(column)
+        if prefix is None:
+            values = self._column(column)
+            if np is not None:
+                prefix = np.zeros(len(values) + 1, dtype=np.int64)
+                np.cumsum(np.frombuffer(values, dtype=np.int64), out=prefix[1:])
+            else:
+                prefix = array("q", accumulate(values, initial=0))
+            self._prefix_sums[column] = prefix
+        return prefix
+
+    def subtree_total(self, index: int, column: str = "tokens") -> int:
+        """Total of a column over a node and everything below it."""
+        prefix = self.prefix_sums(column)
+        return int(prefix[self.subtree_end[index]] - prefix[index])
+
+    def subtree_tokens(self, index: int) -> int:
+        """Total tokens of the files below a node, from the prefix sums."""
+        return self.subtree_total(index, "tokens")
+
+    def directory_tokens(self) -> Dict[int, int]:
+        """The subtree token total of every directory, in one pass."""
+        prefix = self.prefix_sums("tokens")
+        if np is not None:
+            flags = np.frombuffer(self.flags, dtype=np.uint8)
+            directories = np.flatnonzero(flags & DIRECTORY)
+            ends = np.frombuffer(self.subtree_end, dtype=np.int64)[directories]
+            totals = prefix[ends] - prefix[directories]
+            return dict(zip(directories.tolist(), totals.tolist()))
+        return {
+            index: prefix[self.subtree_end[index]] - prefix[index]
+            for index, flags in enumerate(self.flags)
+            if flags & DIRECTORY
+        }
+
+
+class IndexedFiles(Sequence):
+    """
+    The files of a TreeIndex as (view, file path) pairs, created on access,
+    for the ingestion functions that take FileNodes.
+    """
+
+    def __init__(self, tree: TreeIndex, positions: array):
+        self.tree = tree
+        self.positions = positions
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._pair(position) for position in self.positions[index]]
+        return self._pair(self.positions[index])
+
+    def _pair(self, position: int) -> Tuple["TreeNodeView", str]:
+        return TreeNodeView(self.tree, position), self.tree.source_path(position)
+
+
+class TreeNodeView(FileNode):
+    """
+    A FileNode backed by a TreeIndex entry. Views are created on access and
+    hold nothing but the index and the position; what ingestion stores on a
+    node is written to the arrays.
+    """
+
+    def __init__(self, tree: TreeIndex, index: int):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def name(self) -> str:
+        return self.tree.names[self.tree.name_id[self.index]]
+
+    @property
+    def path(self) -> str:
+        return self.tree.path(self.index)
+
+    @property
+    def node_type(self) -> str:
+        return "directory" if self._flag(DIRECTORY) else "file"
+
+    @property
+    def children(self) -> List["TreeNodeView"]:
+        return [
+            TreeNodeView(self.tree, child) for child in self.tree.children(self.index)
+        ]
+
+    @property
+    def tokens(self) -> int:
+        return self.tree.tokens[self.index]
+
+    @tokens.setter
+    def tokens(self, tokens: int):
+        self.tree.tokens[self.index] = tokens
+        self.tree._prefix_sums.clear()
+
+    @property
+    def size(self) -> int:
+        return self.tree.size[self.index]
+
+    @property
+    def content_length(self) -> int:
+        return self.tree.content_length[self.index]
+
+    # Totals follow from the arrays, so assigning them, as aggregate_directory
+    # does, changes nothing
+    @property
+    def total_tokens(self) -> Optional[int]:
+        return (
+            self.tree.subtree_total(self.index, "tokens")
+            if self._flag(DIRECTORY)
+            else None
+        )
+
+    @total_tokens.setter
+    def total_tokens(self, total: Optional[int]):
+        pass
+
+    @property
+    def total_files(self) -> int:
+        return self.tree.subtree_total(self.index, "files")
+
+    @total_files.setter
+    def total_files(self, total: int):
+        pass
+
+    @property
+    def total_bytes(self) -> int:
+        return self.tree.subtree_total(self.index, "bytes")
+
+    @total_bytes.setter
+    def total_bytes(self, total: int):
+        pass
+
+    @property
+    def excluded(self) -> bool:
+        return self._flag(EXCLUDED)
+
+    @property
+    def is_binary(self) -> bool:
+        return self._flag(BINARY)
+
+    @property
+    def estimated(self) -> bool:
+        return self._flag(ESTIMATED)
+
+    @estimated.setter
+    def estimated(self, estimated: bool):
+        self._set_flag(ESTIMATED, estimated)
+
+    @property
+    def encoding(self) -> Optional[str]:
+        return "utf-8" if self._flag(TEXT) else None
+
+    @property
+    def source_path(self) -> str:
+        return self.tree.source_path(self.index)
+
+    @property
+    def source_version(self) -> Tuple[int, int]:
+        return self.tree.size[self.index], self.tree.mtime_ns[self.index]
+
+    def _flag(self, flag: int) -> bool:
+        return bool(self.tree.flags[self.index] & flag)
+
+    def _set_flag(self, flag: int, value: bool):
+        flags = self.tree.flags[self.index]
+        self.tree.flags[self.index] = flags | flag if value else flags & ~flag
+
+    def set_file_info(self, size: int, is_binary: bool, encoding: Optional[str] = None):
+        self.tree.size[self.index] = size
+        self._set_flag(BINARY, is_binary)
+        self._set_flag(TEXT, encoding is not None)
+        self.tree._prefix_sums.clear()
+
+    def set_tokens_and_content(
+        self,
+        tokens: int,
+        content: str,
+        source_path: Optional[str] = None,
+        source_stat: Optional[os.stat_result] = None,
+    ):
+        self.tokens = tokens
+        self.tree.content_length[self.index] = len(content)
+        if source_path is None:
+            # Only <file> references are stored without a source
+            self._set_flag(REFERENCE, bool(content))
+            return
+        if source_stat is not None:
+            self.tree.mtime_ns[self.index] = source_stat.st_mtime_ns
+        if file_node.content_budget.reserve(len(content)):
+            self.tree.resident[self.index] = content
+        else:
+            self.tree.set_edges(self.index, content)
+
+    def calculate_size(self) -> int:
+        return self.tree.subtree_tokens(self.index)
+
+    def get_content(self) -> str:
+        content = self.tree.resident.get(self.index)
+        if content is not None:
+            return content
+        if self._flag(TEXT):
+            if self.content_length <= 2 * CONTENT_EDGE_CHARS:
+                return self.tree.edges(self.index)[0]  # Kept whole
+            return load_text(self.source_path, self.source_version)
+        if self._flag(REFERENCE):
+            return f"<file>{os.path.abspath(self.source_path)}</file>"
+        return ""
+
+    def release_content(self):
+        content = self.tree.resident.pop(self.index, None)
+        if content is not None:
+            file_node.content_budget.release(len(content))
+            self.tree.set_edges(self.index, content)
+
+    def content_edges(self) -> Tuple[str, str]:
+        content = self.tree.resident.get(self.index)
+        if content is None:
+            if self.content_length > 2 * CONTENT_EDGE_CHARS:
+                return self.tree.edges(self.index)
+            content = self.get_content()
+        return content[:CONTENT_EDGE_CHARS], content[-CONTENT_EDGE_CHARS:]
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, TreeNodeView)
+            and other.tree is self.tree
+            and other.index == self.index
+        )
+
+    def __hash__(self) -> int:
+        return hash((id(self.tree), self.index))
@@ -1,10 +1,19 @@
 # ccontext/utils.py
+import codecs
+import mmap
 import os
+from typing import NamedTuple, Optional, Tuple
 
 from colorama import init
 
 verbose_state = {"verbose": False}
 
+# Number of leading bytes inspected to decide whether a file is binary
+BINARY_SNIFF_SIZE = 1024
+
+# Files from this size on are memory-mapped when read again for output
+MMAP_THRESHOLD = 1 << 20
+
 
 def set_verbose(value: bool):
     verbose_state["verbose"] = value
@@ -24,6 +33,15 @@ def format_number(number: int) -> str:
     return f"{number:,}"
 
 
+def format_bytes(size: int) -> str:
+    """Formats a size in bytes with a binary unit, such as 18.2 KB."""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+
+
 def interpolate_color(percentage, color1, color2):
     """
     Interpolates between two RGB colors based on the given percentage.
@@ -62,6 +80,31 @@ def get_color_for_percentage(percentage):
     return rgb_to_ansi(*color)
 
 
+def is_binary_data(data: bytes) -> bool:
+    """
+    Checks the leading bytes of a file for null bytes, which typically
+    indicate binary content.
+    """
+    return b"\x00" in data[:BINARY_SNIFF_SIZE]
+
+
+def is_binary_prefix(data: bytes, complete: bool) -> bool:
+    """
+    Decides from the leading bytes of a file whether it is binary, by the
+    rules of read_file_data: null bytes, or bytes that are not valid UTF-8.
+    complete says whether data is the whole file; otherwise a character cut
+    off at the end of data is not an error. Files that only turn invalid
+    after the leading bytes are not detected.
+    """
+    if is_binary_data(data):
+        return True
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(data, final=complete)
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
 def is_binary_file(file_path: str) -> bool:
     """
     Simple check if file is binary by attempting to read it as text.
@@ -77,11 +120,9 @@ def is_binary_file(file_path: str) -> bool:
         if not os.path.isfile(file_path):
             return False
 
-        # Try to read the first 1024 bytes to determine if it's binary
+        # Try to read the first bytes to determine if it's binary
         with open(file_path, "rb") as check_file:
-            chunk = check_file.read(1024)
-            # Check for null bytes which typically indicate binary content
-            if b"\x00" in chunk:
+            if is_binary_data(check_file.read(BINARY_SNIFF_SIZE)):
                 return True
 
         # Try opening as text as a fallback
@@ -105,3 +146,89 @@ def should_upload_file(file_path: str, uploadable_extensions: set) -> bool:
         return False
     ext = os.path.splitext(file_path)[1].lower()
     return ext in uploadable_extensions
+
+
+class FileData(NamedTuple):
+    """What a single read of a file yields."""
+
+    stat: os.stat_result
+    is_binary: bool
+    # Decoded text, the <file> reference of uploadable files, or "" for binaries
+    content: str
+    # Raw bytes of text files, for hashing
+    data: Optional[bytes]
+    uploadable: bool
+
+
+def read_file_data(file_path: str, uploadable_extensions: set) -> FileData:
+    """
+    Reads a file once: sniffs its binary status and decodes text, with
+    newlines normalized like reading in text mode would. Files that are not
+    valid UTF-8 are treated as binary. Raises OSError if it cannot be read.
+    """
+    with open(file_path, "rb") as f:
+        stat = os.fstat(f.fileno())
+
+        # Uploadable files are referenced, not read, regardless of binary status
+        if should_upload_file(file_path, uploadable_extensions):
+            is_binary = is_binary_data(f.read(BINARY_SNIFF_SIZE))
+            reference = f"<file>{os.path.abspath(file_path)}</file>"
+            return FileData(stat, is_binary, reference, None, True)
+
+        data = f.read()
+
+    if is_binary_data(data):
+        return FileData(stat, True, "", None, False)
+    try:
+        text_content = data.decode("utf-8")
+    except UnicodeDecodeError:
+        return FileData(stat, True, "", None, False)
+
+    return FileData(stat, False, normalize_newlines(text_content), data, False)
+
+
+def normalize_newlines(text: str) -> str:
+    """Converts \r\n and \r to \n, like reading in text mode would."""
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+class SourceChangedError(Exception):
+    """
+    A file changed or disappeared after it was ingested, so reading it again
+    would not yield the content its tokens were counted from.
+    """
+
+
+def file_version(stat: os.stat_result) -> Tuple[int, int]:
+    """The size and modification time that tell whether a file was changed."""
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_text(file_path: str, version: Optional[Tuple[int, int]] = None) -> str:
+    """
+    Reads a text file that was already ingested, decoding it the same way.
+    Large files are memory-mapped and decoded straight from the mapping,
+    without an intermediate copy of their bytes.
+
+    With the file_version recorded at ingestion, raises SourceChangedError
+    if the file was changed or removed since.
+    """
+    try:
+        f = open(file_path, "rb")
+    except FileNotFoundError:
+        if version is None:
+            raise
+        raise SourceChangedError(f"{file_path} was removed after it was read")
+    with f:
+        stat = os.fstat(f.fileno())
+        if version is not None and file_version(stat) != version:
+            raise SourceChangedError(f"{file_path} was changed after it was read")
+        if stat.st_size < MMAP_THRESHOLD:
+            text = f.read().decode("utf-8", errors="replace")
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    text = str(view, "utf-8", errors="replace")
+    return normalize_newlines(text)
@@ -0,0 +1,496 @@
+# ccontext/watcher.py
+import ctypes
+import ctypes.util
+import os
+import select
+import stat
+import struct
+import sys
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from colorama import Fore, Style
+
+from ccontext.file_node import FileNode
+from ccontext.file_system import GitignoreHandler, GlobMatcher
+from ccontext.file_tree import aggregate_directory, build_file_tree, walk_tree
+from ccontext.token_cache import TokenCache
+from ccontext.token_estimator import TokenEstimator
+from ccontext.utils import SourceChangedError
+
+# Seconds without events before a batch of changes is applied
+DEFAULT_DEBOUNCE = 0.3
+
+# Seconds between two scans of the polling watcher
+DEFAULT_POLL_INTERVAL = 1.0
+
+# inotify(7) event masks
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_ONLYDIR
+)
+
+# struct inotify_event: wd, mask, cookie and the length of the name that follows
+INOTIFY_EVENT = struct.Struct("iIII")
+INOTIFY_READ_SIZE = 1 << 16
+
+
+class InotifyWatcher:
+    """
+    Reports changed paths from inotify, through libc with ctypes. Each
+    watched directory reports changes to its own entries, so every included
+    directory of the tree is watched and excluded ones are not.
+    """
+
+    def __init__(self, root_path: str):
+        self.root_path = root_path
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_init1: {os.strerror(error)}")
+        self.directories: Dict[int, str] = {}  # Watch descriptor -> directory
+        self.watches: Dict[str, int] = {}
+
+    def watch(self, relative_dir: str):
+        path = os.fsencode(os.path.join(self.root_path, relative_dir))
+        wd = self.libc.inotify_add_watch(self.fd, path, WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), os.fsdecode(path))
+        # A directory moved within the tree keeps its watch descriptor
+        moved_from = self.directories.get(wd)
+        if moved_from is not None:
+            self.watches.pop(moved_from, None)
+        self.directories[wd] = relative_dir
+        self.watches[relative_dir] = wd
+
+    def unwatch(self, relative_dir: str):
+        wd = self.watches.pop(relative_dir, None)
+        if wd is not None and self.directories.get(wd) == relative_dir:
+            del self.directories[wd]
+            self.libc.inotify_rm_watch(self.fd, wd)  # Fails once it is deleted
+
+    def read_changes(self, timeout: Optional[float] = None) -> Set[str]:
+        """
+        Waits up to timeout seconds (forever with None) for events and
+        returns the paths they concern, relative to the root. "." means
+        events were lost and everything must be read again.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, INOTIFY_READ_SIZE)
+        except BlockingIOError:
+            return set()
+        changes = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                changes.add(".")
+                continue
+            directory = self.directories.get(wd)
+            if directory is not None and name:
+                changes.add(name if directory == "." else os.path.join(directory, name))
+        return changes
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Reports changed paths by listing the watched directories every interval
+    seconds and comparing the size and modification time of their entries.
+    Works on every platform and filesystem, at the cost of a stat per entry.
+    """
+
+    def __init__(self, root_path: str, interval: float = DEFAULT_POLL_INTERVAL):
+        self.root_path = root_path
+        self.interval = interval
+        self.listings: Dict[str, Dict[str, Tuple[int, int, bool]]] = {}
+
+    def watch(self, relative_dir: str):
+        self.listings[relative_dir] = self._list(relative_dir)
+
+    def unwatch(self, relative_dir: str):
+        self.listings.pop(relative_dir, None)
+
+    def _list(self, relative_dir: str) -> Dict[str, Tuple[int, int, bool]]:
+        listing = {}
+        try:
+            with os.scandir(os.path.join(self.root_path, relative_dir)) as it:
+                for entry in it:
+                    try:
+                        entry_stat = entry.stat()
+                    except OSError:
+                        continue
+                    if stat.S_ISDIR(entry_stat.st_mode):
+                        # Changes inside are reported by the directory itself
+                        listing[entry.name] = (0, 0, True)
+                    else:
+                        listing[entry.name] = (
+                            entry_stat.st_mtime_ns,
+                            entry_stat.st_size,
+                            False,
+                        )
+        except OSError:
+            pass
+        return listing
+
+    def _scan(self) -> Set[str]:
+        changes = set()
+        for relative_dir in list(self.listings):
+            old = self.listings[relative_dir]
+            new = self.listings[relative_dir] = self._list(relative_dir)
+            for name in old.keys() | new.keys():
+                if old.get(name) != new.get(name):
+                    changes.add(
+                        name
+                        if relative_dir == "."
+                        else os.path.join(relative_dir, name)
+                    )
+        return changes
+
+    def read_changes(self, timeout: Optional[float] = None) -> Set[str]:
+        """Scans until something changed, or for up to timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changes = self._scan()
+            if changes:
+                return changes
+            wait = self.interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return changes
+            time.sleep(wait)
+
+    def close(self):
+        self.listings.clear()
+
+
+def open_watcher(
+    root_path: str,
+    directories: Iterable[str],
+    backend: str = "auto",
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+):
+    """
+    Watches directories with inotify where available, falling back to
+    polling when it is not, or when the inotify watch limit is reached.
+    backend "poll" always polls, as inotify misses changes made by other
+    machines on network filesystems.
+    """
+    directories = list(directories)
+    if backend != "poll" and sys.platform.startswith("linux"):
+        watcher = None
+        try:
+            watcher = InotifyWatcher(root_path)
+            for relative_dir in directories:
+                watcher.watch(relative_dir)
+            return watcher
+        except (OSError, AttributeError) as e:
+            if watcher is not None:
+                watcher.close()
+            print(
+                f"{Fore.YELLOW}inotify unavailable ({e}), polling for changes instead.{Style.RESET_ALL}"
+            )
+
+    watcher = PollingWatcher(root_path, poll_interval)
+    for relative_dir in directories:
+        watcher.watch(relative_dir)
+    return watcher
+
+
+class TreeUpdater:
+    """
+    Keeps a FileNode tree in step with the filesystem by patching only the
+    nodes of changed paths and the totals of their ancestor directories.
+
+    A changed path is rebuilt with build_file_tree(subtree=...), so new and
+    modified nodes are excluded exactly as in the full build. A changed
+    .gitignore drops its cached rules and rebuilds the directory it sits
+    in, re-evaluating that subtree and nothing else.
+    """
+
+    def __init__(
+        self,
+        root_node: FileNode,
+        root_path: str,
+        excludes: GlobMatcher,
+        includes: GlobMatcher,
+        uploadable_extensions: set,
+        gitignore_handler: Optional[GitignoreHandler] = None,
+        token_cache: Optional[TokenCache] = None,
+        estimator: Optional[TokenEstimator] = None,
+    ):
+        self.root_node = root_node
+        self.root_path = root_path
+        self.excludes = excludes
+        self.includes = includes
+        self.uploadable_extensions = uploadable_extensions
+        self.gitignore_handler = gitignore_handler
+        self.token_cache = token_cache
+        self.estimator = estimator
+        self.watcher = None  # Told about directories entering and leaving the tree
+        self.nodes: Dict[str, FileNode] = {
+            node.path: node for _, node in walk_tree(root_node)
+        }
+
+    def watched_directories(self, node: Optional[FileNode] = None) -> Iterator[str]:
+        """The included directories at and below node, whose entries are in the tree."""
+        for _, child in walk_tree(node or self.root_node, descend_excluded=False):
+            if child.node_type == "directory" and not child.excluded:
+                yield child.path
+
+    def apply(self, changes: Iterable[str]) -> int:
+        """
+        Patches the tree for the changed paths, relative to the root, and
+        returns how many nodes were replaced, added or removed.
+        """
+        paths = set()
+        rebuild = set()  # Directories re-evaluated as a whole
+        for path in changes:
+            path = os.path.normpath(path)
+            paths.add(path)
+            if path == ".":
+                rebuild.add(path)
+            elif os.path.basename(path) == ".gitignore" and self.gitignore_handler:
+                directory = os.path.dirname(path) or "."
+                self.gitignore_handler.forget_directory(directory)
+                rebuild.add(directory)
+        paths |= rebuild
+
+        patched = set()
+        # Parents before children, so a rebuilt directory covers its contents
+        for path in sorted(paths, key=lambda p: (_depth(p), p)):
+            if not any(ancestor in patched for ancestor in _ancestors(path)):
+                if self._patch(path, path in rebuild):
+                    patched.add(path)
+
+        # Deepest directories first, so each sums up to date children
+        ancestors = {ancestor for path in patched for ancestor in _ancestors(path)}
+        for path in sorted(ancestors, key=_depth, reverse=True):
+            node = self.nodes.get(path)
+            if node is not None and node.node_type == "directory":
+                aggregate_directory(node)
+
+        if patched and self.token_cache:
+            self.token_cache.flush()
+        return len(patched)
+
+    def _patch(self, path: str, rebuild: bool) -> bool:
+        if path == ".":
+            self._forget(self.root_node)
+            self.root_node = self._build(None)
+            self._remember(self.root_node)
+            return True
+
+        parent = self.nodes.get(os.path.dirname(path) or ".")
+        if parent is None or parent.excluded or parent.node_type != "directory":
+            return False  # Below an excluded directory, so not in the tree
+        old = self.nodes.get(path)
+        full_path = os.path.join(self.root_path, path)
+        exists = os.path.exists(full_path)
+        if (
+            exists
+            and not rebuild
+            and old is not None
+            and old.node_type == "directory"
+            and os.path.isdir(full_path)
+        ):
+            return False  # Its entries report their own changes
+        if old is None and not exists:
+            return False  # Created and deleted again before the batch
+
+        position = None
+        if old is not None:
+            position = parent.children.index(old)
+            del parent.children[position]
+            self._forget(old)
+        if exists:
+            node = self._build(path)
+            if position is None:
+                position = _child_position(parent.children, node.name)
+            parent.children.insert(position, node)
+            self._remember(node)
+        return True
+
+    def _build(self, subtree: Optional[str]) -> FileNode:
+        return build_file_tree(
+            self.root_path,
+            self.excludes,
+            self.includes,
+            self.uploadable_extensions,
+            self.gitignore_handler,
+            token_cache=self.token_cache,
+            estimator=self.estimator,
+            subtree=subtree,
+        )
+
+    def _remember(self, node: FileNode):
+        for _, child in walk_tree(node):
+            self.nodes[child.path] = child
+        if self.watcher is not None:
+            for relative_dir in self.watched_directories(node):
+                try:
+                    self.watcher.watch(relative_dir)
+                except OSError as e:
+                    print(
+                        f"{Fore.YELLOW}Cannot watch {relative_dir}: {e}{Style.RESET_ALL}"
+                    )
+
+    def _forget(self, node: FileNode):
+        if self.watcher is not None:
+            for relative_dir in self.watched_directories(node):
+                self.watcher.unwatch(relative_dir)
+        for _, child in walk_tree(node):
+            self.nodes.pop(child.path, None)
+            child.release_content()
+
+
+def _depth(path: str) -> int:
+    return 0 if path == "." else path.count(os.sep) + 1
+
+
+def _ancestors(path: str) -> Iterator[str]:
+    """The directories above path, up to and including the root "."."""
+    while path != ".":
+        path = os.path.dirname(path) or "."
+        yield path
+
+
+def _child_position(children: list, name: str) -> int:
+    """Where a child called name goes in children, which are sorted by name."""
+    low, high = 0, len(children)
+    while low < high:
+        middle = (low + high) // 2
+        if children[middle].name < name:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def watch_tree(
+    updater: TreeUpdater,
+    on_change: Callable[[FileNode], None],
+    debounce: float = DEFAULT_DEBOUNCE,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+    backend: str = "auto",
+):
+    """
+    Applies filesystem changes to the tree until interrupted, calling
+    on_change with the root after each batch that changed it. A batch ends
+    once no event arrived for debounce seconds, so a checkout or an editor
+    saving several files causes a single update.
+    """
+    watcher = open_watcher(
+        updater.root_path, updater.watched_directories(), backend, poll_interval
+    )
+    updater.watcher = watcher
+    print(
+        f"{Fore.CYAN}Watching {updater.root_path} for changes, press Ctrl+C to stop.{Style.RESET_ALL}"
+    )
+    try:
+        while True:
+            changes = watcher.read_changes()
+            while True:
+                more = watcher.read_changes(debounce)
+                if not more:
+                    break
+                changes |= more
+
+            started = time.perf_counter()
+            patched = updater.apply(changes)
+            if not patched:
+                continue
+            print(
+                f"\n{Fore.CYAN}Updated {patched} changed path{'s' if patched != 1 else ''} in {time.perf_counter() - started:.2f}s{Style.RESET_ALL}"
+            )
+            try:
+                on_change(updater.root_node)
+            except SourceChangedError as e:
+                # Changed while it was emitted; the next batch emits it again
+                print(
+                    f"{Fore.YELLOW}{e}, emitting again once it is applied.{Style.RESET_ALL}"
+                )
+    except KeyboardInterrupt:
+        print(f"\n{Fore.CYAN}Stopped watching {updater.root_path}{Style.RESET_ALL}")
+    finally:
+        updater.watcher = None
+        watcher.close()
+
+
+# Trees kept between runs in the same process, as in the daemon, by root and
+# the settings that shape them. The least recently used beyond this many are
+# dropped with their watchers.
+MAX_RESIDENT_TREES = 4
+
+_resident_trees: "OrderedDict[tuple, TreeUpdater]" = OrderedDict()
+
+
+def keep_resident_tree(
+    key: tuple,
+    updater: TreeUpdater,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+    backend: str = "auto",
+):
+    """
+    Keeps the tree of updater under key for later runs in this process and
+    starts watching it, so resident_tree can bring it up to date without
+    walking it again.
+    """
+    updater.watcher = open_watcher(
+        updater.root_path, updater.watched_directories(), backend, poll_interval
+    )
+    stale = _resident_trees.pop(key, None)
+    if stale is not None:
+        stale.watcher.close()
+    _resident_trees[key] = updater
+    while len(_resident_trees) > MAX_RESIDENT_TREES:
+        _, evicted = _resident_trees.popitem(last=False)
+        evicted.watcher.close()
+
+
+def resident_tree(key: tuple) -> Optional[FileNode]:
+    """
+    Returns the tree kept under key by keep_resident_tree, with the changes
+    its watcher saw since the last run applied, or None if none is kept.
+    """
+    updater = _resident_trees.get(key)
+    if updater is None:
+        return None
+    _resident_trees.move_to_end(key)
+    changes = set()
+    while True:
+        more = updater.watcher.read_changes(0)
+        if not more:
+            break
+        changes |= more
+    if changes:
+        updater.apply(changes)
+    return updater.root_node
@@ -0,0 +1,13 @@
+import pytest
+
+from ccontext import tokenizer
+
+
+@pytest.fixture
+def encoding():
+    """The tokenizer encoding, or a skip when tiktoken cannot load it here."""
+    tokenizer.set_model_type_and_buffer("gpt-4o", 0.05)
+    try:
+        return tokenizer.get_encoding()
+    except Exception as e:
+        pytest.skip(f"tiktoken encoding unavailable: {e}")
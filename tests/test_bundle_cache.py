@@ -0,0 +1,150 @@
+import json
+import os
+import stat
+import sys
+
+import pytest
+
+from ccontext.bundle_cache import BundleCache
+from ccontext.file_tree import build_file_tree, walk_tree
+from ccontext.token_ledger import TokenLedger
+from ccontext.utils import SourceChangedError
+
+FILES = {
+    "README.md": "# Project\n\nSome words about it.\n",
+    "a/one.py": "def one():\n    return 1\n",
+    "a/two.py": "def two():\n    return 2\n",
+    "b/three.txt": "three\n" * 50,
+    "b/c/four.txt": "four\n",
+}
+
+
+@pytest.fixture
+def root(tmp_path, encoding):
+    root = tmp_path / "root"
+    for path, text in FILES.items():
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_text(text)
+    return str(root)
+
+
+def build(root, bundles=None):
+    """Builds the tree like main does, returning it and the reused directories."""
+    reused = []
+
+    def reuse_directory(relative_dir):
+        node = bundles.reuse_directory(relative_dir)
+        if node is not None:
+            reused.append(relative_dir)
+        return node
+
+    root_node = build_file_tree(
+        root,
+        [],
+        [],
+        set(),
+        reuse_directory=reuse_directory if bundles else None,
+        fingerprints=bundles.fingerprints if bundles else None,
+    )
+    return root_node, reused
+
+
+def files(root_node):
+    return {
+        node.path: (node.tokens, node.get_content())
+        for _, node in walk_tree(root_node)
+        if node.node_type == "file"
+    }
+
+
+def store(bundles, root_node):
+    ledger = TokenLedger()
+    ledger.add("initial content", 3)
+    bundles.store(root_node, ["tree"], "initial", ledger)
+
+
+def test_hit_restores_the_stored_output(root, tmp_path):
+    cache_dir = tmp_path / "bundles"
+    bundles = BundleCache(root, {"max_tokens": 100}, cache_dir=cache_dir)
+    root_node, reused = build(root, bundles)
+    assert not bundles.hit and reused == []
+    store(bundles, root_node)
+
+    bundles = BundleCache(root, {"max_tokens": 100}, cache_dir=cache_dir)
+    restored, reused = build(root, bundles)
+    assert bundles.hit and reused == ["."]
+    assert bundles.console == ["tree"]
+    assert bundles.initial_content == "initial"
+    assert bundles.ledger().entries == [("initial content", 3)]
+    assert files(restored) == files(root_node)
+
+
+def test_other_settings_miss(root, tmp_path):
+    cache_dir = tmp_path / "bundles"
+    bundles = BundleCache(root, {"max_tokens": 100}, cache_dir=cache_dir)
+    store(bundles, build(root, bundles)[0])
+
+    bundles = BundleCache(root, {"max_tokens": 200}, cache_dir=cache_dir)
+    _, reused = build(root, bundles)
+    assert not bundles.hit and reused == []
+
+
+def test_edit_misses_and_reuses_unchanged_directories(root, tmp_path):
+    cache_dir = tmp_path / "bundles"
+    bundles = BundleCache(root, {}, cache_dir=cache_dir)
+    store(bundles, build(root, bundles)[0])
+
+    with open(os.path.join(root, "a", "one.py"), "a") as f:
+        f.write("# changed\n")
+    bundles = BundleCache(root, {}, cache_dir=cache_dir)
+    root_node, reused = build(root, bundles)
+    assert not bundles.hit
+    assert reused == ["b"]
+    assert files(root_node) == files(build(root)[0])
+
+
+def test_restored_file_changed_after_the_hit_is_refused(root, tmp_path):
+    cache_dir = tmp_path / "bundles"
+    bundles = BundleCache(root, {}, cache_dir=cache_dir)
+    store(bundles, build(root, bundles)[0])
+    bundles = BundleCache(root, {}, cache_dir=cache_dir)
+    restored, _ = build(root, bundles)
+    assert bundles.hit
+
+    with open(os.path.join(root, "README.md"), "a") as f:
+        f.write("more\n")
+    readme = next(node for _, node in walk_tree(restored) if node.name == "README.md")
+    with pytest.raises(SourceChangedError):
+        readme.get_content()
+
+
+def test_bundles_hold_no_contents(root, tmp_path):
+    bundles = BundleCache(root, {}, cache_dir=tmp_path / "bundles")
+    store(bundles, build(root, bundles)[0])
+    with open(bundles.path, encoding="utf-8") as f:
+        stored = f.read()
+    assert json.loads(stored)["tree"]
+    for text in FILES.values():
+        assert json.dumps(text)[1:-1] not in stored
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="POSIX permissions")
+def test_bundles_are_private(root, tmp_path):
+    cache_dir = tmp_path / "bundles"
+    bundles = BundleCache(root, {}, cache_dir=cache_dir)
+    store(bundles, build(root, bundles)[0])
+    assert stat.S_IMODE(os.stat(cache_dir).st_mode) == 0o700
+    for path in (bundles.path, bundles.root_fingerprint_path):
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_least_recently_used_bundles_are_evicted(root, tmp_path):
+    cache_dir = tmp_path / "bundles"
+    for max_tokens in (100, 200, 300):
+        bundles = BundleCache(
+            root, {"max_tokens": max_tokens}, cache_dir=cache_dir, max_bundles=2
+        )
+        store(bundles, build(root, bundles)[0])
+    assert len(list(cache_dir.glob("*.json"))) == 2
+    assert len(list(cache_dir.glob("*.root"))) == 2
+    assert bundles.path.exists() and bundles.root_fingerprint_path.exists()
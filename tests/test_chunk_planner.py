@@ -0,0 +1,121 @@
+import random
+
+import pytest
+
+from ccontext.chunk_planner import CHUNK_STRATEGIES, Chunk, plan_chunks
+from ccontext.tokenizer import JOIN_TOKENS
+
+CAPACITY = 1000
+
+
+def random_tokens(seed: int, count: int = 200, largest: int = CAPACITY):
+    generator = random.Random(seed)
+    return [generator.randint(1, largest) for _ in range(count)]
+
+
+def random_groups(seed: int, count: int = 200):
+    generator = random.Random(seed)
+    return [f"dir{generator.randint(0, 15)}" for _ in range(count)]
+
+
+def check_plan(chunks, piece_count, capacity):
+    """Every piece is planned once, in order within its chunk, at or under capacity."""
+    planned = [item.piece for chunk in chunks for item in chunk.items]
+    assert sorted(planned) == list(range(piece_count))
+    for chunk in chunks:
+        assert chunk.items
+        assert chunk.tokens == Chunk().cost(chunk.items)
+        assert chunk.tokens <= capacity
+        pieces = [item.piece for item in chunk.items]
+        assert pieces == sorted(pieces)
+    first_pieces = [chunk.items[0].piece for chunk in chunks]
+    assert first_pieces == sorted(first_pieces)
+
+
+@pytest.mark.parametrize("strategy", CHUNK_STRATEGIES)
+@pytest.mark.parametrize("seed", range(5))
+def test_plans_fit_and_keep_every_piece_once(strategy, seed):
+    tokens = random_tokens(seed)
+    chunks = plan_chunks(tokens, CAPACITY, strategy, groups=random_groups(seed))
+    check_plan(chunks, len(tokens), CAPACITY)
+
+
+@pytest.mark.parametrize("strategy", CHUNK_STRATEGIES)
+def test_keep_last_puts_the_last_piece_at_the_end(strategy):
+    tokens = random_tokens(7) + [5]
+    chunks = plan_chunks(
+        tokens, CAPACITY, strategy, groups=random_groups(7) + ["end"], keep_last=True
+    )
+    check_plan(chunks, len(tokens), CAPACITY)
+    assert chunks[-1].items[-1].piece == len(tokens) - 1
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_ffd_never_needs_more_chunks_than_sequential(seed):
+    tokens = random_tokens(seed, largest=CAPACITY // 2)
+    ffd = plan_chunks(tokens, CAPACITY, "ffd")
+    sequential = plan_chunks(tokens, CAPACITY, "sequential")
+    assert len(ffd) <= len(sequential)
+
+
+def test_locality_keeps_a_group_that_fits_together():
+    tokens = random_tokens(3, largest=100)
+    groups = random_groups(3)
+    chunks = plan_chunks(tokens, CAPACITY, "locality", groups=groups)
+    check_plan(chunks, len(tokens), CAPACITY)
+    chunk_of = {item.piece: n for n, chunk in enumerate(chunks) for item in chunk.items}
+    for group in set(groups):
+        members = [i for i, name in enumerate(groups) if name == group]
+        cost = sum(tokens[i] for i in members) + (len(members) - 1) * JOIN_TOKENS
+        if cost <= CAPACITY:
+            assert len({chunk_of[i] for i in members}) == 1, group
+
+
+@pytest.mark.parametrize("strategy", CHUNK_STRATEGIES)
+def test_oversized_pieces_without_text_get_a_chunk_of_their_own(strategy):
+    tokens = [10, CAPACITY * 3, 20, CAPACITY + 1, 30]
+    chunks = plan_chunks(tokens, CAPACITY, strategy)
+    planned = sorted(item.piece for chunk in chunks for item in chunk.items)
+    assert planned == list(range(len(tokens)))
+    for chunk in chunks:
+        if chunk.tokens > CAPACITY:
+            assert len(chunk.items) == 1
+
+
+@pytest.mark.parametrize("strategy", CHUNK_STRATEGIES)
+def test_oversized_pieces_are_cut_into_parts_that_fit(strategy, encoding):
+    generator = random.Random(11)
+    words = ["alpha", "beta", "gamma", "δέλτα", "日本語", "🙂", "\n", "    ", "x = 1\n"]
+    texts = [
+        "".join(generator.choice(words) for _ in range(generator.randint(5, 4000)))
+        for _ in range(30)
+    ]
+    tokens = [len(encoding.encode_ordinary(text)) for text in texts]
+    capacity = 300
+    assert max(tokens) > capacity * 3
+
+    chunks = plan_chunks(
+        tokens,
+        capacity,
+        strategy,
+        groups=[f"dir{i % 4}" for i in range(len(texts))],
+        piece_text=texts.__getitem__,
+    )
+    parts = {}
+    for chunk in chunks:
+        assert chunk.tokens == Chunk().cost(chunk.items)
+        assert chunk.tokens <= capacity
+        text = chunk.materialize(texts.__getitem__)
+        assert len(encoding.encode_ordinary(text)) <= capacity
+        for item in chunk.items:
+            parts.setdefault(item.piece, []).append(item)
+    assert sorted(parts) == list(range(len(texts)))
+    for piece, items in parts.items():
+        items.sort(key=lambda item: item.part)
+        assert [item.part for item in items] == list(range(len(items)))
+        if items[0].text is None:
+            assert len(items) == 1 and tokens[piece] <= capacity
+        else:
+            assert "".join(item.text for item in items) == texts[piece]
+            for item in items:
+                assert len(encoding.encode_ordinary(item.text)) < item.tokens
@@ -0,0 +1,201 @@
+import os
+import re
+import shutil
+import subprocess
+
+import pytest
+
+from ccontext.file_system import GitignoreHandler
+from ccontext.gitignore import GitignoreRules, translate_pattern
+
+ROOT_GITIGNORE = r"""
+# comment, and a blank line follow
+
+*.log
+!keep.log
+build/
+/anchored.txt
+docs/**/*.md
+!docs/**/README.md
+tmp*
+!tmp_keep
+a/b/
+**/cache
+vendor/**
+\#hash
+\!bang
+[Tt]est?.txt
+*.py[co]
+nested/deep/*.dat
+"""
+# An escaped trailing space is kept, an unescaped one is dropped
+ROOT_GITIGNORE += "space\\ \ntrailing.txt   \n"
+
+SUB_GITIGNORE = """
+*.txt
+!important.txt
+/local
+"""
+
+FILES = [
+    ".gitignore",
+    "app.log",
+    "keep.log",
+    "logs/keep.log",
+    "logs/other.log",
+    "build/out.bin",
+    "src/build/x.c",
+    "src/build.c",
+    "anchored.txt",
+    "src/anchored.txt",
+    "docs/a.md",
+    "docs/guide/b.md",
+    "docs/guide/README.md",
+    "docs/guide/deeper/c.md",
+    "docs/notes.txt",
+    "tmpfile",
+    "tmp_keep",
+    "src/tmp.c",
+    "a/b/c.txt",
+    "x/a/b/c.txt",
+    "a/bc.txt",
+    "cache/k",
+    "src/cache/k",
+    "src/cachefile",
+    "vendor/lib.js",
+    "vendor/sub/lib.js",
+    "src/vendor/lib.js",
+    "#hash",
+    "!bang",
+    "test1.txt",
+    "Test2.txt",
+    "test12.txt",
+    "mod.pyc",
+    "mod.pyo",
+    "mod.py",
+    "nested/deep/x.dat",
+    "nested/deep/more/y.dat",
+    "nested/z.dat",
+    "space ",
+    "trailing.txt",
+    "sub/.gitignore",
+    "sub/a.txt",
+    "sub/important.txt",
+    "sub/inner/b.txt",
+    "sub/inner/important.txt",
+    "sub/local/c.md",
+    "sub/inner/local/d.md",
+    "sub/code.py",
+]
+
+
+def regex_matches(pattern: str, path: str) -> bool:
+    return re.fullmatch(translate_pattern(pattern), path, re.DOTALL) is not None
+
+
+@pytest.mark.parametrize(
+    "pattern, path, expected",
+    [
+        ("*.py", "main.py", True),
+        ("*.py", "src/main.py", False),  # "*" never crosses "/"
+        ("?.py", "a.py", True),
+        ("?.py", "/.py", False),
+        ("**/foo", "foo", True),
+        ("**/foo", "a/b/foo", True),
+        ("a/**/b", "a/b", True),
+        ("a/**/b", "a/x/y/b", True),
+        ("a/**", "a/x/y", True),
+        ("a**b", "a/b", False),  # Not between slashes, so a plain "*"
+        ("[abc].txt", "b.txt", True),
+        ("[!abc].txt", "b.txt", False),
+        ("[!abc].txt", "d.txt", True),
+        ("[a-c]/x", "/x", False),
+        ("\\*.txt", "*.txt", True),
+        ("\\*.txt", "a.txt", False),
+        ("[unclosed", "[unclosed", True),
+    ],
+)
+def test_translate_pattern(pattern, path, expected):
+    assert regex_matches(pattern, path) is expected
+
+
+@pytest.mark.parametrize(
+    "lines, path, is_dir, expected",
+    [
+        # Negation re-includes, and the last matching rule wins
+        (["*.log", "!keep.log"], "keep.log", False, False),
+        (["!keep.log", "*.log"], "keep.log", False, True),
+        (["*.log"], "notes.txt", False, None),
+        # Rules ending in "/" only match directories
+        (["build/"], "build", True, True),
+        (["build/"], "build", False, None),
+        (["build/"], "src/build", True, True),
+        # A leading or middle slash anchors the rule to the .gitignore
+        (["/todo.txt"], "todo.txt", False, True),
+        (["/todo.txt"], "src/todo.txt", False, None),
+        (["doc/frotz"], "doc/frotz", False, True),
+        (["doc/frotz"], "a/doc/frotz", False, None),
+        (["frotz"], "a/doc/frotz", False, True),
+        # Blank lines and comments are skipped
+        (["", "# *.log"], "a.log", False, None),
+    ],
+)
+def test_gitignore_rules(lines, path, is_dir, expected):
+    assert GitignoreRules("", lines).match(path, is_dir) is expected
+
+
+def test_nested_rules_only_apply_below_their_directory():
+    rules = GitignoreRules("sub", ["/local", "*.txt"])
+    assert rules.match("sub/local", True) is True
+    assert rules.match("sub/inner/local", True) is None
+    assert rules.match("sub/a.txt", False) is True
+    assert rules.match("a.txt", False) is None
+
+
+def write_tree(root):
+    for path in FILES:
+        full_path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "w") as f:
+            if path == ".gitignore":
+                f.write(ROOT_GITIGNORE)
+            elif path == "sub/.gitignore":
+                f.write(SUB_GITIGNORE)
+
+
+def git_ignored(root, paths):
+    """The paths git check-ignore reports as ignored."""
+    result = subprocess.run(
+        ["git", "-C", str(root), "check-ignore", "--no-index", "--stdin", "-z"],
+        input="\0".join(paths).encode(),
+        capture_output=True,
+    )
+    assert result.returncode in (0, 1), result.stderr
+    return {path for path in result.stdout.decode().split("\0") if path}
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_gitignore_handler_agrees_with_git_check_ignore(tmp_path):
+    subprocess.run(["git", "init", "-q", str(tmp_path)], check=True)
+    write_tree(tmp_path)
+
+    entries = {}  # Relative path -> is_dir
+    for directory, dirnames, filenames in os.walk(tmp_path):
+        dirnames[:] = [name for name in dirnames if name != ".git"]
+        relative_dir = os.path.relpath(directory, tmp_path)
+        for name in dirnames + filenames:
+            path = name if relative_dir == "." else f"{relative_dir}/{name}"
+            entries[path] = name in dirnames
+    ignored = git_ignored(tmp_path, list(entries))
+
+    handler = GitignoreHandler(str(tmp_path))
+    compared = 0
+    for path, is_dir in entries.items():
+        # Like the walk, nothing below an ignored directory is looked at
+        parents = path.split("/")[:-1]
+        if any("/".join(parents[: i + 1]) in ignored for i in range(len(parents))):
+            continue
+        assert handler.should_ignore(path, is_dir) is (path in ignored), path
+        compared += 1
+    assert compared > len(FILES) // 2
+    assert len(ignored) > len(FILES) // 3
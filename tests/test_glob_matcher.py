@@ -0,0 +1,117 @@
+import fnmatch
+import itertools
+
+import pytest
+from wcmatch import glob
+
+from ccontext.file_system import GlobMatcher, as_glob_matcher
+
+# The default excludes, plus shapes that take each path through the matcher:
+# basename, suffix and component indexes, and the combined fallback regex
+PATTERNS = [
+    "**/.git",
+    "**/node_modules",
+    "**/__pycache__",
+    "**/*.min.js",
+    "**/*.lock",
+    "**/*.DS_Store",
+    "**/crawl4ai-output/**",
+    "**/vendor",
+    "**/build/**",
+    "src/*.py",
+    "docs/**/*.md",
+    "*.txt",
+    "**/test_?.py",
+    "**/[Rr]eadme*",
+    "a/**/b/**",
+]
+
+PATHS = [
+    ".git",
+    "src/.git",
+    "node_modules",
+    "web/node_modules",
+    "web/node_modules/react/index.js",
+    "pkg/__pycache__",
+    "app.min.js",
+    "static/js/app.min.js",
+    "static/js/app.js",
+    "poetry.lock",
+    "sub/Cargo.lock",
+    "lock",
+    "crawl4ai-output/page.json",
+    "x/crawl4ai-output/y/page.json",
+    "crawl4ai-output",
+    "vendor",
+    "php/vendor",
+    "php/vendor/autoload.php",
+    "build/out.o",
+    "src/build/out.o",
+    "build",
+    "src/main.py",
+    "src/pkg/main.py",
+    "docs/index.md",
+    "docs/a/b/c.md",
+    "notes.txt",
+    "dir/notes.txt",
+    "test_a.py",
+    "tests/test_b.py",
+    "tests/test_bc.py",
+    "README.md",
+    "pkg/readme.txt",
+    "a/b/c",
+    "a/x/b/c/d",
+    "a/b",
+]
+
+
+def globmatch(path, patterns):
+    """What is_excluded used before GlobMatcher: wcmatch, one pattern at a time."""
+    return any(
+        glob.globmatch(path, pattern, flags=glob.GLOBSTAR) for pattern in patterns
+    )
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_matches_like_globmatch(path):
+    assert GlobMatcher(PATTERNS).matches(path) is globmatch(path, PATTERNS)
+
+
+@pytest.mark.parametrize("pattern", PATTERNS)
+def test_each_pattern_alone_matches_like_globmatch(pattern):
+    matcher = GlobMatcher([pattern])
+    for path in PATHS:
+        assert matcher.matches(path) is globmatch(path, [pattern]), (pattern, path)
+
+
+def test_basename_patterns_match_like_fnmatch():
+    """
+    Without a "/", "**/" followed by a pattern is fnmatch on the basename,
+    except that wildcards do not match a leading dot, as in a shell.
+    """
+    names = ["*.lock", "*.min.js", "test_?.py", "[Rr]eadme*", "vendor", "*"]
+    for name, path in itertools.product(names, PATHS):
+        basename = path.rpartition("/")[2]
+        expected = fnmatch.fnmatchcase(basename, name)
+        if basename.startswith(".") and not name.startswith("."):
+            expected = False
+        assert GlobMatcher([f"**/{name}"]).matches(path) is expected, (name, path)
+
+
+def test_empty_matcher_matches_nothing():
+    assert not any(GlobMatcher().matches(path) for path in PATHS)
+
+
+def test_combine_returns_a_new_matcher():
+    matcher = GlobMatcher(["*.txt"])
+    combined = matcher.combine(["*.md", "*.txt"])
+    assert combined.patterns == ("*.txt", "*.md")
+    assert matcher.patterns == ("*.txt",)
+    assert combined.matches("a.md") and not matcher.matches("a.md")
+    assert matcher.combine(["*.txt"]) is matcher
+
+
+def test_as_glob_matcher_shares_compiled_matchers():
+    assert as_glob_matcher(["*.py"]) is as_glob_matcher(["*.py"])
+    matcher = GlobMatcher(["*.py"])
+    assert as_glob_matcher(matcher) is matcher